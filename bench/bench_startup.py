@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# bench_startup.py - cold vs warm startup time of main.py
+# Cold: no markets_cache.json yet, so the market catalog is downloaded.
+# Warm: the catalog is read from the disk cache.
+# Each run is a fresh interpreter in a scratch directory (state files are cwd-relative).
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import statistics
+import subprocess
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STEPS = {
+    "import": "import main",
+    "first market data": "import main; main.get_public_exchange()",
+}
+
+
+def run_once(code, cwd):
+    env = dict(os.environ, PYTHONPATH=REPO + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    for name, code in STEPS.items():
+        cold, warm = [], []
+        for _ in range(args.runs):
+            workdir = tempfile.mkdtemp(prefix="bench_startup_")
+            try:
+                cold.append(run_once(code, workdir))
+                warm.append(run_once(code, workdir))
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+        print(f"{name:<18} cold {statistics.median(cold):6.2f}s   warm {statistics.median(warm):6.2f}s   (median of {args.runs})")
+
+
+if __name__ == "__main__":
+    main()
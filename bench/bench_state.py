@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# bench_state.py - trade-state contention under many simulated trades
+# Writer threads open and close virtual trades across many symbols while reader threads
+# render /open-style listings. "global" mode emulates the old design (one lock for all
+# symbols, held across a synchronous journal fsync); "sharded" is the current one
+# (per-symbol locks, copy-on-write snapshots, background journal writer).
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import threading
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))] if samples else float("nan")
+
+
+def run(mode, args):
+    import main
+
+    main.TG_CHAT_ID = None
+    main.tenants = main.TenantRegistry(path=f"tenants_{mode}.json")
+    main.tenants.owner().balance = {"currency": "USDT", "total": 1e12, "available": 1e12}
+    main.journal = main.TradeJournal(path=f"journal_{mode}.jsonl", compact_every=10 ** 9)
+    main.open_trades = main.TradeBook()
+    main.closed_trades = []
+    main.trade_snapshot = main.TradeSnapshot()
+    main.metrics = main.Metrics()
+    main.trade_locks = main.SymbolLocks()
+    if mode == "global":
+        shared = main.TimedLock(threading.RLock(), "trade_lock")
+        main.trade_locks = lambda symbol: shared
+        append = main.journal.append
+
+        def synchronous_append(op, trade):
+            append(op, trade)
+            main.journal.flush()
+        main.journal.append = synchronous_append
+
+    symbols = [f"SYM{i}/USDT" for i in range(args.symbols)]
+    # pre-load the book with resting trades that never trigger
+    for i in range(args.trades):
+        main.open_trade(symbols[i % len(symbols)], "LONG", 100.0, f"{i}m")
+    main.journal.flush()
+
+    stop = threading.Event()
+    ops = [0] * args.writers
+    read_latency = []
+
+    def writer(n):
+        i = 0
+        while not stop.is_set():
+            symbol = symbols[(n + i * args.writers) % len(symbols)]
+            trade = main.open_trade(symbol, "SHORT", 100.0, f"w{n}-{i}")
+            main.close_trade(trade, 99.0, "bench")
+            ops[n] += 2
+            i += 1
+
+    def reader():
+        while not stop.is_set():
+            started = time.perf_counter()
+            if mode == "global":
+                with main.trade_locks(None):
+                    rows = [t["id"] for t in main.open_trades]
+            else:
+                rows = [t["id"] for t in main.trade_snapshot.open_list()]
+            read_latency.append(time.perf_counter() - started)
+            assert rows
+            time.sleep(0.001)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(args.writers)]
+    threads += [threading.Thread(target=reader) for _ in range(args.readers)]
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    main.journal.flush()
+
+    wait = main.metrics.summary("trade_lock_wait_seconds")
+    print(f"{mode:<8} {sum(ops) / args.seconds:9.0f} writes/s   "
+          f"lock wait avg {wait[1] * 1e6:8.1f}µs max {wait[3] * 1e3:7.2f}ms   "
+          f"read p50 {percentile(read_latency, 0.5) * 1e3:6.2f}ms p99 {percentile(read_latency, 0.99) * 1e3:6.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--symbols", type=int, default=200)
+    parser.add_argument("--trades", type=int, default=2000, help="resting open trades")
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_state_")
+    sys.path.insert(0, REPO)
+    os.chdir(workdir)
+    try:
+        for mode in ("global", "sharded"):
+            run(mode, args)
+    finally:
+        os.chdir(REPO)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,18 +5,56 @@
 # Keys are embedded as requested (replace/remove later for safety).
 
 import os
+import sys
 import time
+import socket
+import hashlib
+import subprocess
+import argparse
+import importlib
+import itertools
+import asyncio
 import json
+import math
 import logging
 import threading
 from datetime import datetime
 import traceback
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from bisect import bisect_left, bisect_right
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing.connection import AuthenticationError, Client, Listener
 
-import pandas as pd
-import ccxt
 import requests
-from ta.momentum import RSIIndicator
-from ta.trend import SMAIndicator
+
+
+class LazyModule:
+    """
+    Stand-in for a heavy module: imports it on first attribute access and rebinds the
+    global name to the real module, so startup does not pay for pandas/ccxt/ta.
+    """
+    def __init__(self, name, alias):
+        self._name = name
+        self._alias = alias
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        globals()[self._alias] = module
+        return getattr(module, attr)
+
+
+np = LazyModule("numpy", "np")
+pd = LazyModule("pandas", "pd")
+ccxt = LazyModule("ccxt", "ccxt")
+ta_momentum = LazyModule("ta.momentum", "ta_momentum")
+ta_trend = LazyModule("ta.trend", "ta_trend")
+
+try:
+    import websockets
+except ImportError:  # streaming prices are optional; the monitor falls back to REST polling
+    websockets = None
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
@@ -44,9 +82,16 @@ API_URL = f"https://api.telegram.org/bot{TG_BOT_TOKEN}"
 SETTINGS_FILE = "settings.json"
 OPEN_TRADES_FILE = "open_trades.json"
 CLOSED_TRADES_FILE = "closed_trades.json"
-VIRTUAL_BALANCE_FILE = "virtual_balance.json"
-
-# Popular symbols (defaults)
+HISTORY_DIR = "history"
+MARKETS_CACHE_FILE = "markets_cache.json"
+MARKETS_CACHE_TTL = 6 * 3600  # seconds before the market catalog is downloaded again
+SYMBOL_MISS_TTL = 3600  # seconds before an unlisted symbol is looked up again
+VIRTUAL_BALANCE_FILE = "virtual_balance.json"  # pre-tenant balance, migrated into TENANTS_FILE
+TENANTS_FILE = "tenants.json"
+TRADES_JOURNAL_FILE = "trades_journal.jsonl"
+JOURNAL_COMPACT_EVERY = 500  # journal events between snapshot rewrites
+
+# Popular symbols (defaults for new tenants)
 SYMBOLS = [
     "BTC/USDT", "ETH/USDT", "SOL/USDT", "BNB/USDT", "XRP/USDT",
     "ADA/USDT", "DOGE/USDT", "AVAX/USDT", "MATIC/USDT", "LTC/USDT"
@@ -68,66 +113,589 @@ ACTIVE_TF = ["1m", "5m", "15m"]
 INVEST_AMOUNT = 20.0
 TRADE_MODE = "virtual"  # "virtual" or "real"
 LEVERAGE = 10
-CHECK_INTERVAL = 60  # seconds between signal checks
+CANDLE_CLOSE_DELAY = 2.0  # seconds after a candle close before it is evaluated (exchange latency)
+SCAN_WORKERS = 8  # parallel fetch + indicator workers per scan cycle
+# public market-data requests per second from this host (Bitget allows 20/s per IP); a leader
+# splits it with its local workers, which get their share through the environment
+PUBLIC_RATE_LIMIT = float(os.environ.get("BOT_PUBLIC_RATE_LIMIT", 15))
+CANDLE_CACHE_SIZE = 300  # candles kept per symbol/timeframe
+CANDLE_UPDATE_LIMIT = 10  # candles requested by a routine incremental update
+RESAMPLE_FROM_BASE = False  # fetch only BASE_TIMEFRAME and derive higher timeframes locally
+BASE_TIMEFRAME = "1m"
+RESAMPLE_VERIFY_EVERY = 60  # derived updates between checks against exchange candles
+RESAMPLE_TOLERANCE = 1e-6  # relative difference allowed between derived and exchange candles
+
+# Telegram notification queue
+NOTIFY_MAX_QUEUE = 500  # oldest messages are dropped beyond this
+NOTIFY_COALESCE_WINDOW = 0.5  # seconds to gather a burst into one message
+
+# Streaming prices for open trades
+WS_PUBLIC_URL = "wss://ws.bitget.com/v2/ws/public"
+WS_INST_TYPE = "USDT-FUTURES"
+WS_PING_INTERVAL = 25  # Bitget drops connections without a "ping" every 30s
+WS_MAX_PRICE_AGE = 10  # seconds before a streamed price is considered stale
+EXIT_WORKERS = 4  # threads closing trades triggered by streamed prices
+ORDER_WORKERS = 8  # real orders placed in parallel (one symbol's orders stay sequential)
+ORDER_RETRIES = 2  # resends of an order whose ack was lost, same client order id
+EXCHANGE_SL_TP = False  # real trades: attach SL/TP to the entry order as exchange trigger orders
+RECONCILE_INTERVAL = 5.0  # seconds between position reconciliation passes (one fetch_positions each)
+RECONCILE_ADOPT = False  # book exchange positions no trade accounts for as (monitor-only) owner trades
+RECONCILE_SIZE_TOLERANCE = 0.01  # relative position size difference reported as a divergence
+EXIT_SAME_BAR_POLICY = "sl_first"  # SL and TP both inside one candle: "sl_first", "tp_first" or "nearest_open"
+TICKER_SNAPSHOT_TTL = 4.0  # seconds a bulk ticker snapshot serves the monitor and scanner
+FORCE_CHECK_PROGRESS_INTERVAL = 2.0  # seconds between /force_check progress edits
+
+# Sharded mode: `main.py bot --workers N` starts local workers; `main.py worker --connect ADDR`
+# joins from any host. Workers only fetch and compute; the leader owns Telegram, state and orders.
+CLUSTER_ROLE = os.environ.get("BOT_ROLE", "leader")  # "worker" processes never load or write trade state
+CLUSTER_ADDRESS = os.environ.get("BOT_CLUSTER_ADDRESS", "cluster.sock")  # Unix socket path or host:port
+CLUSTER_VNODES = 64  # ring points per worker
+
+# Metrics (Prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics; None disables)
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# ---------------- Metrics ----------------
+class Metrics:
+    """
+    Process-wide counters and latency histograms for the hot paths, readable as
+    Prometheus text (the metrics endpoint) or as a short summary (/stats).
+    """
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counters = {}
+        self.histograms = {}  # name -> [bucket counts..., +Inf count, sum, max]
+        self.gauges = {}  # name -> zero-argument callable
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self.lock:
+            h = self.histograms.get(name)
+            if h is None:
+                h = self.histograms[name] = [0] * (len(self.buckets) + 1) + [0.0, 0.0]
+            h[bisect_left(self.buckets, seconds)] += 1
+            h[-2] += seconds
+            h[-1] = max(h[-1], seconds)
+
+    def gauge(self, name, fn):
+        self.gauges[name] = fn
+
+    @contextmanager
+    def timer(self, name, errors=None):
+        """
+        Observe the block's duration in histogram `name`; count exceptions in `errors`.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            if errors:
+                self.inc(errors)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def summary(self, name):
+        """
+        (count, avg, p95 upper bound, max) of a histogram, or None if it has no samples.
+        """
+        with self.lock:
+            h = list(self.histograms.get(name) or [])
+        count = sum(h[:-2]) if h else 0
+        if not count:
+            return None
+        seen = 0
+        p95 = float("inf")
+        for bound, n in zip(self.buckets, h):
+            seen += n
+            if seen >= 0.95 * count:
+                p95 = bound
+                break
+        return count, h[-2] / count, p95, h[-1]
+
+    def render(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {k: list(v) for k, v in self.histograms.items()}
+        lines = []
+        for name, value in sorted(counters.items()):
+            lines += [f"# TYPE bot_{name} counter", f"bot_{name} {value}"]
+        for name, fn in sorted(self.gauges.items()):
+            try:
+                value = fn()
+            except Exception:
+                continue
+            lines += [f"# TYPE bot_{name} gauge", f"bot_{name} {value}"]
+        for name, h in sorted(histograms.items()):
+            lines.append(f"# TYPE bot_{name} histogram")
+            cumulative = 0
+            for bound, n in zip(self.buckets + ("+Inf",), h):
+                cumulative += n
+                lines.append(f'bot_{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines += [f"bot_{name}_sum {h[-2]}", f"bot_{name}_count {cumulative}"]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class TimedLock:
+    """
+    Lock wrapper recording how long callers wait to acquire it (histogram `<name>_wait_seconds`).
+    """
+    def __init__(self, lock, name):
+        self.lock = lock
+        self.name = name + "_wait_seconds"
+
+    def acquire(self, blocking=True, timeout=-1):
+        started = time.perf_counter()
+        acquired = self.lock.acquire(blocking, timeout)
+        metrics.observe(self.name, time.perf_counter() - started)
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """
+    Serve /metrics from a daemon thread. Returns the server, or None when disabled.
+    """
+    if port is None:
+        return None
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Metrics on http://{host}:{server.server_port}/metrics")
+    return server
+
+
+# ---------------- Trade book ----------------
+class SortedLevels:
+    """
+    Trade ids kept sorted by a price level, for range queries against a new price.
+    """
+    def __init__(self):
+        self.keys = []
+        self.ids = []
+
+    def add(self, level, trade_id):
+        i = bisect_right(self.keys, level)
+        self.keys.insert(i, level)
+        self.ids.insert(i, trade_id)
+
+    def remove(self, level, trade_id):
+        i = bisect_left(self.keys, level)
+        while i < len(self.keys) and self.keys[i] == level:
+            if self.ids[i] == trade_id:
+                del self.keys[i]
+                del self.ids[i]
+                return
+            i += 1
+
+    def at_or_below(self, price):
+        return self.ids[:bisect_right(self.keys, price)]
+
+    def at_or_above(self, price):
+        return self.ids[bisect_left(self.keys, price):]
+
+
+class TradeBook:
+    """
+    Open trades indexed by id, by symbol and by (symbol, timeframe), with per-symbol
+    SL/TP trigger indexes so a price update only touches the trades it actually crosses.
+    Iterates in opening order, like the plain list it replaces.
+    Writers hold the trade's symbol lock (trade_locks): a change only touches that symbol's
+    entries plus single-key operations on the shared dicts, so symbols never contend.
+    """
+    def __init__(self, trades=()):
+        self.by_id = {}
+        self.by_symbol = {}
+        self.by_pair = {}
+        self.levels = {}
+        for trade in trades:
+            self.add(trade)
+
+    def __iter__(self):
+        return iter(list(self.by_id.values()))
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __contains__(self, trade_id):
+        return trade_id in self.by_id
+
+    def _symbol_levels(self, symbol):
+        if symbol not in self.levels:
+            self.levels[symbol] = {k: SortedLevels() for k in ("long_sl", "long_tp", "short_sl", "short_tp")}
+        return self.levels[symbol]
+
+    def add(self, trade):
+        tid, symbol = trade["id"], trade["symbol"]
+        # re-adding an id replaces the old entry, including its trigger levels
+        self.remove(tid)
+        self.by_id[tid] = trade
+        self.by_symbol.setdefault(symbol, {})[tid] = trade
+        self.by_pair.setdefault((trade.get("tenant"), symbol, trade.get("timeframe")), {})[tid] = trade
+        if trade.get("exchange_exits"):
+            return  # the exchange holds its SL/TP; no client-side triggers
+        side = "long" if trade["direction"] == "LONG" else "short"
+        levels = self._symbol_levels(symbol)
+        levels[f"{side}_sl"].add(trade["sl_price"], tid)
+        levels[f"{side}_tp"].add(trade["tp_price"], tid)
+
+    def remove(self, trade_id):
+        trade = self.by_id.pop(trade_id, None)
+        if trade is None:
+            return None
+        symbol = trade["symbol"]
+        pair = (trade.get("tenant"), symbol, trade.get("timeframe"))
+        for index, key in ((self.by_symbol, symbol), (self.by_pair, pair)):
+            index[key].pop(trade_id, None)
+            if not index[key]:
+                del index[key]
+        if not trade.get("exchange_exits"):
+            side = "long" if trade["direction"] == "LONG" else "short"
+            levels = self.levels[symbol]
+            levels[f"{side}_sl"].remove(trade["sl_price"], trade_id)
+            levels[f"{side}_tp"].remove(trade["tp_price"], trade_id)
+        if symbol not in self.by_symbol:
+            self.levels.pop(symbol, None)
+        return trade
+
+    def get(self, trade_id):
+        return self.by_id.get(trade_id)
+
+    def for_symbol(self, symbol):
+        return list(self.by_symbol.get(symbol, {}).values())
+
+    def has_pair(self, symbol, timeframe, tenant=None):
+        return bool(self.by_pair.get((tenant, symbol, timeframe)))
+
+    def symbols(self):
+        return list(self.by_symbol)
+
+    def triggered(self, symbol, price):
+        """
+        Return [(trade, reason)] for the trades on symbol whose SL or TP is crossed by price.
+        SL wins if both are somehow crossed, as in the per-trade check.
+        """
+        levels = self.levels.get(symbol)
+        if not levels:
+            return []
+        hits = {}
+        for tid in levels["long_sl"].at_or_above(price) + levels["short_sl"].at_or_below(price):
+            hits[tid] = "Hit SL"
+        for tid in levels["long_tp"].at_or_below(price) + levels["short_tp"].at_or_above(price):
+            hits.setdefault(tid, "Hit TP")
+        return [(self.by_id[tid], reason) for tid, reason in hits.items()]
+
+    def to_list(self):
+        return list(self.by_id.values())
+
+
+class SymbolLocks:
+    """
+    One writer lock per symbol for the trade state, so opening or closing a trade on one
+    symbol never waits for another. Readers use trade_snapshot and take no lock at all.
+    """
+    def __init__(self):
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, symbol):
+        with self.lock:
+            lock = self.locks.get(symbol)
+            if lock is None:
+                lock = self.locks[symbol] = TimedLock(threading.RLock(), "trade_lock")
+            return lock
+
+
+def trade_opened_ms(trade):
+    if trade.get("opened_ms") is not None:
+        return int(trade["opened_ms"])
+    try:  # records written before opened_ms existed
+        return int((datetime.strptime(trade["opened_at"], "%Y-%m-%d %H:%M:%S") - datetime(1970, 1, 1)).total_seconds() * 1000)
+    except (KeyError, TypeError, ValueError):
+        return 0
+
+
+class TriggerColumns:
+    """
+    Open trades as NumPy columns (symbol index, side, SL, TP, open time) so the monitor
+    checks every position against vectors of prices and candle ranges in one pass.
+    Built once per TradeSnapshot.
+    """
+    def __init__(self, trades):
+        self.symbols = sorted({t["symbol"] for t in trades})
+        index = {s: i for i, s in enumerate(self.symbols)}
+        n = len(trades)
+        self.ids = [t["id"] for t in trades]
+        self.trade_symbols = [t["symbol"] for t in trades]
+        self.symbol_idx = np.fromiter((index[t["symbol"]] for t in trades), dtype=np.intp, count=n)
+        self.long = np.fromiter((t["direction"] == "LONG" for t in trades), dtype=bool, count=n)
+        self.sl = np.fromiter((t["sl_price"] for t in trades), dtype=np.float64, count=n)
+        self.tp = np.fromiter((t["tp_price"] for t in trades), dtype=np.float64, count=n)
+        self.opened_ms = np.fromiter((trade_opened_ms(t) for t in trades), dtype=np.float64, count=n)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def triggered(self, prices, ranges=None, policy=None):
+        """
+        [(trade_id, symbol, reason, exit_price)] for the trades whose SL or TP was crossed.
+        prices: {symbol: last price}; ranges: {symbol: (start_ms, open, high, low)} of the
+        candles since the last check (see ExitRanges), applied to trades opened before
+        start_ms. When one range crosses both levels, `policy` (EXIT_SAME_BAR_POLICY) decides
+        which came first. Exits fill at the level, or at the open if it gapped through.
+        """
+        if not self.ids:
+            return []
+        policy = policy or EXIT_SAME_BAR_POLICY
+        ranges = ranges or {}
+        last = np.array([prices.get(s, np.nan) for s in self.symbols], dtype=np.float64)
+        bars = np.array([ranges.get(s, (np.inf, np.nan, np.nan, np.nan)) for s in self.symbols], dtype=np.float64).reshape(-1, 4)
+        price = last[self.symbol_idx]
+        use_range = self.opened_ms <= bars[self.symbol_idx, 0]
+        high = np.where(use_range, np.fmax(price, bars[self.symbol_idx, 2]), price)
+        low = np.where(use_range, np.fmin(price, bars[self.symbol_idx, 3]), price)
+        first = np.where(use_range & ~np.isnan(bars[self.symbol_idx, 1]), bars[self.symbol_idx, 1], price)
+        with np.errstate(invalid="ignore"):  # NaN prices compare False
+            sl_hit = np.where(self.long, low <= self.sl, high >= self.sl)
+            tp_hit = np.where(self.long, high >= self.tp, low <= self.tp)
+            both = sl_hit & tp_hit
+            if policy == "tp_first":
+                sl_first = np.zeros_like(both)
+            elif policy == "nearest_open":
+                sl_first = ~(np.abs(first - self.tp) < np.abs(first - self.sl))
+            else:
+                sl_first = np.ones_like(both)
+            sl_hit &= ~both | sl_first
+            tp_hit &= ~both | ~sl_first
+            # a move that opened beyond the level fills at the open, like a stop order would
+            sl_gap = np.where(self.long, first <= self.sl, first >= self.sl)
+            tp_gap = np.where(self.long, first >= self.tp, first <= self.tp)
+        sl_fill = np.where(sl_gap, first, self.sl)
+        tp_fill = np.where(tp_gap, first, self.tp)
+        return ([(self.ids[i], self.trade_symbols[i], "Hit SL", float(sl_fill[i])) for i in np.flatnonzero(sl_hit)]
+                + [(self.ids[i], self.trade_symbols[i], "Hit TP", float(tp_fill[i])) for i in np.flatnonzero(tp_hit)])
+
+
+class TradeSnapshot:
+    """
+    Immutable view of the trade state, republished (copy-on-write) after every change.
+    Open trades are copied per symbol, so a change only re-copies its own symbol; closed
+    trades are an append-only list, so a snapshot just records how many it covers.
+    """
+    __slots__ = ("open_by_symbol", "closed", "closed_count", "_open_list", "_columns")
+
+    def __init__(self, open_by_symbol=None, closed=(), closed_count=0):
+        self.open_by_symbol = open_by_symbol or {}
+        self.closed = closed
+        self.closed_count = closed_count
+        self._open_list = None
+        self._columns = None
+
+    @property
+    def open_count(self):
+        return sum(len(trades) for trades in self.open_by_symbol.values())
+
+    def symbols(self):
+        return list(self.open_by_symbol)
+
+    def open_list(self):
+        if self._open_list is None:
+            trades = [t for group in self.open_by_symbol.values() for t in group]
+            self._open_list = sorted(trades, key=lambda t: (t.get("opened_at") or "", t["id"]))
+        return list(self._open_list)
+
+    def columns(self):
+        """
+        Trigger columns of the trades the monitor prices itself (not the exchange-protected ones).
+        """
+        if self._columns is None:
+            self._columns = TriggerColumns([t for t in self.open_list() if not t.get("exchange_exits")])
+        return self._columns
+
+    def closed_list(self, last=None, tenant=None):
+        if tenant is None:
+            start = 0 if last is None else max(0, self.closed_count - last)
+            return list(self.closed[start:self.closed_count])
+        out = []
+        for i in range(self.closed_count - 1, -1, -1):
+            if self.closed[i].get("tenant") == tenant:
+                out.append(self.closed[i])
+                if last is not None and len(out) >= last:
+                    break
+        return out[::-1]
+
 
 # in-memory state
-open_trades = []
+open_trades = TradeBook()
 closed_trades = []
-state_lock = threading.Lock()
+trade_locks = SymbolLocks()
+trade_snapshot = TradeSnapshot()
+_publish_lock = threading.Lock()
+metrics.gauge("open_trades", lambda: trade_snapshot.open_count)
+
 
-# last chat id if not provided
-_last_chat_id = None
+def publish_trades(symbol=None):
+    """
+    Republish trade_snapshot after a change to `symbol` (everything when None).
+    The caller holds the symbol's lock, so its trades are stable while they are copied.
+    """
+    global trade_snapshot
+    with _publish_lock:
+        if symbol is None:
+            symbols, open_by_symbol = open_trades.symbols(), {}
+        else:
+            symbols, open_by_symbol = [symbol], dict(trade_snapshot.open_by_symbol)
+        for s in symbols:
+            trades = tuple(dict(t) for t in open_trades.for_symbol(s))
+            if trades:
+                open_by_symbol[s] = trades
+            else:
+                open_by_symbol.pop(s, None)
+        trade_snapshot = TradeSnapshot(open_by_symbol, closed_trades, len(closed_trades))
 
 # ---------------- Exchange (Bitget swap) ----------------
-# We'll create two ccxt instances:
+# We'll create two ccxt instances, lazily on first use:
 # - public_exchange : without keys, used to fetch market data even in virtual mode
 # - private_exchange: with keys, used to place real orders (if keys exist)
+# Both share one market catalog, cached on disk for MARKETS_CACHE_TTL seconds.
 public_exchange = None
 private_exchange = None
+_private_failed_at = None
+_markets = None
+_exchange_lock = threading.RLock()
+
+
+def load_market_metadata(exchange):
+    """
+    Give the client the shared market catalog: from memory, from the disk cache if fresh,
+    otherwise from one download that is then cached.
+    """
+    global _markets
+    with _exchange_lock:
+        if _markets is not None and time.time() - _markets.get("saved_at", 0) >= MARKETS_CACHE_TTL:
+            _markets = None
+        if _markets is None:
+            cached = load_json(MARKETS_CACHE_FILE, None)
+            if cached and time.time() - cached.get("saved_at", 0) < MARKETS_CACHE_TTL:
+                _markets = cached
+            else:
+                exchange.load_markets()
+                _markets = {"saved_at": time.time(), "markets": exchange.markets, "currencies": exchange.currencies}
+                save_json(MARKETS_CACHE_FILE, _markets)
+                return
+        exchange.set_markets(_markets["markets"], _markets.get("currencies"))
+
+
+def get_public_exchange():
+    global public_exchange
+    with _exchange_lock:
+        if public_exchange is None:
+            try:
+                exchange = ccxt.bitget({
+                    "enableRateLimit": True,
+                    "options": {"defaultType": "swap"},
+                })
+                try:
+                    load_market_metadata(exchange)
+                except Exception as e:
+                    logging.error(f"Market metadata load error: {e}")
+                public_exchange = exchange
+                logging.info("Public Bitget client initialized.")
+            except Exception as e:
+                logging.error(f"Public exchange init error: {e}")
+        return public_exchange
+
+
+def get_private_exchange():
+    """
+    Private client, or None if keys are missing or init failed (retried after a minute).
+    """
+    global private_exchange, _private_failed_at
+    if not (BITGET_API_KEY and BITGET_API_SECRET):
+        return None
+    with _exchange_lock:
+        if private_exchange is None and (_private_failed_at is None or time.time() - _private_failed_at > 60):
+            try:
+                exchange = ccxt.bitget({
+                    "apiKey": BITGET_API_KEY,
+                    "secret": BITGET_API_SECRET,
+                    "password": BITGET_API_PASSPHRASE,
+                    "enableRateLimit": True,
+                    "options": {"defaultType": "swap"},
+                })
+                load_market_metadata(exchange)
+                private_exchange = exchange
+                _private_failed_at = None
+                logging.info("Private Bitget client initialized.")
+            except Exception as e:
+                _private_failed_at = time.time()
+                logging.error(f"Private exchange init error: {e}")
+        return private_exchange
 
 
 def init_exchanges():
-    global public_exchange, private_exchange
-    try:
-        public_exchange = ccxt.bitget({
-            "enableRateLimit": True,
-            "options": {"defaultType": "swap"},
-        })
-        try:
-            public_exchange.load_markets()
-        except Exception:
-            pass
-        logging.info("Public Bitget client initialized.")
-    except Exception as e:
+    """
+    Drop both clients; they are recreated (from cached markets) on next use.
+    A catalog older than MARKETS_CACHE_TTL is dropped too, so it is downloaded again.
+    """
+    global public_exchange, private_exchange, _private_failed_at, _markets
+    with _exchange_lock:
+        if _markets is not None and time.time() - _markets.get("saved_at", 0) >= MARKETS_CACHE_TTL:
+            _markets = None
         public_exchange = None
-        logging.error(f"Public exchange init error: {e}")
-
-    if BITGET_API_KEY and BITGET_API_SECRET:
-        try:
-            private_exchange = ccxt.bitget({
-                "apiKey": BITGET_API_KEY,
-                "secret": BITGET_API_SECRET,
-                "password": BITGET_API_PASSPHRASE,
-                "enableRateLimit": True,
-                "options": {"defaultType": "swap"},
-            })
-            private_exchange.load_markets()
-            logging.info("Private Bitget client initialized.")
-        except Exception as e:
-            private_exchange = None
-            logging.error(f"Private exchange init error: {e}")
-    else:
         private_exchange = None
+        _private_failed_at = None
+    # leverage may have been changed on the account meanwhile
+    order_executor.leverage.clear()
+    if not (BITGET_API_KEY and BITGET_API_SECRET):
         logging.info("Private keys not provided; no private client.")
 
 
-init_exchanges()
-
 # ---------------- Storage helpers ----------------
 def save_json(path, data):
+    """
+    Write JSON atomically: a crash leaves either the old file or the new one, never half of it.
+    """
+    tmp = f"{path}.tmp"
     try:
-        with open(path, "w", encoding="utf-8") as f:
+        with open(tmp, "w", encoding="utf-8") as f:
             json.dump(data, f, indent=2, default=str, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
     except Exception as e:
         logging.error(f"Error saving {path}: {e}")
 
@@ -142,437 +710,2607 @@ def load_json(path, default):
     return default
 
 
-def save_state():
-    with state_lock:
-        save_json(OPEN_TRADES_FILE, open_trades)
-        save_json(CLOSED_TRADES_FILE, closed_trades)
+# ---------------- Trade journal ----------------
+class TradeJournal:
+    """
+    Append-only log of trade open/close events on top of the JSON snapshots.
+    Events are queued by the trading threads and written by a persistence thread, which
+    fsyncs each batch once, so neither trading nor bot commands ever wait on the disk.
+    The same thread writes other small state files (save_json_later), keeping only the
+    latest pending version of each.
+    Every JOURNAL_COMPACT_EVERY events the snapshots are rewritten from trade_snapshot and
+    the journal truncated. Replay is idempotent, so an event that lands in both a snapshot
+    and the journal is applied once.
+    """
+    def __init__(self, path=TRADES_JOURNAL_FILE, compact_every=JOURNAL_COMPACT_EVERY):
+        self.path = path
+        self.compact_every = compact_every
+        self.lock = threading.Lock()  # file and compaction
+        self.cond = threading.Condition()  # pending queue
+        self.pending = deque()
+        self.pending_files = {}  # path -> latest data
+        self.queued = 0
+        self.written = 0
+        self.thread = None
+        self.file = None
+        self.events = 0
+
+    def _ensure_started(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def append(self, op, trade):
+        """
+        Queue an event for the persistence thread; returns without touching the disk.
+        """
+        line = json.dumps({"op": op, "trade": trade}, default=str, ensure_ascii=False)
+        with self.cond:
+            self._ensure_started()
+            self.pending.append(line)
+            self.queued += 1
+            self.cond.notify_all()
+
+    def save_json_later(self, path, data):
+        """
+        Queue an atomic save_json of `data` (pass a copy); a newer save of the same path
+        replaces a pending one.
+        """
+        with self.cond:
+            self._ensure_started()
+            if path in self.pending_files:
+                self.written += 1  # the superseded version never needs writing
+            self.pending_files[path] = data
+            self.queued += 1
+            self.cond.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Wait until every event queued so far has been written. Returns False on timeout.
+        """
+        with self.cond:
+            target = self.queued
+            return self.cond.wait_for(lambda: self.written >= target, timeout)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.pending_files:
+                    self.cond.wait()
+                lines = list(self.pending)
+                self.pending.clear()
+                files, self.pending_files = self.pending_files, {}
+            if lines:
+                self._write(lines)
+            for path, data in files.items():
+                save_json(path, data)
+            with self.cond:
+                self.written += len(lines) + len(files)
+                self.cond.notify_all()
+
+    def _write(self, lines):
+        with self.lock, metrics.timer("journal_write_seconds"):
+            try:
+                if self.file is None:
+                    self.file = open(self.path, "a", encoding="utf-8")
+                self.file.write("".join(line + "\n" for line in lines))
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.events += len(lines)
+            except Exception as e:
+                logging.error(f"Error writing journal {self.path}: {e}")
+                return
+            if self.events >= self.compact_every:
+                self._compact()
+
+    def compact(self):
+        self.flush()
+        with self.lock:
+            self._compact()
+
+    def _compact(self):
+        # every written event was queued after its change was published, so the snapshot covers it
+        snap = trade_snapshot
+        save_json(OPEN_TRADES_FILE, snap.open_list())
+        save_json(CLOSED_TRADES_FILE, snap.closed_list())
+        try:
+            if self.file is not None:
+                self.file.close()
+            self.file = open(self.path, "w", encoding="utf-8")
+            os.fsync(self.file.fileno())
+            self.events = 0
+        except Exception as e:
+            self.file = None
+            logging.error(f"Error truncating journal {self.path}: {e}")
+
+    def replay(self, book, closed):
+        """
+        Apply journal events to a trade book and closed-trade list loaded from the snapshots.
+        A torn last line (crash mid-append) is cut off so the next append starts on a fresh line.
+        Returns the number of events applied.
+        """
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, "rb") as f:
+            data = f.read()
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            logging.error(f"Dropping torn write at the end of {self.path} ({len(data) - complete} bytes)")
+            with open(self.path, "r+b") as f:
+                f.truncate(complete)
+                os.fsync(f.fileno())
+        closed_ids = {t.get("id") for t in closed}
+        applied = 0
+        for line in data[:complete].decode("utf-8", errors="replace").splitlines():
+            if not line.strip():
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                logging.error(f"Skipping unreadable journal line in {self.path}")
+                continue
+            trade = event.get("trade") or {}
+            tid = trade.get("id")
+            if event.get("op") == "open" and tid not in closed_ids:
+                book.remove(tid)
+                book.add(trade)
+            elif event.get("op") == "close":
+                book.remove(tid)
+                if tid not in closed_ids:
+                    closed.append(trade)
+                    closed_ids.add(tid)
+            applied += 1
+        self.events = applied
+        return applied
 
 
 def load_state():
+    """
+    Rebuild the trade state from the snapshots and the journal, then compact it. Runs in
+    main() before any trading thread, so the offline commands and workers never touch it.
+    Real trades are then checked against the exchange's positions by the reconciler's
+    startup pass.
+    """
     global open_trades, closed_trades
-    with state_lock:
-        open_trades = load_json(OPEN_TRADES_FILE, [])
-        closed_trades = load_json(CLOSED_TRADES_FILE, [])
+    book = TradeBook(load_json(OPEN_TRADES_FILE, []))
+    closed = load_json(CLOSED_TRADES_FILE, [])
+    replayed = journal.replay(book, closed)
+    # trades from before tenants existed belong to the owner
+    for trade in [t for t in book if "tenant" not in t]:
+        book.remove(trade["id"])
+        trade["tenant"] = tenant_key(TG_CHAT_ID)
+        book.add(trade)
+    for trade in closed:
+        trade.setdefault("tenant", tenant_key(TG_CHAT_ID))
+    open_trades, closed_trades = book, closed
+    publish_trades()
+    if os.path.exists(journal.path) and os.path.getsize(journal.path) > 0:
+        logging.info(f"Replayed {replayed} journal events; compacting.")
+        journal.compact()
+
+
+journal = TradeJournal()
+
+
+def save_settings():
+    """
+    Process-wide settings. Per-chat trading settings live in the tenant registry.
+    """
+    try:
+        save_json(SETTINGS_FILE, {"RESAMPLE_FROM_BASE": RESAMPLE_FROM_BASE})
+    except Exception as e:
+        logging.error(f"Error saving settings: {e}")
+
+
+def load_settings():
+    data = load_json(SETTINGS_FILE, {})
+    globals()['RESAMPLE_FROM_BASE'] = bool(data.get("RESAMPLE_FROM_BASE", RESAMPLE_FROM_BASE))
+
+
+# ---------------- Tenants ----------------
+DEFAULT_VIRTUAL_BALANCE = {"currency": "USDT", "total": 1000.0, "available": 1000.0}
+
+
+def tenant_key(chat_id):
+    # the owner may run without a configured chat; "" then stands for it (and disables messages)
+    return "" if chat_id is None else str(chat_id)
+
+
+class Tenant:
+    """
+    One Telegram chat's trading setup: symbols, timeframes, size, leverage, mode and its own
+    virtual balance. Market data and indicators are shared; only trades are per tenant.
+    """
+    def __init__(self, chat_id, symbols=None, active_tf=None, invest_amount=INVEST_AMOUNT, leverage=LEVERAGE,
+                 trade_mode="virtual", balance=None):
+        self.chat_id = tenant_key(chat_id)
+        self.symbols = list(SYMBOLS if symbols is None else symbols)
+        self.active_tf = list(ACTIVE_TF if active_tf is None else active_tf)
+        self.invest_amount = float(invest_amount)
+        self.leverage = int(leverage)
+        self.trade_mode = trade_mode if trade_mode in ("virtual", "real") else "virtual"
+        self.balance = dict(DEFAULT_VIRTUAL_BALANCE)
+        self.balance.update(balance or {})
+        self.balance.setdefault("available", self.balance["total"])
+        self.lock = threading.Lock()  # balance
+
+    @property
+    def is_owner(self):
+        # the exchange keys belong to the configured chat, so only it may trade for real
+        return self.chat_id == tenant_key(TG_CHAT_ID)
+
+    def to_dict(self):
+        with self.lock:
+            balance = dict(self.balance)
+        return {"symbols": list(self.symbols), "active_tf": list(self.active_tf), "invest_amount": self.invest_amount,
+                "leverage": self.leverage, "trade_mode": self.trade_mode, "balance": balance}
+
+    def reserve(self, amount_usd):
+        with self.lock:
+            if self.balance["available"] >= amount_usd:
+                self.balance["available"] = round(self.balance["available"] - amount_usd, 8)
+                return True
+            return False
+
+    def release(self, amount_usd):
+        with self.lock:
+            self.balance["available"] = round(self.balance["available"] + amount_usd, 8)
+            self.balance["total"] = round(self.balance["total"] + amount_usd, 8)
+
+
+class TenantRegistry:
+    """
+    Every chat using the bot, persisted in TENANTS_FILE through the journal's persistence
+    thread. The scanner asks it which (symbol, timeframe) pairs anyone follows, so each pair
+    is fetched and computed once however many tenants follow it.
+    """
+    def __init__(self, path=TENANTS_FILE):
+        self.path = path
+        self.tenants = {}
+        self.lock = threading.Lock()
+        self.subscriptions = None  # (symbol, tf) -> [Tenant], rebuilt after a change
+
+    def load(self):
+        data = load_json(self.path, None)
+        if data is None:
+            data = self._migrate()
+        with self.lock:
+            self.tenants = {key: self._from_dict(key, d) for key, d in data.items()}
+            self.subscriptions = None
+
+    @staticmethod
+    def _from_dict(key, d):
+        return Tenant(key, symbols=d.get("symbols"), active_tf=d.get("active_tf"),
+                      invest_amount=d.get("invest_amount", INVEST_AMOUNT), leverage=d.get("leverage", LEVERAGE),
+                      trade_mode=d.get("trade_mode", "virtual"), balance=d.get("balance"))
+
+    def _migrate(self):
+        # single-user settings and balance become the owner's tenant
+        legacy = load_json(SETTINGS_FILE, {})
+        return {tenant_key(TG_CHAT_ID): {
+            "symbols": legacy.get("SYMBOLS", SYMBOLS),
+            "active_tf": legacy.get("ACTIVE_TF", ACTIVE_TF),
+            "invest_amount": legacy.get("INVEST_AMOUNT", INVEST_AMOUNT),
+            "leverage": legacy.get("LEVERAGE", LEVERAGE),
+            "trade_mode": legacy.get("TRADE_MODE", TRADE_MODE),
+            "balance": load_json(VIRTUAL_BALANCE_FILE, None),
+        }}
+
+    def save(self):
+        journal.save_json_later(self.path, {t.chat_id: t.to_dict() for t in self.all()})
+
+    def get(self, chat_id, create=False):
+        key = tenant_key(chat_id)
+        created = False
+        with self.lock:
+            tenant = self.tenants.get(key)
+            if tenant is None and create:
+                tenant = self.tenants[key] = Tenant(key)
+                self.subscriptions = None
+                created = True
+        if created:
+            self.save()
+        return tenant
+
+    def owner(self):
+        return self.get(TG_CHAT_ID, create=True)
+
+    def all(self):
+        with self.lock:
+            return list(self.tenants.values())
+
+    def changed(self):
+        """
+        Call after editing a tenant's settings: persists them and refreshes the subscriptions.
+        """
+        with self.lock:
+            self.subscriptions = None
+        self.save()
+
+    def _subscriptions(self):
+        with self.lock:
+            if self.subscriptions is None:
+                subs = {}
+                for tenant in self.tenants.values():
+                    for symbol in tenant.symbols:
+                        for tf in tenant.active_tf:
+                            subs.setdefault((symbol, tf), []).append(tenant)
+                self.subscriptions = subs
+            return self.subscriptions
+
+    def subscribed(self, symbol, timeframe):
+        return list(self._subscriptions().get((symbol, timeframe), ()))
+
+    def following(self, symbol):
+        return any(symbol in t.symbols for t in self.all())
+
+    def pairs(self, timeframes=None):
+        return sorted(p for p in self._subscriptions() if timeframes is None or p[1] in timeframes)
+
+    def active_timeframes(self):
+        return sorted({tf for _, tf in self._subscriptions()}, key=timeframe_ms)
+
+
+tenants = TenantRegistry()
+metrics.gauge("tenants", lambda: len(tenants.tenants))
+
+load_settings()
+tenants.load()
+
+# ---------------- Telegram helpers ----------------
+class TelegramNotifier:
+    """
+    Background delivery queue for bot messages sent from trading threads.
+    Enqueueing never blocks on the network: a daemon thread drains the queue over a pooled
+    HTTP session, merges bursts for the same chat into one message, honours Telegram's
+    429 retry_after, and drops the oldest messages once NOTIFY_MAX_QUEUE is reached.
+    """
+    MAX_TEXT = 4096  # Telegram message length limit
+
+    def __init__(self, api_url=API_URL, max_queue=NOTIFY_MAX_QUEUE, coalesce_window=NOTIFY_COALESCE_WINDOW):
+        self.api_url = api_url
+        self.max_queue = max_queue
+        self.coalesce_window = coalesce_window
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.session = None
+        self.thread = None
+        self.stats = {
+            "enqueued": 0, "sent": 0, "coalesced": 0, "dropped": 0, "failed": 0, "rate_limited": 0,
+            "enqueue_us_max": 0.0, "enqueue_us_total": 0.0,
+            "lag_max": 0.0, "lag_total": 0.0, "lag_samples": 0,
+        }
+
+    def _ensure_started(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.session = requests.Session()
+            self.session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=2))
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def enqueue(self, chat_id, text, reply_markup=None):
+        started = time.perf_counter()
+        with self.cond:
+            self._ensure_started()
+            if len(self.queue) >= self.max_queue:
+                self.queue.popleft()
+                self.stats["dropped"] += 1
+            self.queue.append((chat_id, text, reply_markup, time.monotonic()))
+            self.stats["enqueued"] += 1
+            self.cond.notify()
+        elapsed_us = (time.perf_counter() - started) * 1e6
+        self.stats["enqueue_us_total"] += elapsed_us
+        self.stats["enqueue_us_max"] = max(self.stats["enqueue_us_max"], elapsed_us)
+
+    def _batch(self, items):
+        """
+        Merge consecutive plain messages for the same chat, keeping order and the length limit.
+        Returns [(chat_id, text, reply_markup, oldest_enqueue_time)].
+        """
+        out = []
+        for chat_id, text, markup, queued_at in items:
+            last = out[-1] if out else None
+            if (last and not markup and not last[2] and last[0] == chat_id
+                    and len(last[1]) + len(text) + 2 <= self.MAX_TEXT):
+                out[-1] = (chat_id, last[1] + "\n\n" + text, None, last[3])
+                self.stats["coalesced"] += 1
+            else:
+                out.append((chat_id, text, markup, queued_at))
+        return out
+
+    def _deliver(self, chat_id, text, reply_markup=None):
+        payload = {"chat_id": chat_id, "text": text, "parse_mode": "HTML"}
+        if reply_markup:
+            payload["reply_markup"] = json.loads(json.dumps(reply_markup))  # ensure serializable
+        for attempt in range(5):
+            try:
+                with metrics.timer("telegram_send_seconds", errors="telegram_errors_total"):
+                    resp = self.session.post(f"{self.api_url}/sendMessage", json=payload, timeout=10)
+            except Exception as e:
+                logging.error(f"Tg send error: {e}")
+                time.sleep(min(2 ** attempt, 30))
+                continue
+            if resp.status_code == 200:
+                return True
+            if resp.status_code == 429:
+                self.stats["rate_limited"] += 1
+                metrics.inc("telegram_rate_limited_total")
+                try:
+                    retry_after = float(resp.json().get("parameters", {}).get("retry_after", 1))
+                except Exception:
+                    retry_after = 1.0
+                time.sleep(retry_after)
+                continue
+            logging.error(f"Tg send error {resp.status_code}: {resp.text}")
+            if resp.status_code < 500:
+                return False
+            time.sleep(min(2 ** attempt, 30))
+        return False
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.queue:
+                    self.cond.wait()
+            # let a burst accumulate so it goes out as one message
+            time.sleep(self.coalesce_window)
+            with self.cond:
+                items = list(self.queue)
+                self.queue.clear()
+            for chat_id, text, markup, queued_at in self._batch(items):
+                if self._deliver(chat_id, text, markup):
+                    self.stats["sent"] += 1
+                    lag = time.monotonic() - queued_at
+                    self.stats["lag_total"] += lag
+                    self.stats["lag_samples"] += 1
+                    self.stats["lag_max"] = max(self.stats["lag_max"], lag)
+                else:
+                    self.stats["failed"] += 1
+
+    def metrics(self):
+        s = self.stats
+        return {
+            "queued": len(self.queue),
+            "enqueued": s["enqueued"],
+            "sent": s["sent"],
+            "coalesced": s["coalesced"],
+            "dropped": s["dropped"],
+            "failed": s["failed"],
+            "rate_limited": s["rate_limited"],
+            "enqueue_us_avg": round(s["enqueue_us_total"] / s["enqueued"], 1) if s["enqueued"] else None,
+            "enqueue_us_max": round(s["enqueue_us_max"], 1),
+            "delivery_lag_avg": round(s["lag_total"] / s["lag_samples"], 3) if s["lag_samples"] else None,
+            "delivery_lag_max": round(s["lag_max"], 3),
+        }
+
+
+notifier = TelegramNotifier()
+metrics.gauge("journal_queue_depth", lambda: len(journal.pending))
+metrics.gauge("telegram_queue_depth", lambda: len(notifier.queue))
+
+
+def tg_send(chat_id, text, reply_markup=None):
+    """
+    Queue a message for the notifier thread (Telegram Bot HTTP API).
+    Safe to call from background threads; returns immediately.
+    """
+    notifier.enqueue(chat_id, text, reply_markup)
+
+
+def format_notifier_stats_text():
+    m = notifier.metrics()
+    return (f"📨 Notifications\nQueued: {m['queued']}, sent: {m['sent']}, merged: {m['coalesced']}\n"
+            f"Dropped: {m['dropped']}, failed: {m['failed']}, 429s: {m['rate_limited']}\n"
+            f"Enqueue: avg {m['enqueue_us_avg']}µs, max {m['enqueue_us_max']}µs\n"
+            f"Delivery lag: avg {m['delivery_lag_avg']}s, max {m['delivery_lag_max']}s")
+
+# ---------------- Market helpers ----------------
+class RateLimiter:
+    """
+    Token bucket shared by every thread that calls the public API, one token per HTTP request.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        started = time.perf_counter()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    metrics.observe("rate_limiter_wait_seconds", time.perf_counter() - started)
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = self.capacity = float(rate)
+            self.tokens = min(self.tokens, self.capacity)
+
+
+public_rate_limiter = RateLimiter(PUBLIC_RATE_LIMIT)
+
+
+# ---------------- Symbol resolution ----------------
+class SymbolResolver:
+    """
+    Maps user-supplied symbols ("BTC/USDT", "BTCUSDT", "btc-usdt") to the exchange's
+    canonical USDT swap market ("BTC/USDT:USDT") once, from the loaded markets.
+    Misses (e.g. delisted MATIC/USDT) are cached too and retried after SYMBOL_MISS_TTL.
+    """
+    def __init__(self, miss_ttl=SYMBOL_MISS_TTL):
+        self.miss_ttl = miss_ttl
+        self.resolved = {}
+        self.missing = {}  # symbol -> time of the failed lookup
+        self.index = None
+        self.index_source = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(text):
+        return text.split(":")[0].replace("/", "").replace("-", "").replace("_", "").upper()
+
+    def _build_index(self, markets):
+        index = {}
+        for market in markets.values():
+            if market.get("type") != "swap" or market.get("active") is False:
+                continue
+            keys = {self._key(market["symbol"]), self._key(market.get("id") or ""), self._key(f"{market.get('base')}{market.get('quote')}")}
+            for key in keys:
+                # prefer USDT-margined (linear) contracts when base/quote collide
+                if key and (key not in index or market.get("linear")):
+                    index[key] = market
+        return index
+
+    def resolve(self, symbol):
+        """
+        Canonical market symbol, None if the exchange does not list it, or the input unchanged
+        while no market catalog is available.
+        """
+        with self.lock:
+            if symbol in self.resolved:
+                return self.resolved[symbol]
+            missed_at = self.missing.get(symbol)
+            if missed_at is not None and time.time() - missed_at < self.miss_ttl:
+                return None
+        exchange = get_public_exchange()
+        markets = getattr(exchange, "markets", None) if exchange is not None else None
+        if not markets:
+            return symbol
+        with self.lock:
+            if self.index is None or self.index_source is not markets:
+                self.index = self._build_index(markets)
+                self.index_source = markets
+            market = self.index.get(self._key(symbol))
+            if market is None:
+                if symbol not in self.missing:
+                    logging.warning(f"{symbol} is not listed as a swap market; skipping it.")
+                self.missing[symbol] = time.time()
+                return None
+            self.missing.pop(symbol, None)
+            self.resolved[symbol] = market["symbol"]
+            return market["symbol"]
+
+    def display_name(self, symbol):
+        """
+        "BASE/QUOTE" form of a resolvable symbol, as stored in tenant symbol lists; None if unknown.
+        """
+        resolved = self.resolve(symbol)
+        if resolved is None:
+            return None
+        return resolved.split(":")[0]
+
+
+symbol_resolver = SymbolResolver()
+
+
+def public_request(method, *args, **kwargs):
+    """
+    Call a public_exchange method: one rate-limiter token per HTTP request, with metrics.
+    """
+    exchange = get_public_exchange()
+    if exchange is None:
+        raise RuntimeError("Public exchange client not initialized.")
+    public_rate_limiter.acquire()
+    metrics.inc("exchange_requests_total")
+    try:
+        with metrics.timer("exchange_request_seconds", errors="exchange_errors_total"):
+            return getattr(exchange, method)(*args, **kwargs)
+    except ccxt.DDoSProtection:  # includes RateLimitExceeded
+        metrics.inc("exchange_rate_limited_total")
+        raise
+
+
+def fetch_ohlcv_raw(symbol, timeframe="1h", limit=300, since=None):
+    """
+    Use public_exchange to fetch raw candle rows [time, open, high, low, close, volume].
+    """
+    market_symbol = symbol_resolver.resolve(symbol)
+    if market_symbol is None:
+        raise ValueError(f"{symbol} is not listed on the exchange")
+    return public_request("fetch_ohlcv", market_symbol, timeframe=timeframe, since=since, limit=limit)
+
+
+class TickerSnapshot:
+    """
+    Last prices for many symbols at once. Stale symbols are refreshed together with one
+    bulk fetch_tickers request (per-symbol fetch_ticker if the bulk call fails), and every
+    price is reused for TICKER_SNAPSHOT_TTL seconds. The scanner offers the closes it has
+    just fetched, so symbols it covers cost the monitor nothing.
+    """
+    def __init__(self, ttl=TICKER_SNAPSHOT_TTL):
+        self.ttl = ttl
+        self.prices = {}  # symbol -> (price, monotonic time)
+        self.lock = threading.Lock()
+        self.stats = {"bulk": 0, "single": 0, "bulk_failures": 0, "served": 0}
+
+    def offer(self, symbol, price):
+        with self.lock:
+            self.prices[symbol] = (float(price), time.monotonic())
+
+    def _fetch(self, symbols):
+        markets = {}
+        for symbol in symbols:
+            market_symbol = symbol_resolver.resolve(symbol)
+            if market_symbol is not None:
+                markets[market_symbol] = symbol
+        if not markets:
+            return {}
+        try:
+            tickers = public_request("fetch_tickers", list(markets))
+            self.stats["bulk"] += 1
+        except Exception as e:
+            logging.warning(f"Bulk ticker fetch failed, falling back to single tickers: {e}")
+            self.stats["bulk_failures"] += 1
+            tickers = {}
+            for market_symbol in markets:
+                try:
+                    tickers[market_symbol] = public_request("fetch_ticker", market_symbol)
+                    self.stats["single"] += 1
+                except Exception as e:
+                    logging.error(f"Ticker fetch failed for {market_symbol}: {e}")
+        prices = {}
+        for market_symbol, ticker in tickers.items():
+            price = (ticker or {}).get("last") or (ticker or {}).get("close")
+            if market_symbol in markets and price:
+                prices[markets[market_symbol]] = float(price)
+        return prices
+
+    def get(self, symbols):
+        """
+        {symbol: last price} for the symbols that have one; at most one bulk request.
+        """
+        with self.lock:
+            now = time.monotonic()
+            stale = [s for s in symbols if s not in self.prices or now - self.prices[s][1] > self.ttl]
+            if stale:
+                fetched_at = time.monotonic()
+                for symbol, price in self._fetch(stale).items():
+                    self.prices[symbol] = (price, fetched_at)
+            out = {s: self.prices[s][0] for s in symbols if s in self.prices}
+            self.stats["served"] += len(out)
+            return out
+
+
+ticker_snapshot = TickerSnapshot()
+
+
+def timeframe_ms(timeframe):
+    units = {"m": 60, "h": 3600, "d": 86400, "w": 604800}
+    return int(timeframe[:-1]) * units[timeframe[-1]] * 1000
+
+
+# ---------------- OHLCV history store ----------------
+class OHLCVStore:
+    """
+    On-disk candle history: one directory per (symbol, timeframe) holding one raw float64
+    file per column. The live loop appends closed candles; backtests and indicator warm-up
+    read the columns through read-only memory maps, without copying.
+    """
+    COLUMNS = ("time", "open", "high", "low", "close", "volume")
+
+    def __init__(self, root=HISTORY_DIR):
+        self.root = root
+        self.lock = threading.Lock()
+        self.locks = {}
+
+    def _dir(self, symbol, tf):
+        return os.path.join(self.root, symbol.replace("/", "_").replace(":", "_"), tf)
+
+    def _path(self, symbol, tf, column):
+        return os.path.join(self._dir(symbol, tf), f"{column}.f8")
+
+    def _key_lock(self, key):
+        with self.lock:
+            if key not in self.locks:
+                self.locks[key] = threading.Lock()
+            return self.locks[key]
+
+    def _length(self, symbol, tf):
+        # a crash between column appends can leave columns of different lengths; the shortest wins
+        sizes = [os.path.getsize(p) if os.path.exists(p) else 0 for p in (self._path(symbol, tf, c) for c in self.COLUMNS)]
+        return min(sizes) // 8
+
+    def read(self, symbol, tf):
+        """
+        Columns as read-only NumPy memmaps keyed by name (empty arrays if nothing is stored).
+        """
+        n = self._length(symbol, tf)
+        if n == 0:
+            return {c: np.empty(0, dtype=np.float64) for c in self.COLUMNS}
+        return {c: np.memmap(self._path(symbol, tf, c), dtype=np.float64, mode="r", shape=(n,)) for c in self.COLUMNS}
+
+    def last_ts(self, symbol, tf):
+        """
+        Timestamp of the last complete row, read from the time file itself (one 8-byte read)
+        rather than cached, so appends from another process are seen.
+        """
+        n = self._length(symbol, tf)
+        if not n:
+            return None
+        with open(self._path(symbol, tf, "time"), "rb") as f:
+            f.seek((n - 1) * 8)
+            return int(np.frombuffer(f.read(8), dtype=np.float64)[0])
+
+    def tail_rows(self, symbol, tf, count):
+        cols = self.read(symbol, tf)
+        if not len(cols["time"]):
+            return []
+        block = np.column_stack([cols[c][-count:] for c in self.COLUMNS])
+        return [[int(r[0])] + [float(v) for v in r[1:]] for r in block]
+
+    def append(self, symbol, tf, rows):
+        """
+        Append closed candles newer than the last stored one. Returns the number written.
+        """
+        key = (symbol, tf)
+        with self._key_lock(key):
+            last = self.last_ts(symbol, tf)
+            rows = [r for r in rows if last is None or r[0] > last]
+            if not rows:
+                return 0
+            os.makedirs(self._dir(symbol, tf), exist_ok=True)
+            n = self._length(symbol, tf)
+            data = np.asarray(rows, dtype=np.float64)
+            for i, c in enumerate(self.COLUMNS):
+                with open(self._path(symbol, tf, c), "r+b" if os.path.exists(self._path(symbol, tf, c)) else "wb") as f:
+                    f.truncate(n * 8)
+                    f.seek(n * 8)
+                    f.write(data[:, i].tobytes())
+            return len(rows)
+
+    def rewrite(self, symbol, tf, data):
+        """
+        Replace a pair's history with an (n, 6) array, one column file at a time via os.replace.
+        """
+        key = (symbol, tf)
+        with self._key_lock(key):
+            os.makedirs(self._dir(symbol, tf), exist_ok=True)
+            for i, c in enumerate(self.COLUMNS):
+                path = self._path(symbol, tf, c)
+                with open(f"{path}.tmp", "wb") as f:
+                    f.write(np.ascontiguousarray(data[:, i]).tobytes())
+                os.replace(f"{path}.tmp", path)
+
+    def gaps(self, symbol, tf):
+        """
+        Missing ranges inside the stored history as [(last_present_ts, next_present_ts)].
+        """
+        t = self.read(symbol, tf)["time"]
+        if len(t) < 2:
+            return []
+        idx = np.flatnonzero(np.diff(t) > timeframe_ms(tf))
+        return [(int(t[i]), int(t[i + 1])) for i in idx]
+
+    def backfill(self, symbol, tf, days=None, page=1000):
+        """
+        Fetch only what is missing: internal gaps, the range since the last stored candle
+        and, if days is given, anything older than the first stored candle within that window.
+        Returns the number of candles added.
+        """
+        step = timeframe_ms(tf)
+        now_ms = int(time.time() * 1000)
+        t = self.read(symbol, tf)["time"]
+        ranges = [(a + step, b - step) for a, b in self.gaps(symbol, tf)]
+        if len(t):
+            ranges.append((int(t[-1]) + step, now_ms))
+            if days is not None and now_ms - days * 86400000 < t[0]:
+                ranges.insert(0, (now_ms - days * 86400000, int(t[0]) - step))
+        else:
+            ranges.append((now_ms - (days or 30) * 86400000, now_ms))
+
+        fetched = []
+        for start, end in ranges:
+            since = start
+            while since <= end:
+                batch = [r for r in fetch_ohlcv_raw(symbol, timeframe=tf, limit=page, since=since) or [] if start <= r[0] <= end]
+                if not batch:
+                    break
+                fetched.extend(batch)
+                since = batch[-1][0] + step
+        # the newest candle is still forming
+        fetched = [r for r in fetched if r[0] + step <= now_ms]
+        if not fetched:
+            return 0
+        if len(t) and fetched[0][0] > t[-1]:
+            return self.append(symbol, tf, fetched)
+        cols = self.read(symbol, tf)
+        old = np.column_stack([cols[c] for c in self.COLUMNS]) if len(t) else np.empty((0, 6))
+        data = np.vstack([old, np.asarray(fetched, dtype=np.float64)])
+        _, keep = np.unique(data[:, 0], return_index=True)
+        before = len(old)
+        data = data[keep]
+        self.rewrite(symbol, tf, data)
+        return len(data) - before
+
+
+history_store = OHLCVStore()
+
+
+# ---------------- Candle cache ----------------
+class CandleCache:
+    """
+    Rolling per-(symbol, timeframe) candle store.
+    The first request warms up from the history store (or bootstraps from the exchange);
+    later ones only fetch candles since the last stored timestamp (that candle included,
+    since it may still have been forming). Closed candles are appended to the history store.
+    With RESAMPLE_FROM_BASE, higher timeframes are bootstrapped once and then derived from
+    the BASE_TIMEFRAME rows, so one request per symbol serves every timeframe.
+    """
+    def __init__(self, size=CANDLE_CACHE_SIZE, update_limit=CANDLE_UPDATE_LIMIT):
+        self.size = size
+        self.update_limit = update_limit
+        self.rows = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.stats = {"bootstraps": 0, "warm_starts": 0, "updates": 0, "rows_fetched": 0,
+                      "resampled": 0, "verify_checks": 0, "verify_mismatches": 0}
+        self.derived_updates = {}
+        self.fetched_at = {}  # key -> ms of the last fetch or derivation
+
+    def _key_lock(self, key):
+        with self.lock:
+            if key not in self.locks:
+                self.locks[key] = threading.Lock()
+            return self.locks[key]
+
+    def merge(self, key, new_rows):
+        """
+        Merge freshly fetched rows into the stored window, replacing overlapping candles.
+        """
+        if not new_rows:
+            return
+        rows = self.rows.setdefault(key, [])
+        first_ts = new_rows[0][0]
+        while rows and rows[-1][0] >= first_ts:
+            rows.pop()
+        rows.extend(list(r) for r in new_rows)
+        if len(rows) > self.size:
+            del rows[:len(rows) - self.size]
+
+    def _warm(self, key):
+        rows = self.rows.get(key)
+        if not rows:
+            rows = self.rows[key] = history_store.tail_rows(key[0], key[1], self.size)
+            if rows:
+                self.stats["warm_starts"] += 1
+        return rows
+
+    def _store_closed(self, symbol, timeframe, rows, now_ms):
+        step = timeframe_ms(timeframe)
+        try:
+            history_store.append(symbol, timeframe, [r for r in rows or [] if r[0] + step <= now_ms])
+        except Exception as e:
+            logging.error(f"History append failed for {symbol} {timeframe}: {e}")
+
+    def update(self, symbol, timeframe):
+        """
+        Bring the stored window up to date and return its rows.
+        """
+        key = (symbol, timeframe)
+        with self._key_lock(key):
+            return self._fetch_locked(key, int(time.time() * 1000))
+
+    def _fetch_locked(self, key, now_ms):
+        symbol, timeframe = key
+        step = timeframe_ms(timeframe)
+        rows = self._warm(key)
+        missing = (now_ms - rows[-1][0]) // step + 2 if rows else None
+        if missing is None or missing > self.size:
+            fetched = fetch_ohlcv_raw(symbol, timeframe=timeframe, limit=self.size)
+            self.rows[key] = []
+            self.stats["bootstraps"] += 1
+        else:
+            fetched = fetch_ohlcv_raw(symbol, timeframe=timeframe, limit=max(self.update_limit, missing), since=rows[-1][0])
+            self.stats["updates"] += 1
+        self.stats["rows_fetched"] += len(fetched or [])
+        self.merge(key, fetched)
+        self.fetched_at[key] = now_ms
+        self._store_closed(symbol, timeframe, fetched, now_ms)
+        return list(self.rows[key])
+
+    def update_many(self, symbol, timeframes, resample=None):
+        """
+        Bring several timeframes of one symbol up to date; returns {timeframe: rows}.
+        With resampling (RESAMPLE_FROM_BASE unless `resample` says otherwise) the base rows are
+        fetched once and every timeframe that is a multiple of the base is derived from that
+        same snapshot.
+        """
+        if not (RESAMPLE_FROM_BASE if resample is None else resample):
+            return {tf: self.update(symbol, tf) for tf in timeframes}
+        base_step = timeframe_ms(BASE_TIMEFRAME)
+        base_rows = self.update(symbol, BASE_TIMEFRAME)
+        out = {}
+        for tf in timeframes:
+            step = timeframe_ms(tf)
+            if tf == BASE_TIMEFRAME:
+                out[tf] = base_rows
+            elif step % base_step or step < base_step:
+                out[tf] = self.update(symbol, tf)
+            else:
+                out[tf] = self.derive(symbol, tf, base_rows)
+        return out
+
+    def derive(self, symbol, timeframe, base_rows):
+        """
+        Roll base rows into the stored window of a higher timeframe. Falls back to a direct
+        fetch when the window is empty or the base rows no longer reach back to its last
+        candle. Every RESAMPLE_VERIFY_EVERY updates the result is checked against the exchange.
+        """
+        key = (symbol, timeframe)
+        with self._key_lock(key):
+            now_ms = int(time.time() * 1000)
+            rows = self._warm(key)
+            start = rows[-1][0] if rows else None
+            if start is None or not base_rows or base_rows[0][0] > start:
+                return self._fetch_locked(key, now_ms)
+            derived = resample_rows([r for r in base_rows if r[0] >= start], timeframe_ms(timeframe))
+            self.merge(key, derived)
+            self.fetched_at[key] = now_ms
+            self.stats["resampled"] += 1
+            self._store_closed(symbol, timeframe, derived, now_ms)
+            self.derived_updates[key] = self.derived_updates.get(key, 0) + 1
+            if self.derived_updates[key] % RESAMPLE_VERIFY_EVERY == 0:
+                try:
+                    self._verify_locked(key, now_ms)
+                except Exception as e:
+                    logging.error(f"Resample check failed for {symbol} {timeframe}: {e}")
+            return list(self.rows[key])
+
+    def verify(self, symbol, timeframe):
+        """
+        Compare the stored closed candles with the exchange's. Returns the mismatch count.
+        """
+        key = (symbol, timeframe)
+        with self._key_lock(key):
+            return self._verify_locked(key, int(time.time() * 1000))
+
+    def _verify_locked(self, key, now_ms):
+        symbol, timeframe = key
+        step = timeframe_ms(timeframe)
+        fetched = fetch_ohlcv_raw(symbol, timeframe=timeframe, limit=self.update_limit)
+        self.stats["verify_checks"] += 1
+        stored = {r[0]: r for r in self.rows.get(key, [])}
+        mismatches = 0
+        for r in fetched or []:
+            mine = stored.get(r[0])
+            if mine is None or r[0] + step > now_ms:
+                continue
+            if any(not math.isclose(a, b, rel_tol=RESAMPLE_TOLERANCE) for a, b in zip(mine[1:6], r[1:6])):
+                mismatches += 1
+        if mismatches:
+            self.stats["verify_mismatches"] += mismatches
+            logging.warning(f"{mismatches} resampled {timeframe} candles for {symbol} differ from the exchange; re-syncing")
+            # the exchange is authoritative: take its candles and rebuild the indicators on them
+            self.merge(key, fetched)
+            state = get_indicator_state(symbol, timeframe)
+            with state.lock:
+                state.reset()
+        return mismatches
+
+    def peek(self, symbol, timeframe):
+        """
+        Stored rows without fetching, plus the time (ms) they were last brought up to date.
+        """
+        key = (symbol, timeframe)
+        with self._key_lock(key):
+            return list(self.rows.get(key) or []), self.fetched_at.get(key, 0)
+
+    def drop(self, symbol):
+        with self.lock:
+            for key in [k for k in list(self.rows) if k[0] == symbol]:
+                self.rows.pop(key, None)
+
+
+candle_cache = CandleCache()
+
+
+def resample_rows(rows, step):
+    """
+    Aggregate [ts, o, h, l, c, v] rows into candles of `step` ms. The last candle may be
+    partial (still forming), exactly like the exchange's.
+    """
+    out = []
+    for ts, o, h, l, c, v in rows:
+        bucket = int(ts) // step * step
+        if out and out[-1][0] == bucket:
+            last = out[-1]
+            last[2] = max(last[2], h)
+            last[3] = min(last[3], l)
+            last[4] = c
+            last[5] += v
+        else:
+            out.append([bucket, o, h, l, c, v])
+    return out
+
+
+def levels_from_rows(rows, lookback=LEVEL_LOOKBACK):
+    tail = rows[-lookback:]
+    return float(min(r[3] for r in tail)), float(max(r[2] for r in tail))
+
+
+# ---------------- Incremental indicators ----------------
+class IndicatorState:
+    """
+    Streaming RSI / SMA50 / SMA200 for one (symbol, timeframe).
+    Closed candles are folded into Wilder averages and running sums; the forming candle is
+    evaluated on top of that committed state, so each update is O(1).
+    Output matches ta's RSIIndicator / SMAIndicator (fillna=False) over the same closes.
+    """
+    def __init__(self, rsi_window=RSI_WINDOW, sma_windows=(SMA50, SMA200)):
+        self.rsi_window = rsi_window
+        self.alpha = 1.0 / rsi_window
+        self.sma_windows = tuple(sma_windows)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.count = 0  # committed (closed) candles
+        self.last_close = None
+        self.avg_up = 0.0
+        self.avg_down = 0.0
+        self.closes = {w: deque(maxlen=w - 1) for w in self.sma_windows}
+        self.sums = {w: 0.0 for w in self.sma_windows}
+        self.forming_ts = None
+        self.forming_close = None
+
+    def _averages(self, close):
+        # ta seeds the averages with a zero move on the first candle
+        if self.last_close is None:
+            return 0.0, 0.0
+        diff = close - self.last_close
+        up = diff if diff > 0 else 0.0
+        down = -diff if diff < 0 else 0.0
+        return ((1 - self.alpha) * self.avg_up + self.alpha * up,
+                (1 - self.alpha) * self.avg_down + self.alpha * down)
+
+    def _commit(self):
+        close = self.forming_close
+        self.avg_up, self.avg_down = self._averages(close)
+        self.last_close = close
+        self.count += 1
+        for w, window in self.closes.items():
+            if len(window) == window.maxlen:
+                self.sums[w] -= window[0]
+            window.append(close)
+            self.sums[w] += close
+            if self.count % w == 0:
+                self.sums[w] = math.fsum(window)  # drop accumulated rounding error
+
+    def update(self, ts, close):
+        """
+        Tick the forming candle, or close it when a candle with a newer timestamp arrives.
+        """
+        if self.forming_ts is not None:
+            if ts < self.forming_ts:
+                return
+            if ts > self.forming_ts:
+                self._commit()
+        self.forming_ts = ts
+        self.forming_close = float(close)
+
+    def feed(self, rows):
+        """
+        Feed candle rows from the cache, skipping the ones already committed.
+        If the forming candle is missing from the rows (a gap), rebuild from scratch.
+        """
+        start = 0
+        if self.forming_ts is not None:
+            start = len(rows)
+            while start > 0 and rows[start - 1][0] >= self.forming_ts:
+                start -= 1
+            if start == len(rows) or rows[start][0] != self.forming_ts:
+                self.reset()
+                start = 0
+        for r in rows[start:]:
+            self.update(r[0], r[4])
+
+    def rsi(self):
+        if self.forming_close is None or self.count + 1 < self.rsi_window:
+            return float("nan")
+        up, down = self._averages(self.forming_close)
+        if down == 0:
+            return 100.0
+        return 100 - 100 / (1 + up / down)
+
+    def sma(self, window):
+        if self.forming_close is None or self.count + 1 < window:
+            return float("nan")
+        return (self.sums[window] + self.forming_close) / window
+
+
+indicator_states = {}
+indicator_states_lock = threading.Lock()
+
+
+def get_indicator_state(symbol, tf):
+    with indicator_states_lock:
+        state = indicator_states.get((symbol, tf))
+        if state is None:
+            state = indicator_states[(symbol, tf)] = IndicatorState()
+        return state
+
+
+def pair_snapshot(symbol, tf, rows):
+    """
+    Update the pair's indicator state with new candle rows and return the values the strategy needs.
+    """
+    state = get_indicator_state(symbol, tf)
+    support, resistance = levels_from_rows(rows)
+    with state.lock, metrics.timer("indicator_update_seconds"):
+        state.feed(rows)
+        return {
+            "bars": len(rows),
+            "bar_ms": int(rows[-1][0]),
+            "price": float(rows[-1][4]),
+            "rsi": state.rsi(),
+            "sma50": state.sma(SMA50),
+            "sma200": state.sma(SMA200),
+            "support": support,
+            "resistance": resistance,
+        }
+
+
+def pnl_percent(entry_price, current_price, direction):
+    if direction == "LONG":
+        return (current_price - entry_price) / entry_price
+    else:
+        return (entry_price - current_price) / entry_price
+
+
+def cash_pnl(invest_amount, leverage, pnl_p):
+    return invest_amount * leverage * pnl_p
+
+
+def size_from_usd(symbol, price, amount_usd, leverage):
+    amount = (amount_usd * leverage) / price
+    return float(round(amount, 6))
+
+# ---------------- Orders ----------------
+def client_order_id(*parts):
+    """
+    Deterministic client order id for one intent (a signal's open, a trade's close):
+    sending the same intent again reuses the id, so the exchange rejects the duplicate
+    instead of trading twice.
+    """
+    return "tb" + hashlib.blake2b("|".join(map(str, parts)).encode(), digest_size=12).hexdigest()
+
+
+class OrderExecutor:
+    """
+    Real order placement off the calling thread. Orders for one symbol go out strictly in
+    submission order (a close never overtakes its open); different symbols are placed in
+    parallel on ORDER_WORKERS threads sharing the one private client and its HTTP session.
+    Leverage is set once per market and cached instead of before every order. A network
+    error is retried with the same client order id after checking whether the first attempt
+    already reached the exchange. Trigger-to-ack latency is observed as `<purpose>_ack_seconds`.
+    """
+    def __init__(self, workers=ORDER_WORKERS, exchange=None, retries=ORDER_RETRIES):
+        self.exchange = exchange  # callable returning the client; get_private_exchange by default
+        self.retries = retries
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="order")
+        self.lock = threading.Lock()
+        self.queues = {}  # symbol -> deque of jobs; the head is being placed
+        self.leverage = {}  # market -> leverage last set on the exchange
+
+    def submit(self, symbol, side, amount, client_id, leverage=None, params=None, triggered_at=None, purpose="order"):
+        """
+        Queue a market order; the Future resolves to the exchange's order dict, or None if it failed.
+        triggered_at is the time.monotonic() of the decision that caused it.
+        """
+        future = Future()
+        job = (future, symbol, side, amount, client_id, leverage, dict(params or {}), triggered_at, purpose)
+        with self.lock:
+            queue = self.queues.get(symbol)
+            if queue is not None:
+                queue.append(job)
+                return future
+            self.queues[symbol] = deque([job])
+        self.pool.submit(self._drain, symbol)
+        return future
+
+    def _drain(self, symbol):
+        while True:
+            with self.lock:
+                job = self.queues[symbol][0]
+            future = job[0]
+            try:
+                future.set_result(self._place(*job[1:]))
+            except Exception as e:
+                future.set_exception(e)
+            with self.lock:
+                queue = self.queues[symbol]
+                queue.popleft()
+                if not queue:
+                    del self.queues[symbol]
+                    return
+
+    def _place(self, symbol, side, amount, client_id, leverage, params, triggered_at, purpose):
+        exchange = (self.exchange or get_private_exchange)()
+        if exchange is None:
+            logging.error("Private exchange client not configured for real orders.")
+            return None
+        market = symbol_resolver.resolve(symbol) or symbol
+        if leverage is not None:
+            self.ensure_leverage(exchange, market, leverage)
+        params = dict(params, clientOid=client_id)
+        order = None
+        for attempt in range(self.retries + 1):
+            try:
+                with metrics.timer("order_seconds", errors="order_errors_total"):
+                    order = exchange.create_order(market, "market", side, amount, None, params)
+                break
+            except (ccxt.NetworkError, ccxt.DuplicateOrderId) as e:
+                # the request may have reached the exchange: look the id up before sending it again
+                order = self.lookup(exchange, market, client_id)
+                if order is not None:
+                    break
+                logging.warning(f"Order {client_id} for {symbol} not confirmed (attempt {attempt + 1}): {e}")
+            except Exception as e:
+                logging.error(f"Error placing real order: {e}")
+                return None
+        if order is None:
+            logging.error(f"Real order {client_id} for {symbol} failed after {self.retries + 1} attempts")
+            return None
+        if triggered_at is not None:
+            metrics.observe(f"{purpose}_ack_seconds", time.monotonic() - triggered_at)
+        logging.info(f"Real market order placed: {order}")
+        return order
+
+    @staticmethod
+    def lookup(exchange, market, client_id):
+        try:
+            return exchange.fetch_order(None, market, {"clientOrderId": client_id})
+        except Exception:
+            return None
+
+    def ensure_leverage(self, exchange, market, leverage):
+        # Bitget keeps leverage per market and account, so it only needs setting when it changes
+        if self.leverage.get(market) == leverage or not hasattr(exchange, "set_leverage"):
+            return
+        try:
+            exchange.set_leverage(leverage, market)
+            self.leverage[market] = leverage
+        except Exception as e:
+            logging.warning(f"Setting {leverage}x leverage on {market} failed: {e}")
+
+
+order_executor = OrderExecutor()
+
+# ---------------- Trades ----------------
+def format_ts(ms=None):
+    dt = datetime.utcnow() if ms is None else datetime.utcfromtimestamp(ms / 1000)
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def sl_tp_prices(entry_price, direction, sl_pct=None, tp_pct=None):
+    sl_pct = SL_PCT if sl_pct is None else sl_pct
+    tp_pct = TP_PCT if tp_pct is None else tp_pct
+    sl_price = entry_price * (1 - sl_pct) if direction == "LONG" else entry_price * (1 + sl_pct)
+    tp_price = entry_price * (1 + tp_pct) if direction == "LONG" else entry_price * (1 - tp_pct)
+    return sl_price, tp_price
+
+
+def build_trade(symbol, direction, entry_price, timeframe, strategy_source="signal", invest=INVEST_AMOUNT, leverage=None,
+                real_order=None, amount_base=None, opened_ms=None, sl_pct=None, tp_pct=None, tenant=None, exchange_exits=False):
+    """
+    Trade record shared by live trading and the backtester. opened_ms defaults to now;
+    tenant is the owning chat's key (None for backtests); exchange_exits marks a real trade
+    the client never closes on SL/TP: its stops were placed on the exchange with the entry
+    order, or it was adopted by the reconciler.
+    """
+    leverage = LEVERAGE if leverage is None else leverage
+    opened_ms = int(time.time() * 1000) if opened_ms is None else int(opened_ms)
+    opened_s = opened_ms // 1000
+    sl_price, tp_price = sl_tp_prices(entry_price, direction, sl_pct, tp_pct)
+    # tenants following the same pair open in the same second, so the tenant is part of the id
+    suffix = f"-{tenant}" if tenant else ""
+    return {
+        "id": f"{symbol}-{timeframe}-{opened_s}{suffix}",
+        "symbol": symbol,
+        "direction": direction,
+        "entry_price": float(entry_price),
+        "sl_price": float(sl_price),
+        "tp_price": float(tp_price),
+        "invest": invest,
+        "leverage": leverage,
+        "opened_at": format_ts(opened_ms),
+        "opened_ms": opened_ms,
+        "strategy": strategy_source,
+        "timeframe": timeframe,
+        "status": "OPEN",
+        "real": bool(real_order),
+        "real_order": real_order,
+        "amount_base": amount_base,
+        "tenant": tenant,
+        "exchange_exits": bool(exchange_exits),
+    }
+
+
+def apply_close(trade, exit_price, reason, closed_ms=None):
+    trade["closed_at"] = format_ts(closed_ms)
+    trade["exit_price"] = float(exit_price)
+    trade["status"] = "CLOSED"
+    pnl_p = pnl_percent(trade["entry_price"], exit_price, trade["direction"])
+    trade["pnl_percent"] = round(pnl_p * 100, 4)
+    trade["pnl_cash"] = round(cash_pnl(trade["invest"], trade["leverage"], pnl_p), 8)
+    trade["close_reason"] = reason
+    return trade
+
+
+def open_trade(symbol, direction, entry_price, timeframe, strategy_source="signal", invest=None, real_order=None, amount_base=None,
+               tenant=None, exchange_exits=False, leverage=None):
+    """
+    Record a new trade for `tenant` (the owner by default), sized and levered from its settings.
+    """
+    tenant = tenant or tenants.owner()
+    invest = tenant.invest_amount if invest is None else invest
+    trade = build_trade(symbol, direction, entry_price, timeframe, strategy_source=strategy_source, invest=invest,
+                        leverage=tenant.leverage if leverage is None else leverage, real_order=real_order, amount_base=amount_base, tenant=tenant.chat_id,
+                        exchange_exits=exchange_exits)
+    sl_price, tp_price = trade["sl_price"], trade["tp_price"]
+    with trade_locks(symbol):
+        open_trades.add(trade)
+        publish_trades(symbol)
+        journal.append("open", dict(trade))
+    if tenant.chat_id:
+        tg_send(tenant.chat_id, f"💼 OPEN: {symbol} {direction} {timeframe}\nentry={entry_price:.2f}, SL={sl_price:.2f}, TP={tp_price:.2f}\nMode: {mode_status(tenant)}")
+    logging.info(f"Opened trade: {trade['id']}")
+    return trade
+
+
+def close_trade(trade, exit_price, reason):
+    with trade_locks(trade["symbol"]):
+        apply_close(trade, exit_price, reason)
+        closed_trades.append(trade)
+        open_trades.remove(trade["id"])
+        publish_trades(trade["symbol"])
+        journal.append("close", dict(trade))
+
+    if not trade.get("real"):
+        invest = trade["invest"]
+        pnl_cash = trade.get("pnl_cash", 0.0)
+        tenants.get(trade.get("tenant"), create=True).release(invest + pnl_cash)
+        tenants.save()
+
+    chat = trade.get("tenant")
+    if chat:
+        tg_send(chat, f"✅ CLOSED: {trade['symbol']} {trade['direction']}\nPnL={trade['pnl_percent']}% ({trade['pnl_cash']}$)\nReason: {reason}")
+    logging.info(f"Closed trade: {trade['id']} reason={reason}")
+
+# ---------------- Signals & Logic ----------------
+def format_signal_text(symbol, snap):
+    price = snap["price"]
+    rsi = snap["rsi"]
+    sma50 = snap["sma50"]
+    sma200 = snap["sma200"]
+    support, resistance = snap["support"], snap["resistance"]
+    trend = "up" if price > sma200 else "down"
+    if rsi < 30:
+        rsi_status = "oversold (LONG possible)"
+    elif rsi > 70:
+        rsi_status = "overbought (SHORT possible)"
+    else:
+        rsi_status = "neutral"
+    return (f"📊 {symbol}\nPrice: {price:.2f}$\nRSI: {round(rsi,2)} ({rsi_status})\nSMA50: {round(sma50,2)}, SMA200: {round(sma200,2)}\nTrend: {trend}\nLvls: S {round(support,2)}, R {round(resistance,2)}")
+
+
+def is_price_near_level(price, level, threshold=None):
+    threshold = LEVEL_THRESHOLD_PCT if threshold is None else threshold
+    return abs(price - level) / level <= threshold
+
+
+# Entry rules in priority order; signal_conditions returns their conditions in the same order.
+SIGNAL_RULES = [
+    ("LONG", "RSI < 30 & price > SMA200"),
+    ("SHORT", "RSI > 70 & price < SMA200"),
+    ("LONG", "near support + RSI<40 + uptrend"),
+    ("SHORT", "near resistance + RSI>60 + downtrend"),
+]
+
+
+def signal_conditions(price, rsi, sma200, support, resistance, level_threshold=None):
+    """
+    Conditions for SIGNAL_RULES. Works on scalars (live scan) and NumPy arrays (backtest),
+    so both evaluate exactly the same strategy.
+    """
+    return [
+        (rsi < 30) & (price > sma200),
+        (rsi > 70) & (price < sma200),
+        is_price_near_level(price, support, level_threshold) & (rsi < 40) & (price > sma200),
+        is_price_near_level(price, resistance, level_threshold) & (rsi > 60) & (price < sma200),
+    ]
+
+
+def evaluate_signal(symbol, tf, snap):
+    """
+    Apply the strategy rules to a pair snapshot (see pair_snapshot) and open a trade if needed.
+    """
+    if snap["bars"] < SMA200:
+        return
+    price = snap["price"]
+    rsi = snap["rsi"]
+    sma200 = snap["sma200"]
+    support, resistance = snap["support"], snap["resistance"]
+
+    direction = None
+    reason = ""
+
+    for (rule_direction, rule_reason), hit in zip(SIGNAL_RULES, signal_conditions(price, rsi, sma200, support, resistance)):
+        if hit:
+            direction, reason = rule_direction, rule_reason
+            break
+
+    if not direction:
+        return
+
+    triggered_at = time.monotonic()
+    # indicators are computed once per pair; every tenant following it gets its own trade
+    for tenant in tenants.subscribed(symbol, tf):
+        # the symbol lock spans the check and the open, so a pair is never opened twice
+        with trade_locks(symbol):
+            if open_trades.has_pair(symbol, tf, tenant.chat_id) or (tenant.chat_id, symbol, tf) in _pending_opens:
+                continue
+            open_signal_trade(tenant, symbol, tf, direction, reason, snap, triggered_at)
+
+
+_pending_opens = set()  # (tenant, symbol, tf) with a real open order awaiting its ack
+
+
+def open_signal_trade(tenant, symbol, tf, direction, reason, snap, triggered_at=None):
+    price = snap["price"]
+    invest, leverage = tenant.invest_amount, tenant.leverage
+    chat = tenant.chat_id
+    private = None
+    if tenant.trade_mode == "real" and tenant.is_owner:
+        private = get_private_exchange()
+        if private is None:
+            logging.debug("Real mode set but no private exchange client; skipping real opens.")
+            return
+
+    if chat:
+        tg_send(chat, f"⚡ SIGNAL: {symbol} {tf} {direction}\n{format_signal_text(symbol, snap)}\nReason: {reason}\nSize: {invest}$\nMode: {mode_status(tenant)}")
+
+    amount_base = size_from_usd(symbol, price, invest, leverage)
+    if private is None:
+        # Reserve virtual balance
+        if not tenant.reserve(invest):
+            if chat:
+                tg_send(chat, f"⚠️ Not enough virtual balance for {symbol}")
+            return
+        tenants.save()
+        open_trade(symbol, direction, price, tf, strategy_source=reason, invest=invest, real_order=None, amount_base=amount_base,
+                   tenant=tenant)
+    else:
+        # real trade path: the order goes out on the executor and the trade is recorded on its ack
+        side = "buy" if direction == "LONG" else "sell"
+        key = (tenant.chat_id, symbol, tf)
+        _pending_opens.add(key)
+        # one id per entry attempt: stable across resends, but a re-entry after an exit in the
+        # same bar (the pair has one more closed trade by then) is a new order
+        attempt = sum(1 for t in closed_trades if (t.get("tenant"), t["symbol"], t.get("timeframe")) == key)
+        cid = client_order_id(tenant.chat_id, symbol, tf, snap.get("bar_ms"), direction, attempt)
+        params = {}
+        if EXCHANGE_SL_TP:
+            # Bitget attaches these to the position as preset stop orders
+            sl_price, tp_price = sl_tp_prices(price, direction)
+            params = {"stopLoss": {"triggerPrice": sl_price}, "takeProfit": {"triggerPrice": tp_price}}
+        future = order_executor.submit(symbol, side, amount_base, cid, leverage=leverage, params=params,
+                                       triggered_at=triggered_at, purpose="open")
+        future.add_done_callback(lambda f: _record_real_open(f, key, tenant, direction, price, reason, invest, amount_base,
+                                                             bool(params)))
+
+
+def _record_real_open(future, key, tenant, direction, price, reason, invest, amount_base, exchange_exits=False):
+    _, symbol, tf = key
+    try:
+        order = future.result()
+        if order:
+            open_trade(symbol, direction, price, tf, strategy_source=reason, invest=invest, real_order={"order": order},
+                       amount_base=amount_base, tenant=tenant, exchange_exits=exchange_exits)
+        elif tenant.chat_id:
+            tg_send(tenant.chat_id, f"⚠️ Failed to open real trade for {symbol}")
+    except Exception as e:
+        logging.error(f"Recording real open for {symbol} failed: {e}\n{traceback.format_exc()}")
+    finally:
+        with trade_locks(symbol):
+            _pending_opens.discard(key)
+
+
+# ---------------- Scan engine ----------------
+# Fetch + indicator work for every symbol/timeframe pair is fanned out over a bounded
+# thread pool; signal evaluation and trade opening stay in the calling thread.
+_scan_executor = None
+_scan_executor_lock = threading.Lock()
+_scan_lock = threading.Lock()  # one scan cycle at a time (scheduler and /force_check)
+last_scan_stats = {}
+
+
+def get_scan_executor():
+    global _scan_executor
+    with _scan_executor_lock:
+        if _scan_executor is None:
+            _scan_executor = ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix="scan")
+        return _scan_executor
+
+
+def analyze_pair(symbol, tfs, queue):
+    """
+    Worker task: fetch candles and update indicators for one symbol on the given timeframes.
+    Returns ([(tf, snapshot)], latency_seconds) where latency excludes time spent queued.
+    """
+    with queue["lock"]:
+        queue["pending"] -= 1
+    return analyze_symbol(symbol, tfs)
+
+
+def analyze_symbol(symbol, tfs, resample=None):
+    started = time.perf_counter()
+    rows = candle_cache.update_many(symbol, tfs, resample)
+    snaps = [(tf, pair_snapshot(symbol, tf, rows[tf])) for tf in tfs]
+    return snaps, time.perf_counter() - started
+
+
+def submit_analysis(executor, symbol, tfs, queue):
+    # in sharded mode the symbol's worker does the work and queues it on its own pool
+    if cluster.active():
+        with queue["lock"]:
+            queue["pending"] -= 1
+        return cluster.submit(symbol, "analyze", symbol, tfs, RESAMPLE_FROM_BASE)
+    return executor.submit(analyze_pair, symbol, tfs, queue)
+
+
+def check_signals_once(timeframes=None, progress=None, cancel=None):
+    """
+    Fetch and evaluate every symbol on the given timeframes (all active ones by default)
+    in one scan cycle. Cycles never overlap: a second caller waits for the running one.
+    progress(done, total) is called as tasks finish; setting the `cancel` event drops the
+    tasks not started yet and stops evaluating results.
+    """
+    with _scan_lock:
+        return _scan_cycle(timeframes, progress, cancel)
+
+
+def _scan_cycle(timeframes, progress, cancel):
+    global last_scan_stats
+    # the union of every tenant's pairs: a pair followed by many chats is still fetched once
+    wanted = tenants.pairs(timeframes)
+    if not wanted:
+        return
+
+    # unlisted symbols are skipped without spending a request (the resolver caches the miss)
+    pairs = [(symbol, tf) for symbol, tf in wanted if symbol_resolver.resolve(symbol) is not None]
+    tfs = sorted({tf for _, tf in pairs}, key=timeframe_ms)
+    # resampling serves all of a symbol's timeframes from one base fetch, so it is one task
+    if RESAMPLE_FROM_BASE:
+        by_symbol = {}
+        for symbol, tf in pairs:
+            by_symbol.setdefault(symbol, []).append(tf)
+        tasks = [(symbol, sorted(symbol_tfs, key=timeframe_ms)) for symbol, symbol_tfs in by_symbol.items()]
+    else:
+        tasks = [(symbol, [tf]) for symbol, tf in pairs]
+    queue = {"pending": len(tasks), "lock": threading.Lock()}
+    executor = get_scan_executor()
+    cycle_started = time.perf_counter()
+    futures = {submit_analysis(executor, symbol, task_tfs, queue): (symbol, task_tfs) for symbol, task_tfs in tasks}
+
+    latencies = []
+    depth_samples = []
+    errors = 0
+    done = 0
+    cancelled = False
+    for future in as_completed(futures):
+        done += 1
+        if progress is not None:
+            progress(done, len(tasks))
+        if cancel is not None and cancel.is_set() and not cancelled:
+            cancelled = True
+            for f in futures:
+                f.cancel()
+        if cancelled:
+            continue
+        symbol, task_tfs = futures[future]
+        with queue["lock"]:
+            depth_samples.append(queue["pending"])
+        try:
+            snaps, latency = future.result()
+            latencies.append(latency)
+        except Exception as e:
+            errors += 1
+            logging.error(f"Failed to fetch ohlcv for {symbol} {', '.join(task_tfs)}: {e}")
+            continue
+        # the forming candle's close is the current price: share it with the monitor
+        if snaps and snaps[0][1].get("price"):
+            ticker_snapshot.offer(symbol, snaps[0][1]["price"])
+        for tf, snap in snaps:
+            try:
+                evaluate_signal(symbol, tf, snap)
+            except Exception as e:
+                errors += 1
+                logging.error(f"Signal error {symbol} {tf}: {e}\n{traceback.format_exc()}")
+
+    cycle_seconds = time.perf_counter() - cycle_started
+    metrics.observe("scan_cycle_seconds", cycle_seconds)
+    metrics.inc("scan_errors_total", errors)
+    last_scan_stats = {
+        "finished_at": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+        "pairs": len(pairs),
+        "timeframes": tfs,
+        "resampled": RESAMPLE_FROM_BASE,
+        "cancelled": cancelled,
+        "errors": errors,
+        "workers": SCAN_WORKERS,
+        "shards": len(cluster.links),
+        "cycle_seconds": round(cycle_seconds, 3),
+        "pair_latency_avg": round(sum(latencies) / len(latencies), 3) if latencies else None,
+        "pair_latency_max": round(max(latencies), 3) if latencies else None,
+        "queue_depth_max": max(depth_samples) if depth_samples else 0,
+        "queue_depth_avg": round(sum(depth_samples) / len(depth_samples), 1) if depth_samples else 0,
+    }
+    logging.info(f"Scan cycle: {last_scan_stats}")
+    shortest = min((timeframe_ms(tf) for tf in tfs), default=0) / 1000
+    if tfs and cycle_seconds > shortest:
+        logging.warning(f"Scan cycle took {cycle_seconds:.1f}s, longer than the shortest timeframe ({shortest:.0f}s)")
+    return last_scan_stats
+
+
+STATS_HISTOGRAMS = [
+    ("exchange_request_seconds", "Exchange request"),
+    ("rate_limiter_wait_seconds", "Rate limiter wait"),
+    ("indicator_update_seconds", "Indicator update"),
+    ("scan_cycle_seconds", "Scan cycle"),
+    ("monitor_iteration_seconds", "Monitor pass"),
+    ("telegram_send_seconds", "Telegram send"),
+    ("order_seconds", "Order"),
+    ("open_ack_seconds", "Signal to open ack"),
+    ("close_ack_seconds", "Trigger to close ack"),
+    ("reconcile_seconds", "Reconcile pass"),
+    ("journal_write_seconds", "Journal write"),
+    ("trade_lock_wait_seconds", "Trade lock wait"),
+]
+
+
+def format_metrics_text():
+    lines = ["📊 Stats (count, avg, p95, max)"]
+    for name, label in STATS_HISTOGRAMS:
+        summary = metrics.summary(name)
+        if summary:
+            count, avg, p95, peak = summary
+            lines.append(f"{label}: {count}, {avg * 1000:.1f}ms, ≤{p95 * 1000:.0f}ms, {peak * 1000:.1f}ms")
+    with metrics.lock:
+        counters = dict(metrics.counters)
+    lines.append(f"Exchange requests: {counters.get('exchange_requests_total', 0)} "
+                 f"(errors: {counters.get('exchange_errors_total', 0)}, rate limited: {counters.get('exchange_rate_limited_total', 0)})")
+    lines.append(f"Telegram errors: {counters.get('telegram_errors_total', 0)}, 429s: {counters.get('telegram_rate_limited_total', 0)}")
+    lines.append(f"Order errors: {counters.get('order_errors_total', 0)}")
+    return "\n".join(lines)
+
+
+class ForcedScan:
+    """
+    Runs /force_check scans on a worker thread, off the bot's event loop. A request while
+    one is in flight joins it instead of starting another; progress and cancellation are
+    shared by every chat watching it.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="force-check")
+        self.future = None
+        self.cancel_event = threading.Event()
+        self.progress = (0, 0)
+
+    def start(self):
+        """
+        Start a scan or join the running one. Returns (concurrent future, joined).
+        """
+        with self.lock:
+            if self.future is not None and not self.future.done():
+                return self.future, True
+            self.cancel_event = threading.Event()
+            self.progress = (0, 0)
+            self.future = self.executor.submit(check_signals_once, None, self._report, self.cancel_event)
+            return self.future, False
+
+    def _report(self, done, total):
+        self.progress = (done, total)
+
+    def cancel(self):
+        with self.lock:
+            if self.future is None or self.future.done():
+                return False
+            self.cancel_event.set()
+            return True
+
+
+forced_scan = ForcedScan()
+
+
+def format_scan_stats_text():
+    s = last_scan_stats
+    if not s:
+        return "No scan completed yet."
+    shards = f" x {s['shards']} shards" if s.get("shards") else ""
+    return (f"🔎 Last scan ({s['finished_at']} UTC)\nPairs: {s['pairs']} on {', '.join(s['timeframes'])} (errors: {s['errors']})\nWorkers: {s['workers']}{shards}\n"
+            f"Cycle: {s['cycle_seconds']}s\nPair latency: avg {s['pair_latency_avg']}s, max {s['pair_latency_max']}s\n"
+            f"Queue depth: max {s['queue_depth_max']}, avg {s['queue_depth_avg']}")
+
+# ---------------- Streaming prices (Bitget public WebSocket) ----------------
+def ws_inst_id(symbol):
+    # "BTC/USDT" or "BTC/USDT:USDT" -> "BTCUSDT"
+    return symbol.split(":")[0].replace("/", "").replace("-", "").upper()
+
+
+class PriceFeed:
+    """
+    Keeps a shared last-price table fed by Bitget ticker pushes for the symbols we hold.
+    Runs its own asyncio loop in a daemon thread; on_price(symbol, price) is called for
+    every update. The URL is configurable so it can be pointed at a local fake server.
+    """
+    def __init__(self, url=WS_PUBLIC_URL, inst_type=WS_INST_TYPE, on_price=None):
+        self.url = url
+        self.inst_type = inst_type
+        self.on_price = on_price
+        self.prices = {}  # symbol -> (price, monotonic time received)
+        self.wanted = {}  # inst_id -> symbol
+        self.subscribed = set()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.connected = False
+        self.thread = None
+
+    def start(self):
+        if websockets is None:
+            logging.info("websockets package not installed; streaming prices disabled.")
+            return False
+        if self.thread and self.thread.is_alive():
+            return True
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=lambda: asyncio.run(self._run()), daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        self.stop_event.set()
+
+    def set_symbols(self, symbols):
+        with self.lock:
+            self.wanted = {ws_inst_id(s): s for s in symbols}
+
+    def last_price(self, symbol, max_age=WS_MAX_PRICE_AGE):
+        with self.lock:
+            item = self.prices.get(symbol)
+        if not item or not self.connected or time.monotonic() - item[1] > max_age:
+            return None
+        return item[0]
+
+    def _args(self, inst_ids):
+        return [{"instType": self.inst_type, "channel": "ticker", "instId": i} for i in sorted(inst_ids)]
+
+    async def _sync_subscriptions(self, ws):
+        with self.lock:
+            wanted = set(self.wanted)
+        add = wanted - self.subscribed
+        remove = self.subscribed - wanted
+        if add:
+            await ws.send(json.dumps({"op": "subscribe", "args": self._args(add)}))
+        if remove:
+            await ws.send(json.dumps({"op": "unsubscribe", "args": self._args(remove)}))
+            with self.lock:
+                for symbol in [s for s in self.prices if ws_inst_id(s) in remove]:
+                    self.prices.pop(symbol, None)
+        self.subscribed = wanted
+
+    def _handle(self, raw):
+        if raw == "pong":
+            return
+        msg = json.loads(raw)
+        if msg.get("event") == "error":
+            logging.error(f"Price feed error: {msg}")
+            return
+        arg = msg.get("arg") or {}
+        if arg.get("channel") != "ticker" or not msg.get("data"):
+            return
+        for item in msg["data"]:
+            inst_id = item.get("instId") or arg.get("instId")
+            with self.lock:
+                symbol = self.wanted.get(inst_id)
+            price = item.get("lastPr") or item.get("last")
+            if symbol is None or price is None:
+                continue
+            price = float(price)
+            with self.lock:
+                self.prices[symbol] = (price, time.monotonic())
+            if self.on_price:
+                try:
+                    self.on_price(symbol, price)
+                except Exception as e:
+                    logging.error(f"Price update handler error for {symbol}: {e}\n{traceback.format_exc()}")
+
+    async def _session(self, ws):
+        last_ping = time.monotonic()
+        while not self.stop_event.is_set():
+            await self._sync_subscriptions(ws)
+            if time.monotonic() - last_ping >= WS_PING_INTERVAL:
+                await ws.send("ping")
+                last_ping = time.monotonic()
+            try:
+                raw = await asyncio.wait_for(ws.recv(), timeout=1.0)
+            except asyncio.TimeoutError:
+                continue
+            self._handle(raw)
+
+    async def _run(self):
+        backoff = 1
+        while not self.stop_event.is_set():
+            try:
+                async with websockets.connect(self.url, ping_interval=None) as ws:
+                    self.subscribed = set()
+                    self.connected = True
+                    backoff = 1
+                    logging.info(f"Price feed connected: {self.url}")
+                    await self._session(ws)
+            except Exception as e:
+                logging.error(f"Price feed connection error: {e}")
+            self.connected = False
+            if not self.stop_event.is_set():
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+
+# ---------------- Monitor open trades ----------------
+_closing_ids = set()
+
+
+def exit_trade(trade, price, reason, triggered_at=None, on_exchange=False):
+    """
+    Close a trade (and its real position, if any). Safe to call from the monitor and the
+    price feed at the same time: only the first caller for a given trade does the work.
+    A real close is queued on the order executor and the trade is booked on its ack, so
+    exits on different symbols are placed in parallel. on_exchange: the position is already
+    closed on the exchange, only book it.
+    """
+    symbol = trade["symbol"]
+    with trade_locks(symbol):
+        if trade["id"] in _closing_ids or trade["id"] not in open_trades:
+            return False
+        _closing_ids.add(trade["id"])
+    try:
+        if trade.get("real") and not on_exchange and get_private_exchange():
+            amount = trade.get("amount_base") or size_from_usd(symbol, trade["entry_price"], trade["invest"], trade["leverage"])
+            future = order_executor.submit(symbol, "sell" if trade["direction"] == "LONG" else "buy", amount,
+                                           client_order_id(trade["id"], "close"), params={"reduceOnly": True},
+                                           triggered_at=triggered_at, purpose="close")
+            future.add_done_callback(lambda f: _finish_exit(trade, price, reason, f))
+        else:
+            _finish_exit(trade, price, reason)
+        return True
+    except Exception:
+        with trade_locks(symbol):
+            _closing_ids.discard(trade["id"])
+        raise
 
 
-def save_settings():
+def _finish_exit(trade, price, reason, order_future=None):
     try:
-        data = {
-            "ACTIVE_TF": ACTIVE_TF,
-            "INVEST_AMOUNT": INVEST_AMOUNT,
-            "TRADE_MODE": TRADE_MODE,
-            "LEVERAGE": LEVERAGE,
-            "SYMBOLS": SYMBOLS
-        }
-        save_json(SETTINGS_FILE, data)
+        if order_future is not None and not order_future.result():
+            logging.error(f"Close order for {trade['id']} failed; booking the exit locally anyway.")
+        close_trade(trade, price, reason)
     except Exception as e:
-        logging.error(f"Error saving settings: {e}")
+        logging.error(f"Exit error for {trade.get('id')}: {e}\n{traceback.format_exc()}")
+    finally:
+        with trade_locks(trade["symbol"]):
+            _closing_ids.discard(trade["id"])
 
 
-def load_settings():
-    global ACTIVE_TF, INVEST_AMOUNT, TRADE_MODE, LEVERAGE, SYMBOLS
-    data = load_json(SETTINGS_FILE, {})
-    ACTIVE_TF[:] = data.get("ACTIVE_TF", ACTIVE_TF)
-    try:
-        INVEST = float(data.get("INVEST_AMOUNT", INVEST_AMOUNT))
-        globals()['INVEST_AMOUNT'] = INVEST
-    except Exception:
-        pass
-    globals()['TRADE_MODE'] = data.get("TRADE_MODE", TRADE_MODE)
-    try:
-        globals()['LEVERAGE'] = int(data.get("LEVERAGE", LEVERAGE))
-    except Exception:
-        pass
-    SYMBOLS[:] = data.get("SYMBOLS", SYMBOLS)
+_exit_executor = ThreadPoolExecutor(max_workers=EXIT_WORKERS, thread_name_prefix="exit")
 
 
-load_settings()
-load_state()
+def _exit_trade_task(trade, price, reason, triggered_at=None):
+    try:
+        exit_trade(trade, price, reason, triggered_at)
+    except Exception as e:
+        logging.error(f"Exit error for {trade.get('id')}: {e}\n{traceback.format_exc()}")
 
-# ---------------- Virtual balance ----------------
-DEFAULT_VIRTUAL_BALANCE = {"currency": "USDT", "total": 1000.0, "available": 1000.0}
 
+def on_stream_price(symbol, price):
+    """
+    Price feed callback: hand the trades on this symbol whose SL/TP the price crossed to the
+    exit workers, so order placement and disk writes never stall the feed thread.
+    """
+    with trade_locks(symbol):
+        hits = open_trades.triggered(symbol, price)
+    triggered_at = time.monotonic()
+    for trade, reason in hits:
+        _exit_executor.submit(_exit_trade_task, trade, price, reason, triggered_at)
 
-def load_virtual_balance():
-    data = load_json(VIRTUAL_BALANCE_FILE, DEFAULT_VIRTUAL_BALANCE.copy())
-    if "currency" not in data:
-        data["currency"] = "USDT"
-    if "total" not in data:
-        data["total"] = float(DEFAULT_VIRTUAL_BALANCE["total"])
-    if "available" not in data:
-        data["available"] = float(data["total"])
-    return data
 
+price_feed = PriceFeed(on_price=on_stream_price)
 
-def save_virtual_balance(bal):
-    save_json(VIRTUAL_BALANCE_FILE, bal)
 
+class ExitRanges:
+    """
+    Open/high/low of each symbol's 1m candles since the monitor last looked at it, so a
+    wick through SL or TP between polls is not missed. Reads the candle cache and brings
+    it up to date at most once per closed candle (the scanner usually already has).
+    """
+    def __init__(self, timeframe="1m"):
+        self.timeframe = timeframe
+        self.last_check = {}  # symbol -> ms
+
+    def collect(self, symbols, now_ms=None):
+        """
+        {symbol: (start_ms, open, high, low)} over the candles overlapping (last check, now].
+        """
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        pending = {}
+        for symbol in symbols:
+            since = self.last_check.get(symbol)
+            self.last_check[symbol] = now_ms
+            if since is not None:
+                # the candles live with the symbol's shard in sharded mode
+                pending[symbol] = shard_call(symbol, "candle_window", symbol, since, now_ms, self.timeframe)
+        out = {}
+        for symbol, future in pending.items():
+            try:
+                window = future.result()
+            except Exception as e:
+                logging.error(f"Exit candles for {symbol} unavailable: {e}")
+                continue
+            if window:
+                out[symbol] = window
+        for symbol in [s for s in self.last_check if s not in symbols]:
+            del self.last_check[symbol]
+        return out
 
-virtual_balance = load_virtual_balance()
 
+def candle_window(symbol, since, now_ms, timeframe="1m"):
+    """
+    (start_ms, open, high, low) of the candles overlapping (since, now_ms], or None.
+    """
+    step = timeframe_ms(timeframe)
+    rows, fetched_at = candle_cache.peek(symbol, timeframe)
+    if fetched_at < now_ms // step * step:  # the last closed candle is not in yet
+        rows = candle_cache.update(symbol, timeframe)
+    window = [r for r in rows if r[0] + step > since]
+    if not window:
+        return None
+    return window[0][0], window[0][1], max(r[2] for r in window), min(r[3] for r in window)
 
-def virtual_reserve(amount_usd):
-    global virtual_balance
-    if virtual_balance["available"] >= amount_usd:
-        virtual_balance["available"] = round(virtual_balance["available"] - amount_usd, 8)
-        save_virtual_balance(virtual_balance)
-        return True
-    return False
 
+exit_ranges = ExitRanges()
 
-def virtual_release(amount_usd):
-    global virtual_balance
-    virtual_balance["available"] = round(virtual_balance["available"] + amount_usd, 8)
-    virtual_balance["total"] = round(virtual_balance["total"] + amount_usd, 8)
-    save_virtual_balance(virtual_balance)
 
-# ---------------- Telegram helpers ----------------
-def tg_send(chat_id, text, reply_markup=None):
+class PositionReconciler:
     """
-    Send a message synchronously using Telegram Bot HTTP API.
-    Useful for background threads that are not async.
+    Keeps the real trades in the book in line with the exchange, so neither a restart nor a
+    close we did not see (attached SL/TP, liquidation, manual close) leaves them diverged.
+    Each pass makes one fetch_positions call for every open position and diffs it against
+    the real trades in one pass over dicts keyed by (market, side):
+      - a trade whose position is gone is booked as closed at the exchange's closing fill
+        (fills are fetched only for those, which is rare);
+      - a position no trade accounts for is only reported, or with RECONCILE_ADOPT booked as
+        an owner trade that shows in /open and P&L but gets no client-side SL/TP (its entry
+        was not ours, so closing it stays with whoever opened it);
+      - a size difference is reported only: partial fills and manual reductions need a human.
+    A divergence must show on two consecutive passes before it is repaired, so an order in
+    flight between the fetch and the diff is never mistaken for one; the startup pass, with
+    nothing in flight yet, repairs at once. Markets with an open order awaiting its ack are
+    skipped for the pass.
     """
-    try:
-        payload = {"chat_id": chat_id, "text": text, "parse_mode": "HTML"}
-        if reply_markup:
-            payload["reply_markup"] = json.loads(json.dumps(reply_markup))  # ensure serializable
-        resp = requests.post(f"{API_URL}/sendMessage", json=payload, timeout=10)
-        if resp.status_code != 200:
-            logging.error(f"Tg send error {resp.status_code}: {resp.text}")
-    except Exception as e:
-        logging.error(f"Tg send error: {e}")
+    def __init__(self, interval=RECONCILE_INTERVAL):
+        self.interval = interval
+        self.suspects = set()  # divergences seen on the previous pass
+        self.last_report = None
+        self.lock = threading.Lock()  # one pass at a time (loop and /reconcile)
+
+    def check(self, exchange=None, confirmations=2):
+        """
+        Run one pass; returns its report, or None without a private client.
+        """
+        exchange = exchange or get_private_exchange()
+        if exchange is None:
+            return None
+        with self.lock, metrics.timer("reconcile_seconds", errors="reconcile_errors_total"):
+            return self._check(exchange, confirmations)
+
+    def _check(self, exchange, confirmations):
+        trades = [t for t in open_trades if t.get("real")]
+        positions = exchange.fetch_positions()
+        held = {}
+        for position in positions:
+            if float(position.get("contracts") or 0) > 0:
+                held[(position.get("symbol"), position.get("side"))] = position
+        local = {}
+        for trade in trades:
+            local.setdefault((self.market(trade["symbol"]), "long" if trade["direction"] == "LONG" else "short"), []).append(trade)
+        busy = {self.market(symbol) for _, symbol, _ in list(_pending_opens)}
+
+        seen = set()
+        repaired, warnings = [], []
+        for key, group in local.items():
+            if key[0] in busy:
+                continue
+            position = held.get(key)
+            if position is None:
+                for trade in group:
+                    if trade["id"] in _closing_ids or not self._confirmed(("gone", trade["id"]), seen, confirmations):
+                        continue
+                    price, reason = self.fill(exchange, key[0], trade)
+                    if exit_trade(trade, price, reason, on_exchange=True):
+                        repaired.append(f"{trade['id']}: closed on the exchange, booked {reason} at {price}")
+                continue
+            size = self.position_size(position)
+            expected = sum(t.get("amount_base") or 0 for t in group)
+            if expected and abs(size - expected) > RECONCILE_SIZE_TOLERANCE * expected:
+                warnings.append(f"{key[0]} {key[1]}: exchange holds {size}, trades account for {round(expected, 8)}")
+        for key, position in held.items():
+            if key in local or key[0] in busy or not self._confirmed(("untracked", key), seen, confirmations):
+                continue
+            if RECONCILE_ADOPT:
+                trade = self.adopt(position)
+                repaired.append(f"{trade['id']}: untracked {key[1]} position on {key[0]} adopted")
+            else:
+                warnings.append(f"{key[0]} {key[1]}: position of {self.position_size(position)} is not tracked")
+        self.suspects = seen
+
+        metrics.inc("reconcile_repairs_total", len(repaired))
+        report = {"at": format_ts(), "positions": len(held), "trades": len(trades), "repaired": repaired,
+                  "warnings": warnings, "pending": len(seen)}
+        previous, self.last_report = self.last_report, report
+        owner = tenants.owner()
+        if owner.chat_id and (repaired or (warnings and warnings != (previous or {}).get("warnings"))):
+            tg_send(owner.chat_id, format_reconcile_text(report))
+        if repaired or warnings:
+            logging.warning(f"Reconcile: {report}")
+        return report
+
+    def _confirmed(self, key, seen, confirmations):
+        seen.add(key)
+        return confirmations <= 1 or key in self.suspects
+
+    @staticmethod
+    def market(symbol):
+        return symbol_resolver.resolve(symbol) or symbol
+
+    @staticmethod
+    def position_size(position):
+        return round(float(position.get("contracts") or 0) * float(position.get("contractSize") or 1), 8)
+
+    @staticmethod
+    def fill(exchange, market, trade):
+        """
+        (price, reason) of an exchange-side close: the last closing-side fill since the trade
+        opened. For trades with exchange SL/TP the nearer level names it.
+        """
+        closing_side = "sell" if trade["direction"] == "LONG" else "buy"
+        price = None
+        try:
+            fills = exchange.fetch_my_trades(market, since=int(trade_opened_ms(trade)))
+            closing = [f for f in fills if f.get("side") == closing_side and f.get("price")]
+            if closing:
+                price = float(closing[-1]["price"])
+        except Exception as e:
+            logging.warning(f"Fills for {trade['id']} unavailable: {e}")
+        if price is None:
+            price = ticker_snapshot.get([trade["symbol"]]).get(trade["symbol"]) or trade["entry_price"]
+        if not trade.get("exchange_exits") or trade.get("strategy") == "reconciled":
+            return price, "Closed on exchange"
+        near_tp = abs(price - trade["tp_price"]) < abs(price - trade["sl_price"])
+        return price, "Hit TP (exchange)" if near_tp else "Hit SL (exchange)"
+
+    def adopt(self, position):
+        owner = tenants.owner()
+        market = position["symbol"]
+        entry = float(position.get("entryPrice") or 0)
+        amount = self.position_size(position)
+        leverage = int(float(position.get("leverage") or owner.leverage))
+        return open_trade(market.split(":")[0], "LONG" if position["side"] == "long" else "SHORT", entry, "external",
+                          strategy_source="reconciled", invest=round(entry * amount / leverage, 8),
+                          real_order={"position": {"symbol": market, "side": position["side"], "contracts": position.get("contracts")}},
+                          amount_base=amount, tenant=owner, exchange_exits=True, leverage=leverage)
+
+
+reconciler = PositionReconciler()
+
+
+def format_reconcile_text(report):
+    if not report:
+        return "No reconciliation pass yet (needs the private exchange client)."
+    lines = [f"🔄 Reconciled with exchange ({report['at']} UTC): {report['positions']} positions, {report['trades']} real trades"]
+    lines += [f"Fixed: {line}" for line in report["repaired"]]
+    lines += [f"⚠️ {line}" for line in report["warnings"]]
+    if report["pending"]:
+        lines.append(f"{report['pending']} differences waiting for confirmation on the next pass")
+    if not (report["repaired"] or report["warnings"] or report["pending"]):
+        lines.append("In sync.")
+    return "\n".join(lines)
+
+
+def reconcile_loop():
+    while True:
+        try:
+            reconciler.check()
+        except Exception as e:
+            logging.error(f"Reconcile error: {e}")
+        time.sleep(reconciler.interval)
 
-# ---------------- Market helpers ----------------
-def fetch_ohlcv(symbol, timeframe="1h", limit=300):
+
+def current_prices_for(symbols):
     """
-    Use public_exchange to fetch candles. Works in virtual mode too.
+    {symbol: price}: streamed prices where the feed is live, the rest from one shared
+    ticker snapshot, so the request count does not depend on how many trades are open.
     """
-    if public_exchange is None:
-        raise RuntimeError("Public exchange client not initialized.")
-    try:
-        ohlcv = public_exchange.fetch_ohlcv(symbol, timeframe=timeframe, limit=limit)
-    except Exception as e:
-        logging.debug(f"fetch_ohlcv error for {symbol}: {e}")
-        tried = []
-        for sym in [symbol, symbol.replace("/", ""), symbol.replace("/", "-")]:
-            if sym in tried:
-                continue
-            tried.append(sym)
-            try:
-                ohlcv = public_exchange.fetch_ohlcv(sym, timeframe=timeframe, limit=limit)
-                break
-            except Exception:
-                ohlcv = None
-        if not ohlcv:
-            raise
-    df = pd.DataFrame(ohlcv, columns=["time", "open", "high", "low", "close", "volume"])
-    df["time"] = pd.to_datetime(df["time"], unit="ms")
-    return df
+    prices = {}
+    for symbol in symbols:
+        price = price_feed.last_price(symbol)
+        if price is not None:
+            prices[symbol] = price
+    missing = [s for s in symbols if s not in prices]
+    if missing:
+        try:
+            prices.update(ticker_snapshot.get(missing))
+        except Exception as e:
+            logging.error(f"Price snapshot failed: {e}")
+    return prices
 
 
-def compute_indicators(df):
-    df = df.copy().reset_index(drop=True)
-    df["close"] = pd.to_numeric(df["close"], errors="coerce")
-    df["rsi"] = RSIIndicator(df["close"], window=RSI_WINDOW).rsi()
-    df["sma50"] = SMAIndicator(df["close"], window=SMA50).sma_indicator()
-    df["sma200"] = SMAIndicator(df["close"], window=SMA200).sma_indicator()
-    return df
+def monitor_open_trades_loop():
+    while True:
+        try:
+            iteration_started = time.perf_counter()
+            snap = trade_snapshot
+            # exchange-protected trades are left to the position reconciler
+            columns = snap.columns()
+            symbols = columns.symbols
+            price_feed.set_symbols(symbols)
+            prices = current_prices_for(symbols)
+            ranges = exit_ranges.collect(symbols)
+            # every open trade against the price and range vectors at once; exits go out as one batch
+            triggered_at = time.monotonic()
+            for trade_id, symbol, reason, exit_price in columns.triggered(prices, ranges):
+                trade = open_trades.get(trade_id)
+                if trade is not None:
+                    _exit_executor.submit(_exit_trade_task, trade, exit_price, reason, triggered_at)
+            metrics.observe("monitor_iteration_seconds", time.perf_counter() - iteration_started)
+            time.sleep(5)
+        except Exception as e:
+            logging.error(f"monitor loop error: {e}\n{traceback.format_exc()}")
+            time.sleep(5)
 
 
-def levels_from_df(df, lookback=LEVEL_LOOKBACK):
-    low = df["low"].tail(lookback).min()
-    high = df["high"].tail(lookback).max()
-    return float(low), float(high)
+# ---------------- Cluster (sharded workers) ----------------
+class HashRing:
+    """
+    Consistent hashing of symbols onto worker ids. Each worker owns CLUSTER_VNODES points on
+    the ring, so adding or removing one moves only about 1/N of the symbols.
+    """
+    def __init__(self, vnodes=CLUSTER_VNODES):
+        self.vnodes = vnodes
+        self.points = []  # sorted ring positions
+        self.owners = []  # worker id at each position
 
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
 
-def pnl_percent(entry_price, current_price, direction):
-    if direction == "LONG":
-        return (current_price - entry_price) / entry_price
-    else:
-        return (entry_price - current_price) / entry_price
+    def add(self, node):
+        for i in range(self.vnodes):
+            point = self._hash(f"{node}#{i}")
+            at = bisect_left(self.points, point)
+            self.points.insert(at, point)
+            self.owners.insert(at, node)
 
+    def remove(self, node):
+        kept = [(p, o) for p, o in zip(self.points, self.owners) if o != node]
+        self.points = [p for p, _ in kept]
+        self.owners = [o for _, o in kept]
 
-def cash_pnl(invest_amount, leverage, pnl_p):
-    return invest_amount * leverage * pnl_p
+    def nodes(self):
+        return sorted(set(self.owners))
 
+    def owner(self, key):
+        if not self.points:
+            return None
+        return self.owners[bisect_right(self.points, self._hash(key)) % len(self.points)]
 
-def size_from_usd(symbol, price, amount_usd, leverage):
-    amount = (amount_usd * leverage) / price
-    return float(round(amount, 6))
 
-# ---------------- Orders ----------------
-def place_real_market_order(symbol, side, amount):
+class ClusterCallError(RuntimeError):
     """
-    Place a market order using private_exchange (requires keys).
-    Returns order dict or None.
+    A shard call raised on the worker; the message carries the remote exception.
     """
-    if private_exchange is None:
-        logging.error("Private exchange client not configured for real orders.")
-        return None
-    try:
-        order = private_exchange.create_order(symbol, "market", side, amount, None, {})
-        logging.info(f"Real market order placed: {order}")
-        return order
-    except Exception as e:
-        logging.error(f"Error placing real order: {e}")
-        return None
 
 
-def close_real_position_by_market(symbol, side_opposite, amount):
-    return place_real_market_order(symbol, side_opposite, amount)
-
-# ---------------- Trades ----------------
-def chat_from_last_update():
-    return _last_chat_id
+# name -> function a worker runs for the leader; arguments and results must pickle
+CLUSTER_CALLS = {
+    "analyze": lambda symbol, tfs, resample: analyze_symbol(symbol, tfs, resample),
+    "candle_window": lambda symbol, since, now_ms, timeframe: candle_window(symbol, since, now_ms, timeframe),
+    "release": lambda symbols: release_symbols(symbols),
+}
 
 
-def open_trade(symbol, direction, entry_price, timeframe, strategy_source="signal", invest=INVEST_AMOUNT, real_order=None, amount_base=None):
-    sl_price = entry_price * (1 - SL_PCT) if direction == "LONG" else entry_price * (1 + SL_PCT)
-    tp_price = entry_price * (1 + TP_PCT) if direction == "LONG" else entry_price * (1 - TP_PCT)
-    trade = {
-        "id": f"{symbol}-{timeframe}-{int(time.time())}",
-        "symbol": symbol,
-        "direction": direction,
-        "entry_price": float(entry_price),
-        "sl_price": float(sl_price),
-        "tp_price": float(tp_price),
-        "invest": invest,
-        "leverage": LEVERAGE,
-        "opened_at": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
-        "strategy": strategy_source,
-        "timeframe": timeframe,
-        "status": "OPEN",
-        "real": bool(real_order),
-        "real_order": real_order,
-        "amount_base": amount_base
-    }
-    with state_lock:
-        open_trades.append(trade)
-        save_state()
-    chat = TG_CHAT_ID or chat_from_last_update()
-    if chat:
-        tg_send(chat, f"💼 OPEN: {symbol} {direction} {timeframe}\nentry={entry_price:.2f}, SL={sl_price:.2f}, TP={tp_price:.2f}\nMode: {mode_status()}")
-    logging.info(f"Opened trade: {trade['id']}")
-    return trade
+def release_symbols(symbols):
+    # a symbol moved to another shard: its candles and indicator state live there now
+    for symbol in symbols:
+        candle_cache.drop(symbol)
+        with indicator_states_lock:
+            for key in [k for k in indicator_states if k[0] == symbol]:
+                indicator_states.pop(key, None)
 
 
-def close_trade(trade, exit_price, reason):
-    with state_lock:
-        trade["closed_at"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-        trade["exit_price"] = float(exit_price)
-        trade["status"] = "CLOSED"
-        pnl_p = pnl_percent(trade["entry_price"], exit_price, trade["direction"])
-        trade["pnl_percent"] = round(pnl_p * 100, 4)
-        trade["pnl_cash"] = round(cash_pnl(trade["invest"], trade["leverage"], pnl_p), 8)
-        trade["close_reason"] = reason
-        closed_trades.append(trade)
-        open_trades[:] = [t for t in open_trades if t["id"] != trade["id"]]
-        save_state()
+class Coordinator:
+    """
+    Leader side of the sharded mode. Worker processes (`main.py worker`, on this host or
+    others) connect to CLUSTER_ADDRESS and each symbol is consistently hashed to one of them,
+    so its candle cache and indicator state stay warm in one process. The leader keeps
+    Telegram polling, trade state and order placement, and sends the per-symbol fetch and
+    compute calls (scan analysis, exit candle windows) to the symbol's owner.
+
+    When a worker joins or leaves only the symbols whose owner changed move: the old owner
+    is told to release them, and calls in flight on a lost worker are re-sent to the new
+    owner, or run in this process once no worker is left.
+    """
+    def __init__(self, address=CLUSTER_ADDRESS, authkey=None):
+        self.address = address
+        self.authkey = authkey
+        self.ring = HashRing()
+        self.links = {}  # worker id -> {"conn", "send_lock", "pending": {request id: (future, call)}}
+        self.assigned = {}  # symbol -> worker id that holds its state
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+        self.listener = None
+        self.stopped = False
+
+    def start(self):
+        self.listener = Listener(self.address, authkey=self.authkey)
+        threading.Thread(target=self._accept_loop, daemon=True, name="cluster-accept").start()
+        logging.info(f"Cluster leader listening on {self.address}")
+
+    def stop(self):
+        self.stopped = True
+        if self.listener is not None:
+            self.listener.close()
+        for worker_id in list(self.links):
+            self._leave(worker_id)
+
+    def active(self):
+        return bool(self.links)
+
+    def workers(self):
+        with self.lock:
+            return sorted(self.links)
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+                kind, worker_id = conn.recv()
+            except (OSError, EOFError, AuthenticationError) as e:
+                if self.stopped:
+                    return
+                logging.warning(f"Cluster handshake failed: {e}")
+                continue
+            if kind != "hello":
+                conn.close()
+                continue
+            self._join(worker_id, conn)
+
+    def _join(self, worker_id, conn):
+        with self.lock:
+            if worker_id in self.links:
+                worker_id = f"{worker_id}-{next(self.ids)}"
+            self.links[worker_id] = {"conn": conn, "send_lock": threading.Lock(), "pending": {}}
+            self.ring.add(worker_id)
+        metrics.inc("cluster_membership_changes_total")
+        logging.info(f"Worker {worker_id} joined; {len(self.links)} in the cluster")
+        threading.Thread(target=self._read_loop, args=(worker_id, conn), daemon=True, name=f"cluster-{worker_id}").start()
+        self._rebalance()
+
+    def _leave(self, worker_id):
+        with self.lock:
+            link = self.links.pop(worker_id, None)
+            if link is None:
+                return
+            self.ring.remove(worker_id)
+            orphans = list(link["pending"].values())
+        try:
+            link["conn"].close()
+        except OSError:
+            pass
+        metrics.inc("cluster_membership_changes_total")
+        logging.warning(f"Worker {worker_id} left; re-sending {len(orphans)} calls")
+        self._rebalance()
+        for future, call in orphans:
+            self._dispatch(future, call)
+
+    def _read_loop(self, worker_id, conn):
+        while True:
+            try:
+                request_id, ok, payload = conn.recv()
+            except (EOFError, OSError, TypeError):  # TypeError: closed under us by _leave
+                break
+            with self.lock:
+                link = self.links.get(worker_id)
+                entry = link["pending"].pop(request_id, None) if link else None
+            if entry is None:
+                continue
+            future = entry[0]
+            if ok:
+                future.set_result(payload)
+            else:
+                future.set_exception(ClusterCallError(payload))
+        self._leave(worker_id)
+
+    def _rebalance(self):
+        """
+        Tell previous owners to drop symbols that hash elsewhere now.
+        """
+        moved = {}
+        with self.lock:
+            for symbol, worker_id in list(self.assigned.items()):
+                owner = self.ring.owner(symbol)
+                if owner != worker_id:
+                    if worker_id in self.links:
+                        moved.setdefault(worker_id, []).append(symbol)
+                    del self.assigned[symbol]
+        for worker_id, symbols in moved.items():
+            self._send(worker_id, None, ("release", (symbols,)))
+
+    def _send(self, worker_id, request_id, call):
+        with self.lock:
+            link = self.links.get(worker_id)
+        if link is None:
+            return False
+        try:
+            with link["send_lock"]:
+                link["conn"].send((request_id, call[0], call[1]))
+            return True
+        except (OSError, EOFError, ValueError):
+            return False
+
+    def submit(self, symbol, name, *args):
+        """
+        Run CLUSTER_CALLS[name](*args) on the worker owning `symbol`; returns a Future.
+        """
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self._dispatch(future, (symbol, name, args))
+        return future
+
+    def _dispatch(self, future, call):
+        symbol, name, args = call
+        while True:
+            with self.lock:
+                worker_id = self.ring.owner(symbol)
+                if worker_id is None:
+                    break
+                request_id = next(self.ids)
+                self.links[worker_id]["pending"][request_id] = (future, call)
+                self.assigned[symbol] = worker_id
+            if self._send(worker_id, request_id, (name, args)):
+                metrics.inc("cluster_calls_total")
+                return
+            with self.lock:
+                link = self.links.get(worker_id)
+                if link is not None:
+                    link["pending"].pop(request_id, None)
+            self._leave(worker_id)
+        get_scan_executor().submit(_run_call_into, future, name, args)
+
+
+def _run_call_into(future, name, args):
+    try:
+        future.set_result(CLUSTER_CALLS[name](*args))
+    except Exception as e:
+        future.set_exception(e)
 
-    if not trade.get("real"):
-        invest = trade["invest"]
-        pnl_cash = trade.get("pnl_cash", 0.0)
-        virtual_release(invest + pnl_cash)
 
-    chat = TG_CHAT_ID or chat_from_last_update()
-    if chat:
-        tg_send(chat, f"✅ CLOSED: {trade['symbol']} {trade['direction']}\nPnL={trade['pnl_percent']}% ({trade['pnl_cash']}$)\nReason: {reason}")
-    logging.info(f"Closed trade: {trade['id']} reason={reason}")
+cluster = Coordinator()
+metrics.gauge("cluster_workers", lambda: len(cluster.links))
 
-# ---------------- Signals & Logic ----------------
-def format_signal_text(symbol, df):
-    price = df["close"].iloc[-1]
-    rsi = df["rsi"].iloc[-1]
-    sma50 = df["sma50"].iloc[-1]
-    sma200 = df["sma200"].iloc[-1]
-    support, resistance = levels_from_df(df)
-    trend = "up" if price > sma200 else "down"
-    if rsi < 30:
-        rsi_status = "oversold (LONG possible)"
-    elif rsi > 70:
-        rsi_status = "overbought (SHORT possible)"
-    else:
-        rsi_status = "neutral"
-    return (f"📊 {symbol}\nPrice: {price:.2f}$\nRSI: {round(rsi,2)} ({rsi_status})\nSMA50: {round(sma50,2)}, SMA200: {round(sma200,2)}\nTrend: {trend}\nLvls: S {round(support,2)}, R {round(resistance,2)}")
 
+def shard_call(symbol, name, *args):
+    """
+    Future for CLUSTER_CALLS[name](*args): on the symbol's worker in sharded mode,
+    otherwise computed right here.
+    """
+    if cluster.active():
+        return cluster.submit(symbol, name, *args)
+    future = Future()
+    future.set_running_or_notify_cancel()
+    _run_call_into(future, name, args)
+    return future
 
-def is_price_near_level(price, level):
-    return abs(price - level) / level <= LEVEL_THRESHOLD_PCT
 
+def parse_cluster_address(text):
+    # "host:port" is TCP (workers on other hosts); anything else is a Unix socket path
+    host, sep, port = text.rpartition(":")
+    return (host, int(port)) if sep and port.isdigit() else text
 
-def check_signals_once():
-    if not SYMBOLS:
-        return
-    for symbol in list(SYMBOLS):
-        for tf in list(ACTIVE_TF):
-            try:
-                # If real mode but no private exchange, skip opening real trades
-                if TRADE_MODE == "real" and private_exchange is None:
-                    logging.debug("Real mode set but no private exchange client; skipping real opens.")
-                    continue
 
-                # fetch candles (public)
-                try:
-                    df = fetch_ohlcv(symbol, timeframe=tf, limit=300)
-                except Exception as e:
-                    logging.error(f"Failed to fetch ohlcv for {symbol} {tf}: {e}")
-                    continue
-
-                df = compute_indicators(df)
-                if len(df) < SMA200:
-                    continue
-                price = float(df["close"].iloc[-1])
-                rsi = float(df["rsi"].iloc[-1])
-                sma200 = float(df["sma200"].iloc[-1])
-                support, resistance = levels_from_df(df)
-
-                direction = None
-                reason = ""
-
-                if rsi < 30 and price > sma200:
-                    direction, reason = "LONG", "RSI < 30 & price > SMA200"
-                elif rsi > 70 and price < sma200:
-                    direction, reason = "SHORT", "RSI > 70 & price < SMA200"
-
-                if not direction:
-                    if is_price_near_level(price, support) and rsi < 40 and price > sma200:
-                        direction, reason = "LONG", "near support + RSI<40 + uptrend"
-                    elif is_price_near_level(price, resistance) and rsi > 60 and price < sma200:
-                        direction, reason = "SHORT", "near resistance + RSI>60 + downtrend"
-
-                if direction:
-                    trade_id_prefix = f"{symbol}-{tf}"
-                    with state_lock:
-                        if any(t["id"].startswith(trade_id_prefix) for t in open_trades):
-                            continue
-
-                    chat = TG_CHAT_ID or chat_from_last_update()
-                    if chat:
-                        tg_send(chat, f"⚡ SIGNAL: {symbol} {tf} {direction}\n{format_signal_text(symbol, df)}\nReason: {reason}\nSize: {INVEST_AMOUNT}$\nMode: {mode_status()}")
-
-                    # open
-                    if TRADE_MODE == "virtual" or private_exchange is None:
-                        # Reserve virtual balance
-                        if not virtual_reserve(INVEST_AMOUNT):
-                            if chat:
-                                tg_send(chat, f"⚠️ Not enough virtual balance for {symbol}")
-                            continue
-                        amount_base = size_from_usd(symbol, price, INVEST_AMOUNT, LEVERAGE)
-                        open_trade(symbol, direction, price, tf, strategy_source=reason, invest=INVEST_AMOUNT, real_order=None, amount_base=amount_base)
-                    else:
-                        # real trade path
-                        amount_base = size_from_usd(symbol, price, INVEST_AMOUNT, LEVERAGE)
-                        side = "buy" if direction == "LONG" else "sell"
-                        try:
-                            # attempt to set leverage if supported
-                            if hasattr(private_exchange, "set_leverage"):
-                                try:
-                                    private_exchange.set_leverage(LEVERAGE, symbol)
-                                except Exception:
-                                    pass
-                        except Exception:
-                            pass
-                        order = place_real_market_order(symbol, side, amount_base)
-                        if order:
-                            open_trade(symbol, direction, price, tf, strategy_source=reason, invest=INVEST_AMOUNT, real_order={"order": order}, amount_base=amount_base)
-                        else:
-                            if chat:
-                                tg_send(chat, f"⚠️ Failed to open real trade for {symbol}")
-            except Exception as e:
-                logging.error(f"Signal error {symbol} {tf}: {e}\n{traceback.format_exc()}")
+def run_worker(address, authkey, worker_id=None):
+    """
+    `main.py worker`: serve shard calls for the leader until it goes away. Calls run on the
+    scan pool, so one worker overlaps the network waits of many symbols.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    conn = Client(address, authkey=authkey)
+    conn.send(("hello", worker_id))
+    send_lock = threading.Lock()
+    executor = get_scan_executor()
+    logging.info(f"Worker {worker_id} connected to {address}")
+
+    def serve(request_id, name, args):
+        try:
+            reply = (request_id, True, CLUSTER_CALLS[name](*args))
+        except Exception as e:
+            reply = (request_id, False, f"{type(e).__name__}: {e}")
+        if request_id is None:
+            return
+        try:
+            with send_lock:
+                conn.send(reply)
+        except (OSError, EOFError):
+            pass
 
-# ---------------- Monitor open trades ----------------
-def monitor_open_trades_loop():
     while True:
         try:
-            with state_lock:
-                snapshot = list(open_trades)
-            for trade in snapshot:
-                try:
-                    symbol = trade["symbol"]
-                    direction = trade["direction"]
-                    # get latest price (public fetch)
-                    try:
-                        df = fetch_ohlcv(symbol, timeframe="1m", limit=5)
-                        current_price = float(df["close"].iloc[-1])
-                    except Exception:
-                        # fallback to ticker if private exchange exists
-                        current_price = None
-                        if private_exchange:
-                            try:
-                                ticker = private_exchange.fetch_ticker(symbol)
-                                current_price = float(ticker.get("last") or ticker.get("close") or 0)
-                            except Exception:
-                                current_price = None
-                    if current_price is None:
-                        continue
+            request_id, name, args = conn.recv()
+        except (EOFError, OSError):
+            logging.info("Leader went away; worker exiting.")
+            return
+        executor.submit(serve, request_id, name, args)
 
-                    price = current_price
-
-                    if direction == "LONG":
-                        if price <= trade["sl_price"]:
-                            if trade.get("real") and private_exchange:
-                                amount = trade.get("amount_base") or size_from_usd(symbol, trade["entry_price"], trade["invest"], trade["leverage"])
-                                close_real_position_by_market(symbol, "sell", amount)
-                            close_trade(trade, price, "Hit SL")
-                        elif price >= trade["tp_price"]:
-                            if trade.get("real") and private_exchange:
-                                amount = trade.get("amount_base") or size_from_usd(symbol, trade["entry_price"], trade["invest"], trade["leverage"])
-                                close_real_position_by_market(symbol, "sell", amount)
-                            close_trade(trade, price, "Hit TP")
-                    else:  # SHORT
-                        if price >= trade["sl_price"]:
-                            if trade.get("real") and private_exchange:
-                                amount = trade.get("amount_base") or size_from_usd(symbol, trade["entry_price"], trade["invest"], trade["leverage"])
-                                close_real_position_by_market(symbol, "buy", amount)
-                            close_trade(trade, price, "Hit SL")
-                        elif price <= trade["tp_price"]:
-                            if trade.get("real") and private_exchange:
-                                amount = trade.get("amount_base") or size_from_usd(symbol, trade["entry_price"], trade["invest"], trade["leverage"])
-                                close_real_position_by_market(symbol, "buy", amount)
-                            close_trade(trade, price, "Hit TP")
-                except Exception as e:
-                    logging.error(f"Monitoring error for {trade.get('id')}: {e}\n{traceback.format_exc()}")
-            time.sleep(5)
-        except Exception as e:
-            logging.error(f"monitor loop error: {e}\n{traceback.format_exc()}")
-            time.sleep(5)
+
+def spawn_local_workers(count, address, authkey, rate=PUBLIC_RATE_LIMIT):
+    """
+    Start `count` worker processes on this host pointed at the leader, each limited to
+    `rate` public requests per second.
+    """
+    env = dict(os.environ, BOT_ROLE="worker", BOT_CLUSTER_KEY=authkey.decode(), BOT_PUBLIC_RATE_LIMIT=str(rate))
+    target = address if isinstance(address, str) else f"{address[0]}:{address[1]}"
+    return [subprocess.Popen([sys.executable, os.path.abspath(__file__), "worker", "--connect", target,
+                              "--id", f"local-{i}"], env=env) for i in range(count)]
+
+
+class CandleScheduler:
+    """
+    Plans scan cycles at candle closes: each active timeframe is due CANDLE_CLOSE_DELAY
+    seconds after its candle closes, and timeframes closing at the same moment (every 15m
+    close is also a 5m and 1m close) share a single cycle. Closes missed while a cycle
+    overran are folded into the next run instead of queueing up.
+    """
+    def __init__(self, clock=time.time, delay=CANDLE_CLOSE_DELAY):
+        self.clock = clock
+        self.delay = delay
+        self.next_close = {}  # timeframe -> next candle close to evaluate, ms
+
+    def _following_close(self, tf, now_ms):
+        step = timeframe_ms(tf)
+        return (now_ms // step + 1) * step
+
+    def _sync(self, now_ms):
+        active = tenants.active_timeframes()
+        for tf in list(self.next_close):
+            if tf not in active:
+                del self.next_close[tf]
+        for tf in active:
+            if tf not in self.next_close:
+                self.next_close[tf] = self._following_close(tf, now_ms)
+
+    def plan(self, now=None):
+        """
+        Upcoming runs as [(run_at_seconds, [timeframes])], earliest first.
+        """
+        now_ms = int((self.clock() if now is None else now) * 1000)
+        self._sync(now_ms)
+        runs = {}
+        for tf, close_ms in self.next_close.items():
+            runs.setdefault(close_ms / 1000 + self.delay, []).append(tf)
+        return sorted((run_at, sorted(tfs, key=timeframe_ms)) for run_at, tfs in runs.items())
+
+    def due(self, now=None):
+        """
+        Timeframes whose close is due at `now`; their next close is scheduled from `now`,
+        so a late run covers every close it missed.
+        """
+        now = self.clock() if now is None else now
+        now_ms = int(now * 1000)
+        self._sync(now_ms)
+        delay_ms = int(self.delay * 1000)
+        due = [tf for tf, close_ms in self.next_close.items() if close_ms + delay_ms <= now_ms]
+        for tf in due:
+            self.next_close[tf] = self._following_close(tf, now_ms - delay_ms)
+        return sorted(due, key=timeframe_ms)
+
+    def seconds_until_next(self, now=None):
+        now = self.clock() if now is None else now
+        plan = self.plan(now)
+        return max(0.0, plan[0][0] - now) if plan else None
+
+
+scheduler = CandleScheduler()
+
+
+def format_schedule_text(limit=5):
+    plan = scheduler.plan()
+    if not plan:
+        return "No active timeframes."
+    lines = [f"{datetime.utcfromtimestamp(run_at).strftime('%H:%M:%S')} UTC: {', '.join(tfs)}" for run_at, tfs in plan[:limit]]
+    return "🕒 Next scans:\n" + "\n".join(lines)
 
 
 def check_signals_loop():
     while True:
         try:
-            check_signals_once()
-            time.sleep(CHECK_INTERVAL)
+            wait = scheduler.seconds_until_next()
+            if wait is None:
+                time.sleep(5)
+                continue
+            time.sleep(wait)
+            tfs = scheduler.due()
+            if tfs:
+                check_signals_once(tfs)
         except Exception as e:
             logging.error(f"check_signals_loop error: {e}\n{traceback.format_exc()}")
             time.sleep(5)
 
 # ---------------- Mode & helpers ----------------
-def mode_status():
-    return "Virtual" if TRADE_MODE == "virtual" else "Real"
+def mode_status(tenant):
+    return "Virtual" if tenant.trade_mode == "virtual" else "Real"
 
 
-def format_settings_text():
-    return (f"⚙️ Settings:\nSymbols: {', '.join(SYMBOLS)}\nTFs: {', '.join(ACTIVE_TF)}\nSize: {INVEST_AMOUNT}$\nLeverage: {LEVERAGE}x\nMode: {mode_status()}")
+def format_settings_text(tenant):
+    return (f"⚙️ Settings:\nSymbols: {', '.join(tenant.symbols)}\nTFs: {', '.join(tenant.active_tf)}\nSize: {tenant.invest_amount}$\n"
+            f"Leverage: {tenant.leverage}x\nMode: {mode_status(tenant)}")
 
 # ---------------- Telegram handlers (async) ----------------
+def tenant_of(update):
+    # every chat talking to the bot gets its own settings and virtual portfolio
+    return tenants.get(update.effective_chat.id, create=True)
+
+
 async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global _last_chat_id
-    _last_chat_id = update.effective_chat.id
-    await update.message.reply_text("Bot started. " + format_settings_text())
+    await update.message.reply_text("Bot started. " + format_settings_text(tenant_of(update)))
 
 
 async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "Commands:\n"
         "/start\n/help\n/settings\n/strategy\n/panel\n/mode\n"
-        "/tfs\n/amount N\n/leverage N\n/add_symbol SYMBOL\n/remove_symbol SYMBOL\n/open\n/closed\n/balance\n/force_check"
+        "/tfs\n/resample on|off\n/amount N\n/leverage N\n/add_symbol SYMBOL\n/remove_symbol SYMBOL\n/open\n/closed\n/balance\n/force_check\n/scan_stats\n/stats\n/schedule\n/notify_stats\n/reconcile"
     )
 
 
 async def settings_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(format_settings_text())
+    await update.message.reply_text(format_settings_text(tenant_of(update)))
 
 
 async def strategy_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -580,10 +3318,11 @@ async def strategy_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def panel_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = tenant_of(update)
     kb = []
     row = []
     for tf in ALL_TIMEFRAMES:
-        text = f"{'❌' if tf in ACTIVE_TF else '✅'} {tf}"
+        text = f"{'❌' if tf in tenant.active_tf else '✅'} {tf}"
         cb = f"tf_toggle:{tf}"
         row.append(InlineKeyboardButton(text, callback_data=cb))
         if len(row) == 2:
@@ -596,20 +3335,33 @@ async def panel_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def mode_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(f"Mode: {mode_status()}\nUse /panel for quick buttons.")
+    await update.message.reply_text(f"Mode: {mode_status(tenant_of(update))}\nUse /panel for quick buttons.")
 
 
 async def tfs_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(f"Active TFs: {', '.join(ACTIVE_TF)}")
+    await update.message.reply_text(f"Active TFs: {', '.join(tenant_of(update).active_tf)}")
+
+
+async def resample_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    global RESAMPLE_FROM_BASE
+    # the candle cache is shared by every tenant, so only the owner switches it
+    if context.args and context.args[0].lower() in ("on", "off") and tenant_of(update).is_owner:
+        RESAMPLE_FROM_BASE = context.args[0].lower() == "on"
+        save_settings()
+    state = f"on (derived from {BASE_TIMEFRAME})" if RESAMPLE_FROM_BASE else "off"
+    s = candle_cache.stats
+    await update.message.reply_text(f"Resampling: {state}\nResampled updates: {s['resampled']}\n"
+                                    f"Checks vs exchange: {s['verify_checks']} (mismatched candles: {s['verify_mismatches']})\n"
+                                    "Usage: /resample on|off")
 
 
 async def amount_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global INVEST_AMOUNT
+    tenant = tenant_of(update)
     try:
         if context.args:
-            INVEST_AMOUNT = float(context.args[0])
-            save_settings()
-            await update.message.reply_text(f"Size set to {INVEST_AMOUNT}$")
+            tenant.invest_amount = float(context.args[0])
+            tenants.changed()
+            await update.message.reply_text(f"Size set to {tenant.invest_amount}$")
         else:
             await update.message.reply_text("Usage: /amount N (e.g. /amount 20)")
     except Exception as e:
@@ -617,12 +3369,12 @@ async def amount_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def leverage_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global LEVERAGE
+    tenant = tenant_of(update)
     try:
         if context.args:
-            LEVERAGE = int(context.args[0])
-            save_settings()
-            await update.message.reply_text(f"Leverage set to {LEVERAGE}x")
+            tenant.leverage = int(context.args[0])
+            tenants.changed()
+            await update.message.reply_text(f"Leverage set to {tenant.leverage}x")
         else:
             await update.message.reply_text("Usage: /leverage N (e.g. /leverage 10)")
     except Exception as e:
@@ -630,12 +3382,19 @@ async def leverage_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def add_symbol_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = tenant_of(update)
     try:
         if context.args:
             sym = context.args[0].upper()
-            if sym not in SYMBOLS:
-                SYMBOLS.append(sym)
-                save_settings()
+            # resolving may download the market catalog; keep it off the event loop
+            name = await asyncio.get_running_loop().run_in_executor(None, symbol_resolver.display_name, sym)
+            if name is None:
+                await update.message.reply_text(f"Symbol {sym} is not listed on Bitget futures.")
+                return
+            sym = name
+            if sym not in tenant.symbols:
+                tenant.symbols.append(sym)
+                tenants.changed()
                 await update.message.reply_text(f"Added symbol {sym}")
             else:
                 await update.message.reply_text("Symbol already present.")
@@ -646,12 +3405,19 @@ async def add_symbol_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def remove_symbol_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = tenant_of(update)
     try:
         if context.args:
             sym = context.args[0].upper()
-            if sym in SYMBOLS:
-                SYMBOLS.remove(sym)
-                save_settings()
+            if sym in tenant.symbols:
+                tenant.symbols.remove(sym)
+                tenants.changed()
+                # candles and indicator state are shared: keep them while another chat follows the symbol
+                if not tenants.following(sym):
+                    candle_cache.drop(sym)
+                    with indicator_states_lock:
+                        for key in [k for k in indicator_states if k[0] == sym]:
+                            indicator_states.pop(key, None)
                 await update.message.reply_text(f"Removed symbol {sym}")
             else:
                 await update.message.reply_text("Symbol not found.")
@@ -662,60 +3428,115 @@ async def remove_symbol_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def open_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    with state_lock:
-        if not open_trades:
-            await update.message.reply_text("No open trades.")
-            return
-        lines = []
-        for t in open_trades:
-            lines.append(f"{t['id']} | {t['symbol']} {t['direction']} entry={t['entry_price']} status={t['status']}")
-        await update.message.reply_text("\n".join(lines))
+    chat = tenant_of(update).chat_id
+    trades = [t for t in trade_snapshot.open_list() if t.get("tenant") == chat]
+    if not trades:
+        await update.message.reply_text("No open trades.")
+        return
+    lines = []
+    for t in trades:
+        lines.append(f"{t['id']} | {t['symbol']} {t['direction']} entry={t['entry_price']} status={t['status']}")
+    await update.message.reply_text("\n".join(lines))
 
 
 async def closed_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    with state_lock:
-        if not closed_trades:
-            await update.message.reply_text("No closed trades.")
-            return
-        lines = []
-        for t in closed_trades[-50:]:
-            lines.append(f"{t['id']} | {t['symbol']} {t['direction']} pnl={t.get('pnl_percent')}% reason={t.get('close_reason')}")
-        await update.message.reply_text("\n".join(lines))
+    trades = trade_snapshot.closed_list(last=50, tenant=tenant_of(update).chat_id)
+    if not trades:
+        await update.message.reply_text("No closed trades.")
+        return
+    lines = []
+    for t in trades:
+        lines.append(f"{t['id']} | {t['symbol']} {t['direction']} pnl={t.get('pnl_percent')}% reason={t.get('close_reason')}")
+    await update.message.reply_text("\n".join(lines))
 
 
 async def balance_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(f"Virtual balance: {virtual_balance['available']}$ available / total {virtual_balance['total']}$")
+    balance = tenant_of(update).to_dict()["balance"]
+    await update.message.reply_text(f"Virtual balance: {balance['available']}$ available / total {balance['total']}$")
 
 
 async def force_check_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Running signal check...")
+    future, joined = forced_scan.start()
+    cancel_kb = InlineKeyboardMarkup([[InlineKeyboardButton("Cancel", callback_data="force_check_cancel")]])
+    title = "Joined the running signal check" if joined else "Running signal check"
+    message = await update.message.reply_text(f"{title}...", reply_markup=cancel_kb)
+    waiter = asyncio.wrap_future(future)
+    shown = None
+    while not waiter.done():
+        await asyncio.wait({waiter}, timeout=FORCE_CHECK_PROGRESS_INTERVAL)
+        done, total = forced_scan.progress
+        if not waiter.done() and total and (done, total) != shown:
+            shown = (done, total)
+            try:
+                await message.edit_text(f"{title}... {done}/{total}", reply_markup=cancel_kb)
+            except Exception:
+                pass
+    try:
+        stats = waiter.result()
+    except Exception as e:
+        text = f"Error running check: {e}"
+    else:
+        if stats and stats.get("cancelled"):
+            text = "Check cancelled."
+        elif stats:
+            text = f"Check complete: {stats['pairs']} pairs in {stats['cycle_seconds']}s (errors: {stats['errors']})."
+        else:
+            text = "Check complete."
+    try:
+        await message.edit_text(text)
+    except Exception:
+        await update.message.reply_text(text)
+
+
+async def scan_stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(format_scan_stats_text())
+
+
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(format_metrics_text())
+
+
+async def schedule_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(format_schedule_text())
+
+
+async def notify_stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(format_notifier_stats_text())
+
+
+async def reconcile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not tenant_of(update).is_owner:
+        await update.message.reply_text("Reconciliation covers the owner's real trades only.")
+        return
     try:
-        check_signals_once()
-        await update.message.reply_text("Check complete.")
+        # one bulk positions call; keep it off the event loop
+        report = await asyncio.get_running_loop().run_in_executor(None, reconciler.check)
     except Exception as e:
-        await update.message.reply_text(f"Error running check: {e}")
+        await update.message.reply_text(f"Reconcile failed: {e}")
+        return
+    await update.message.reply_text(format_reconcile_text(report or reconciler.last_report))
 
 
 # CallbackQuery handler for panel buttons
 async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global ACTIVE_TF, TRADE_MODE
     query = update.callback_query
     if not query:
         return
+    tenant = tenant_of(update)
     data = query.data or ""
     await query.answer()  # acknowledge
     if data.startswith("tf_toggle:"):
         tf = data.split(":", 1)[1]
-        if tf in ACTIVE_TF:
-            ACTIVE_TF.remove(tf)
+        if tf in tenant.active_tf:
+            tenant.active_tf.remove(tf)
         else:
             if tf in ALL_TIMEFRAMES:
-                ACTIVE_TF.append(tf)
+                tenant.active_tf.append(tf)
         # update keyboard: edit message to show new state
         kb = []
         row = []
         for t in ALL_TIMEFRAMES:
-            text = f"{'❌' if t in ACTIVE_TF else '✅'} {t}"
+            text = f"{'❌' if t in tenant.active_tf else '✅'} {t}"
             cb = f"tf_toggle:{t}"
             row.append(InlineKeyboardButton(text, callback_data=cb))
             if len(row) == 2:
@@ -724,7 +3545,7 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
         if row:
             kb.append(row)
         kb.append([InlineKeyboardButton("Set Virtual", callback_data="mode_virtual"), InlineKeyboardButton("Set Real", callback_data="mode_real")])
-        save_settings()
+        tenants.changed()
         try:
             await query.edit_message_text("Panel updated:", reply_markup=InlineKeyboardMarkup(kb))
         except Exception:
@@ -733,8 +3554,8 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
             except Exception:
                 pass
     elif data == "mode_virtual":
-        TRADE_MODE = "virtual"
-        save_settings()
+        tenant.trade_mode = "virtual"
+        tenants.changed()
         try:
             await query.edit_message_text("Mode set to Virtual")
         except Exception:
@@ -743,13 +3564,23 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
             except Exception:
                 pass
     elif data == "mode_real":
-        TRADE_MODE = "real"
-        save_settings()
+        # the exchange keys belong to the owner; other chats trade virtually only
+        text = "Real mode is only available to the bot owner."
+        if tenant.is_owner:
+            tenant.trade_mode = "real"
+            tenants.changed()
+            text = "Mode set to Real"
         try:
-            await query.edit_message_text("Mode set to Real")
+            await query.edit_message_text(text)
         except Exception:
             try:
-                await query.message.reply_text("Mode set to Real")
+                await query.message.reply_text(text)
+            except Exception:
+                pass
+    elif data == "force_check_cancel":
+        if not forced_scan.cancel():
+            try:
+                await query.edit_message_text("No check is running.")
             except Exception:
                 pass
     else:
@@ -763,14 +3594,286 @@ async def echo_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Unknown command. Use /help to see commands.")
 
 
-# ---------------- Main entry ----------------
-def main():
-    # Re-init exchanges in case keys were modified externally
-    init_exchanges()
+# ---------------- Backtesting ----------------
+def history_columns(symbol, tf):
+    """
+    Stored candles for a pair as memory-mapped (time_ms, close, high, low, open) arrays.
+    """
+    cols = history_store.read(symbol, tf)
+    return cols["time"], cols["close"], cols["high"], cols["low"], cols["open"]
+
+
+def cached_column(cache, key, build):
+    if cache is None:
+        return build()
+    if key not in cache:
+        cache[key] = build()
+    return cache[key]
+
+
+def backtest_signal_codes(close, high, low, rsi_window=None, sma_window=None, level_lookback=None, level_threshold=None, cache=None):
+    """
+    Vectorized signal generation: for every bar, 0 if no rule fires, else 1 + index into SIGNAL_RULES.
+    Indicator columns are memoized in cache (if given) under their own parameter only, so a sweep
+    recomputes just the columns that the swept parameter affects.
+    """
+    rsi_window = RSI_WINDOW if rsi_window is None else rsi_window
+    sma_window = SMA200 if sma_window is None else sma_window
+    level_lookback = LEVEL_LOOKBACK if level_lookback is None else level_lookback
+    rsi = cached_column(cache, ("rsi", rsi_window),
+                        lambda: ta_momentum.RSIIndicator(pd.Series(close), window=rsi_window).rsi().to_numpy(dtype=float))
+    sma = cached_column(cache, ("sma", sma_window),
+                        lambda: ta_trend.SMAIndicator(pd.Series(close), window=sma_window).sma_indicator().to_numpy(dtype=float))
+    support = cached_column(cache, ("support", level_lookback),
+                            lambda: pd.Series(low).rolling(level_lookback, min_periods=1).min().to_numpy(dtype=float))
+    resistance = cached_column(cache, ("resistance", level_lookback),
+                               lambda: pd.Series(high).rolling(level_lookback, min_periods=1).max().to_numpy(dtype=float))
+    conditions = signal_conditions(close, rsi, sma, support, resistance, level_threshold)
+    return np.select(conditions, np.arange(1, len(SIGNAL_RULES) + 1), 0)
+
+
+def resolve_exit(direction, start, sl_price, tp_price, high, low, opens=None, chunk=256):
+    """
+    First bar at or after start whose high/low crosses SL or TP, searched in growing NumPy chunks.
+    Returns (index, reason, fill_price) or (None, None, None). A bar crossing both counts as SL.
+    Exits fill at the level, or at the bar's open if it gapped through, like TriggerColumns.
+    """
+    n = len(high)
+    i = start
+    while i < n:
+        j = min(n, i + chunk)
+        if direction == "LONG":
+            sl_hit = low[i:j] <= sl_price
+            tp_hit = high[i:j] >= tp_price
+        else:
+            sl_hit = high[i:j] >= sl_price
+            tp_hit = low[i:j] <= tp_price
+        hit = sl_hit | tp_hit
+        if hit.any():
+            k = int(hit.argmax())
+            reason, level = ("Hit SL", sl_price) if sl_hit[k] else ("Hit TP", tp_price)
+            price = level
+            if opens is not None:
+                first = float(opens[i + k])
+                beyond = (first <= level) if (direction == "LONG") == (reason == "Hit SL") else (first >= level)
+                price = first if beyond else level
+            return i + k, reason, price
+        i = j
+        chunk *= 2
+    return None, None, None
+
+
+def simulate_trades(codes, close, high, low, sl_pct=None, tp_pct=None, opens=None):
+    """
+    Walk the signal codes one open trade at a time, like the live duplicate check.
+    Entries fill at the signal bar's close, exits as in resolve_exit; yields (entry_idx, exit_idx_or_None, code, exit_reason, exit_price).
+    """
+    sl_pct = SL_PCT if sl_pct is None else sl_pct
+    tp_pct = TP_PCT if tp_pct is None else tp_pct
+    signal_idx = np.flatnonzero(codes)
+    pos = 0
+    while pos < len(signal_idx):
+        i = int(signal_idx[pos])
+        code = int(codes[i])
+        direction = SIGNAL_RULES[code - 1][0]
+        entry = float(close[i])
+        sl_price = entry * (1 - sl_pct) if direction == "LONG" else entry * (1 + sl_pct)
+        tp_price = entry * (1 + tp_pct) if direction == "LONG" else entry * (1 - tp_pct)
+        j, reason, exit_price = resolve_exit(direction, i + 1, sl_price, tp_price, high, low, opens)
+        if j is None:
+            yield i, None, code, None, None
+            return
+        yield i, j, code, reason, exit_price
+        # the pair is free again once the exit bar is reached
+        pos = int(np.searchsorted(signal_idx, j, side="left"))
+
+
+def backtest_pair(symbol, tf, columns, invest=None, leverage=None, sl_pct=None, tp_pct=None, level_threshold=None):
+    """
+    Replay the strategy over (time_ms, close, high, low, open) arrays for one pair; exits fill at the
+    SL/TP price, or at the open of a bar that gapped through it.
+    Returns (closed_trades, still_open_trade_or_None) with the same records as open_trade/close_trade.
+    """
+    invest = INVEST_AMOUNT if invest is None else invest
+    times, close, high, low, opens = columns
+    codes = backtest_signal_codes(close, high, low, level_threshold=level_threshold)
+    trades = []
+    for i, j, code, exit_reason, exit_price in simulate_trades(codes, close, high, low, sl_pct, tp_pct, opens):
+        direction, reason = SIGNAL_RULES[code - 1]
+        price = float(close[i])
+        amount_base = size_from_usd(symbol, price, invest, LEVERAGE if leverage is None else leverage)
+        trade = build_trade(symbol, direction, price, tf, strategy_source=reason, invest=invest, leverage=leverage,
+                            amount_base=amount_base, opened_ms=int(times[i]), sl_pct=sl_pct, tp_pct=tp_pct)
+        if j is None:
+            return trades, trade
+        trades.append(apply_close(trade, exit_price, exit_reason, closed_ms=int(times[j])))
+    return trades, None
+
+
+def summarize_trades(trades):
+    if not trades:
+        return {"trades": 0, "wins": 0, "win_rate": 0.0, "pnl_cash": 0.0, "max_drawdown": 0.0}
+    ordered = sorted(trades, key=lambda t: t["closed_at"])
+    pnl = np.array([t["pnl_cash"] for t in ordered], dtype=float)
+    equity = np.cumsum(pnl)
+    drawdown = np.maximum.accumulate(np.maximum(equity, 0)) - equity
+    wins = int((pnl > 0).sum())
+    return {
+        "trades": len(ordered),
+        "wins": wins,
+        "win_rate": round(wins / len(ordered) * 100, 2),
+        "pnl_cash": round(float(pnl.sum()), 4),
+        "max_drawdown": round(float(drawdown.max()), 4),
+    }
+
+
+def run_backtest(symbols, tfs, out=None):
+    started = time.perf_counter()
+    all_trades = []
+    bars = 0
+    for symbol in symbols:
+        for tf in tfs:
+            columns = history_columns(symbol, tf)
+            if len(columns[0]) < SMA200:
+                logging.warning(f"No stored history for {symbol} {tf}; run 'download' first.")
+                continue
+            bars += len(columns[0])
+            trades, still_open = backtest_pair(symbol, tf, columns)
+            s = summarize_trades(trades)
+            print(f"{symbol:<12} {tf:<4} bars={len(columns[0]):<8} trades={s['trades']:<5} win={s['win_rate']:>6}% "
+                  f"pnl={s['pnl_cash']:>10}$ dd={s['max_drawdown']}$" + (" (1 open)" if still_open else ""))
+            all_trades.extend(trades)
+    s = summarize_trades(all_trades)
+    print(f"TOTAL trades={s['trades']} win={s['win_rate']}% pnl={s['pnl_cash']}$ dd={s['max_drawdown']}$ "
+          f"({bars} bars in {time.perf_counter() - started:.2f}s)")
+    if out:
+        save_json(out, all_trades)
+    return all_trades
+
+
+# ---------------- Parameter sweep ----------------
+# Workers memory-map the candle columns straight from the history store, so every process
+# shares the same page-cache copy, and keep their own indicator-column cache between tasks.
+_opt_pairs = {}
+_opt_cache = {}
+
+
+def _optimizer_worker_init(pairs):
+    for symbol, tf in pairs:
+        _opt_pairs[f"{symbol} {tf}"] = history_columns(symbol, tf)
+
+
+def optimizer_task(signal_params, exit_grid, leverages, invest):
+    """
+    Evaluate one signal-parameter set over every pair for all (sl, tp) x leverage combinations.
+    Signals depend only on the signal parameters and trade sequences not on leverage,
+    so each is computed once per task.
+    """
+    rsi_window, sma_window, level_lookback, level_threshold = signal_params
+    results = {combo: ([], []) for combo in exit_grid}
+    for key, (times, close, high, low, opens) in _opt_pairs.items():
+        cache = _opt_cache.setdefault(key, {})
+        codes = backtest_signal_codes(close, high, low, rsi_window, sma_window, level_lookback, level_threshold, cache=cache)
+        for sl_pct, tp_pct in exit_grid:
+            pnl, exit_times = results[(sl_pct, tp_pct)]
+            for i, j, code, reason, exit_price in simulate_trades(codes, close, high, low, sl_pct, tp_pct, opens):
+                if j is None:
+                    break
+                pnl.append(pnl_percent(close[i], exit_price, SIGNAL_RULES[code - 1][0]))
+                exit_times.append(times[j])
+
+    rows = []
+    for (sl_pct, tp_pct), (pnl, exit_times) in results.items():
+        pnl = np.asarray(pnl, dtype=float)[np.argsort(np.asarray(exit_times), kind="stable")]
+        for leverage in leverages:
+            cash = pnl * invest * leverage
+            equity = np.cumsum(cash)
+            drawdown = float((np.maximum.accumulate(np.maximum(equity, 0)) - equity).max()) if len(cash) else 0.0
+            wins = int((cash > 0).sum())
+            rows.append({
+                "rsi_window": rsi_window, "sma200": sma_window, "level_lookback": level_lookback,
+                "level_threshold": level_threshold, "sl_pct": sl_pct, "tp_pct": tp_pct, "leverage": leverage,
+                "trades": len(cash), "win_rate": round(wins / len(cash) * 100, 2) if len(cash) else 0.0,
+                "pnl_cash": round(float(cash.sum()), 4), "max_drawdown": round(drawdown, 4),
+            })
+    return rows
+
+
+OPTIMIZER_SORT_KEYS = {
+    "pnl": lambda r: (-r["pnl_cash"], r["max_drawdown"], -r["win_rate"]),
+    "drawdown": lambda r: (r["max_drawdown"], -r["pnl_cash"], -r["win_rate"]),
+    "win_rate": lambda r: (-r["win_rate"], -r["pnl_cash"], r["max_drawdown"]),
+}
+
+
+def run_optimizer(symbols, tfs, grid, workers=None, sort="pnl", top=20, out=None):
+    """
+    Sweep the parameter grid over stored history with a process pool and rank the results.
+    """
+    started = time.perf_counter()
+    pairs = []
+    for symbol in symbols:
+        for tf in tfs:
+            if len(history_columns(symbol, tf)[0]) < max(grid["sma200"]):
+                logging.warning(f"No stored history for {symbol} {tf}; skipped.")
+                continue
+            pairs.append((symbol, tf))
+    if not pairs:
+        print("No history to optimize over; run 'download' first.")
+        return []
+
+    signal_grid = list(itertools.product(grid["rsi_window"], grid["sma200"], grid["level_lookback"], grid["level_threshold"]))
+    exit_grid = list(itertools.product(grid["sl_pct"], grid["tp_pct"]))
+    total = len(signal_grid) * len(exit_grid) * len(grid["leverage"])
+    print(f"Sweeping {total} combinations over {len(pairs)} pairs...")
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_optimizer_worker_init, initargs=(pairs,)) as pool:
+        futures = [pool.submit(optimizer_task, params, exit_grid, grid["leverage"], INVEST_AMOUNT) for params in signal_grid]
+        for done, future in enumerate(as_completed(futures), 1):
+            rows.extend(future.result())
+            if done % max(1, len(futures) // 20) == 0:
+                print(f"  {done}/{len(futures)} signal sets done ({time.perf_counter() - started:.1f}s)")
+
+    rows.sort(key=OPTIMIZER_SORT_KEYS[sort])
+    for r in rows[:top]:
+        print(f"pnl={r['pnl_cash']:>10}$ dd={r['max_drawdown']:>9}$ win={r['win_rate']:>6}% trades={r['trades']:<6} "
+              f"rsi={r['rsi_window']} sma200={r['sma200']} lookback={r['level_lookback']} thr={r['level_threshold']} "
+              f"sl={r['sl_pct']} tp={r['tp_pct']} lev={r['leverage']}")
+    print(f"{len(rows)} combinations in {time.perf_counter() - started:.1f}s")
+    if out:
+        pd.DataFrame(rows).to_csv(out, index=False)
+    return rows
 
-    app = Application.builder().token(TG_BOT_TOKEN).build()
 
-    # Register command handlers
+# ---------------- Main entry ----------------
+def start_cluster(workers=0, listen=None):
+    """
+    Make this process the leader of a sharded setup: listen for workers (at `listen`, or a
+    local socket) and spawn `workers` of them here. They all share this host's IP, so the
+    public request budget is split evenly between the leader and its local workers.
+    Returns the spawned processes.
+    """
+    address = parse_cluster_address(listen or CLUSTER_ADDRESS)
+    key = os.environ.get("BOT_CLUSTER_KEY")
+    if key is None:
+        if not isinstance(address, str):
+            logging.warning("BOT_CLUSTER_KEY is not set; remote workers cannot join.")
+        key = os.urandom(16).hex()
+    if isinstance(address, str) and os.path.exists(address):
+        os.unlink(address)  # stale socket from a previous run
+    cluster.address, cluster.authkey = address, key.encode()
+    cluster.start()
+    share = PUBLIC_RATE_LIMIT / (workers + 1)
+    public_rate_limiter.set_rate(share)
+    return spawn_local_workers(workers, address, cluster.authkey, rate=share)
+
+
+def build_application(builder=None):
+    app = (builder or Application.builder().token(TG_BOT_TOKEN)).build()
+
+    # Register command handlers; /force_check waits for a whole scan, so it runs as its
+    # own task and the Cancel button (and joining /force_check) are handled meanwhile
     app.add_handler(CommandHandler("start", start_cmd))
     app.add_handler(CommandHandler("help", help_cmd))
     app.add_handler(CommandHandler("settings", settings_cmd))
@@ -778,6 +3881,7 @@ def main():
     app.add_handler(CommandHandler("panel", panel_cmd))
     app.add_handler(CommandHandler("mode", mode_cmd))
     app.add_handler(CommandHandler("tfs", tfs_cmd))
+    app.add_handler(CommandHandler("resample", resample_cmd))
     app.add_handler(CommandHandler("amount", amount_cmd))
     app.add_handler(CommandHandler("leverage", leverage_cmd))
     app.add_handler(CommandHandler("add_symbol", add_symbol_cmd))
@@ -785,21 +3889,114 @@ def main():
     app.add_handler(CommandHandler("open", open_cmd))
     app.add_handler(CommandHandler("closed", closed_cmd))
     app.add_handler(CommandHandler("balance", balance_cmd))
-    app.add_handler(CommandHandler("force_check", force_check_cmd))
+    app.add_handler(CommandHandler("force_check", force_check_cmd, block=False))
+    app.add_handler(CommandHandler("scan_stats", scan_stats_cmd))
+    app.add_handler(CommandHandler("stats", stats_cmd))
+    app.add_handler(CommandHandler("schedule", schedule_cmd))
+    app.add_handler(CommandHandler("notify_stats", notify_stats_cmd))
+    app.add_handler(CommandHandler("reconcile", reconcile_cmd))
 
     # Callback (inline buttons)
     app.add_handler(CallbackQueryHandler(callback_query_handler))
 
     # Fallback for unknown texts
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, echo_text))
+    return app
+
+
+def main(workers=0, listen=None):
+    load_state()
+    # Re-init exchanges in case keys were modified externally
+    init_exchanges()
+    procs = start_cluster(workers, listen) if workers or listen else []
+    # the saved book is not trusted as is: before trading, real trades are matched to the
+    # exchange's positions (nothing is in flight yet, so divergences are repaired at once)
+    try:
+        reconciler.check(confirmations=1)
+    except Exception as e:
+        logging.error(f"Startup reconciliation failed: {e}")
+
+    app = build_application()
 
     # Start background threads (daemon)
     threading.Thread(target=check_signals_loop, daemon=True).start()
     threading.Thread(target=monitor_open_trades_loop, daemon=True).start()
+    threading.Thread(target=reconcile_loop, daemon=True).start()
+    price_feed.start()
+    try:
+        start_metrics_server()
+    except OSError as e:
+        logging.error(f"Metrics endpoint not started: {e}")
 
     logging.info("Bot started. Waiting for commands...")
     app.run_polling()
+    cluster.stop()
+    for proc in procs:
+        proc.terminate()
+    if not journal.flush(timeout=10):
+        logging.error("Trade journal still had unwritten events at shutdown.")
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Bitget signal bot")
+    sub = parser.add_subparsers(dest="command")
+    p = sub.add_parser("bot", help="run the Telegram bot and trading threads (default)")
+    p.add_argument("--workers", type=int, default=0, help="shard scanning over this many local worker processes")
+    p.add_argument("--listen", default=None, help="accept workers at this socket path or host:port")
+    p = sub.add_parser("worker", help="serve one shard of the scan for a leader (set BOT_ROLE=worker, BOT_CLUSTER_KEY)")
+    p.add_argument("--connect", default=CLUSTER_ADDRESS, help="leader socket path or host:port")
+    p.add_argument("--id", default=None)
+    p = sub.add_parser("download", help="backfill the candle history store (gaps and new candles only)")
+    p.add_argument("--symbols", nargs="+", default=None)
+    p.add_argument("--tfs", nargs="+", default=None)
+    p.add_argument("--days", type=int, default=30)
+    p = sub.add_parser("backtest", help="replay the strategy over stored history")
+    p.add_argument("--symbols", nargs="+", default=None)
+    p.add_argument("--tfs", nargs="+", default=None)
+    p.add_argument("--out", default=None, help="write closed trade records to this JSON file")
+    p = sub.add_parser("optimize", help="sweep strategy parameters over stored history")
+    p.add_argument("--symbols", nargs="+", default=None)
+    p.add_argument("--tfs", nargs="+", default=None)
+    p.add_argument("--rsi", nargs="+", type=int, default=[RSI_WINDOW])
+    p.add_argument("--sma200", nargs="+", type=int, default=[SMA200])
+    p.add_argument("--lookback", nargs="+", type=int, default=[LEVEL_LOOKBACK])
+    p.add_argument("--threshold", nargs="+", type=float, default=[LEVEL_THRESHOLD_PCT])
+    p.add_argument("--sl", nargs="+", type=float, default=[SL_PCT])
+    p.add_argument("--tp", nargs="+", type=float, default=[TP_PCT])
+    p.add_argument("--leverage", nargs="+", type=int, default=[LEVERAGE])
+    p.add_argument("--workers", type=int, default=None)
+    p.add_argument("--sort", choices=sorted(OPTIMIZER_SORT_KEYS), default="pnl")
+    p.add_argument("--top", type=int, default=20)
+    p.add_argument("--out", default=None, help="write all results to this CSV file")
+    args = parser.parse_args(argv)
+
+    owner = tenants.owner()  # history commands default to the owner's pairs
+    if args.command is None:
+        main()
+    elif args.command == "bot":
+        main(workers=args.workers, listen=args.listen)
+    elif args.command == "worker":
+        if CLUSTER_ROLE != "worker":
+            parser.error("workers must run with BOT_ROLE=worker so they never touch trade state")
+        run_worker(parse_cluster_address(args.connect), os.environ["BOT_CLUSTER_KEY"].encode(), args.id)
+    elif args.command == "download":
+        for symbol in args.symbols or owner.symbols:
+            for tf in args.tfs or owner.active_tf:
+                try:
+                    added = history_store.backfill(symbol, tf, days=args.days)
+                    print(f"{symbol} {tf}: +{added} candles, {len(history_store.gaps(symbol, tf))} gaps left")
+                except Exception as e:
+                    logging.error(f"Download failed for {symbol} {tf}: {e}")
+    elif args.command == "backtest":
+        run_backtest(args.symbols or owner.symbols, args.tfs or owner.active_tf, out=args.out)
+    elif args.command == "optimize":
+        grid = {
+            "rsi_window": args.rsi, "sma200": args.sma200, "level_lookback": args.lookback,
+            "level_threshold": args.threshold, "sl_pct": args.sl, "tp_pct": args.tp, "leverage": args.leverage,
+        }
+        run_optimizer(args.symbols or owner.symbols, args.tfs or owner.active_tf, grid, workers=args.workers,
+                      sort=args.sort, top=args.top, out=args.out)
 
 
 if __name__ == "__main__":
-    main()
+    cli()
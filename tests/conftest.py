@@ -0,0 +1,95 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import ccxt
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# main.py loads and writes its state files relative to the working directory;
+# keep the tests away from the real ones.
+os.chdir(tempfile.mkdtemp(prefix="torg_bot_tests_"))
+
+import main  # noqa: E402  (after the chdir)
+
+
+class FakeExchange:
+    """
+    ccxt-shaped private client: records calls, optionally sleeps per order and fails the
+    first `drop` create_order calls with a network error.
+    """
+    def __init__(self, delay=0.0, drop=0, reached=False):
+        self.delay = delay
+        self.drop = drop
+        self.reached = reached  # a dropped request still reached the exchange
+        self.orders = []
+        self.leverage_calls = []
+        self.lock = threading.Lock()
+
+    def set_leverage(self, leverage, market):
+        self.leverage_calls.append((leverage, market))
+
+    def create_order(self, market, type, side, amount, price, params):
+        time.sleep(self.delay)
+        order = {"id": str(len(self.orders)), "symbol": market, "side": side, "amount": amount,
+                 "clientOrderId": params["clientOid"], "params": params, "at": time.monotonic()}
+        with self.lock:
+            if self.drop:
+                self.drop -= 1
+                if self.reached:
+                    self.orders.append(order)
+                raise ccxt.RequestTimeout("timed out")
+            self.orders.append(order)
+        return order
+
+    def fetch_order(self, id, market, params):
+        for order in self.orders:
+            if order["clientOrderId"] == params["clientOrderId"]:
+                return order
+        raise ccxt.OrderNotFound("no such order")
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    monkeypatch.setattr(main.symbol_resolver, "resolve", lambda symbol: f"{symbol}:USDT")
+    exchange = FakeExchange()
+    return main.OrderExecutor(workers=8, exchange=lambda: exchange), exchange
+
+
+class PositionsExchange(FakeExchange):
+    def __init__(self):
+        super().__init__()
+        self.positions = []
+        self.fills = {}
+        self.position_calls = []
+
+    def fetch_positions(self, markets=None):
+        self.position_calls.append(markets)
+        return [p for p in self.positions if markets is None or p["symbol"] in markets]
+
+    def fetch_my_trades(self, market, since=None):
+        return self.fills.get(market, [])
+
+
+@pytest.fixture
+def real(tmp_path, monkeypatch):
+    exchange = PositionsExchange()
+    monkeypatch.setattr(main.symbol_resolver, "resolve", lambda symbol: f"{symbol}:USDT")
+    monkeypatch.setattr(main, "order_executor", main.OrderExecutor(exchange=lambda: exchange))
+    monkeypatch.setattr(main, "get_private_exchange", lambda: exchange)
+    monkeypatch.setattr(main, "tg_send", lambda chat, text: None)
+    monkeypatch.setattr(main, "TG_CHAT_ID", "1")
+    registry = main.TenantRegistry(path=str(tmp_path / "tenants.json"))
+    owner = registry.owner()
+    owner.symbols, owner.active_tf, owner.trade_mode = ["BTC/USDT", "ETH/USDT"], ["1m"], "real"
+    monkeypatch.setattr(main, "tenants", registry)
+    monkeypatch.setattr(main, "journal", main.TradeJournal(path=str(tmp_path / "trades_journal.jsonl")))
+    monkeypatch.setattr(main, "open_trades", main.TradeBook())
+    monkeypatch.setattr(main, "closed_trades", [])
+    monkeypatch.setattr(main, "trade_snapshot", main.TradeSnapshot())
+    monkeypatch.setattr(main, "EXCHANGE_SL_TP", True)
+    return exchange
@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("ta")
+
+import main
+
+
+def trending_walk(n, seed=3):
+    # alternating up and down regimes, so every rule fires somewhere
+    rnd = random.Random(seed)
+    price, rows = 100.0, []
+    for i in range(n):
+        drift = 0.002 if (i // 150) % 2 else -0.002
+        close = price * (1 + drift + rnd.uniform(-0.01, 0.01))
+        rows.append([i * 60000, price, max(price, close) * 1.002, min(price, close) * 0.998, close, 1.0])
+        price = close
+    return rows
+
+
+def test_backtest_codes_match_the_live_rules():
+    rows = trending_walk(3000)
+    close, high, low = (main.np.array([r[k] for r in rows]) for k in (4, 2, 3))
+    codes = main.backtest_signal_codes(close, high, low)
+
+    state = main.IndicatorState()
+    live = []
+    for i, row in enumerate(rows):
+        state.update(row[0], row[4])
+        support, resistance = main.levels_from_rows(rows[:i + 1])
+        hits = main.signal_conditions(row[4], state.rsi(), state.sma(main.SMA200), support, resistance)
+        live.append(next((k + 1 for k, hit in enumerate(hits) if hit), 0))
+    assert codes.tolist() == live
+    assert set(live) == {0, 1, 2, 3, 4}
+
+
+def flat_bars(n):
+    return main.np.full(n, 100.0), main.np.full(n, 100.5), main.np.full(n, 99.5)
+
+
+def test_bar_crossing_both_levels_exits_at_sl():
+    close, high, low = flat_bars(3)
+    high[1], low[1] = 105.0, 97.0
+    codes = main.np.array([1, 0, 0])
+    trades = list(main.simulate_trades(codes, close, high, low, sl_pct=0.02, tp_pct=0.04))
+    assert trades == [(0, 1, 1, "Hit SL", 98.0)]
+
+
+def test_pair_reenters_from_the_exit_bar():
+    close, high, low = flat_bars(6)
+    low[2] = 97.0  # LONG from bar 0 stopped out in bar 2
+    codes = main.np.array([1, 1, 1, 1, 0, 0])  # bar 1 is skipped: the trade is still open
+    trades = list(main.simulate_trades(codes, close, high, low, sl_pct=0.02, tp_pct=0.04))
+    assert trades == [(0, 2, 1, "Hit SL", 98.0), (2, None, 1, None, None)]
@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+import main
+
+SYMBOLS = [f"S{i}/USDT" for i in range(200)]
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_ring_moves_only_the_new_workers_share():
+    ring = main.HashRing()
+    for node in ("a", "b", "c"):
+        ring.add(node)
+    before = {s: ring.owner(s) for s in SYMBOLS}
+    ring.add("d")
+    after = {s: ring.owner(s) for s in SYMBOLS}
+    moved = [s for s in SYMBOLS if before[s] != after[s]]
+    assert all(after[s] == "d" for s in moved)
+    assert 0.1 < len(moved) / len(SYMBOLS) < 0.45
+    ring.remove("d")
+    assert {s: ring.owner(s) for s in SYMBOLS} == before
+
+
+@pytest.fixture
+def leader(tmp_path, monkeypatch):
+    released = []
+    gate = threading.Event()
+    calls = dict(main.CLUSTER_CALLS)
+    calls["echo"] = lambda value: value
+    calls["slow"] = lambda value: gate.wait(5) and value
+    calls["release"] = lambda symbols: released.extend(symbols)
+    monkeypatch.setattr(main, "CLUSTER_CALLS", calls)
+    coordinator = main.Coordinator(address=str(tmp_path / "cluster.sock"), authkey=b"secret")
+    monkeypatch.setattr(main, "cluster", coordinator)
+    coordinator.start()
+
+    def join(worker_id):
+        threading.Thread(target=main.run_worker, args=(coordinator.address, b"secret", worker_id), daemon=True).start()
+        wait_for(lambda: worker_id in coordinator.workers())
+
+    yield coordinator, join, released, gate
+    gate.set()
+    coordinator.stop()
+
+
+def test_calls_route_to_owner_and_survive_a_lost_worker(leader):
+    coordinator, join, released, gate = leader
+    assert main.shard_call("BTC/USDT", "echo", 1).result(timeout=1) == 1  # no workers: runs here
+    join("a")
+    join("b")
+    assert [f.result(timeout=5) for f in [main.shard_call(s, "echo", s) for s in SYMBOLS]] == SYMBOLS
+    assert set(coordinator.assigned.values()) == {"a", "b"}
+
+    symbol = next(s for s in SYMBOLS if coordinator.ring.owner(s) == "a")
+    future = coordinator.submit(symbol, "slow", "done")
+    coordinator._leave("a")
+    assert coordinator.ring.owner(symbol) == "b"
+    gate.set()
+    assert future.result(timeout=5) == "done"  # re-sent to b
+
+
+def test_joining_worker_takes_over_and_old_owner_releases(leader):
+    coordinator, join, released, gate = leader
+    join("a")
+    for f in [coordinator.submit(s, "echo", s) for s in SYMBOLS]:
+        f.result(timeout=5)
+    join("b")
+    moved = [s for s in SYMBOLS if coordinator.ring.owner(s) == "b"]
+    wait_for(lambda: sorted(released) == sorted(moved))
+    assert moved and not any(coordinator.assigned.get(s) == "a" for s in moved)
+
+
+def test_scan_cycle_runs_on_shards(leader, tmp_path, monkeypatch):
+    coordinator, join, released, gate = leader
+    registry = main.TenantRegistry(path=str(tmp_path / "tenants.json"))
+    registry.tenants[""] = main.Tenant(None, symbols=SYMBOLS[:20], active_tf=["1m"])
+    monkeypatch.setattr(main, "tenants", registry)
+    monkeypatch.setattr(main.symbol_resolver, "resolve", lambda symbol: symbol)
+    main.CLUSTER_CALLS["analyze"] = lambda symbol, tfs, resample: ([(tf, {"symbol": symbol}) for tf in tfs], 0.0)
+    evaluated = []
+    monkeypatch.setattr(main, "evaluate_signal", lambda symbol, tf, snap: evaluated.append(snap["symbol"]))
+    join("a")
+    join("b")
+    stats = main.check_signals_once()
+    assert sorted(evaluated) == sorted(SYMBOLS[:20])
+    assert stats["shards"] == 2
+
+
+def test_local_workers_split_the_hosts_request_budget(tmp_path, monkeypatch):
+    spawned = []
+    monkeypatch.setattr(main.subprocess, "Popen", lambda args, env: spawned.append(env))
+    monkeypatch.setattr(main, "PUBLIC_RATE_LIMIT", 16.0)
+    monkeypatch.setattr(main, "public_rate_limiter", main.RateLimiter(16.0))
+    monkeypatch.setattr(main, "cluster", main.Coordinator())
+    main.start_cluster(workers=3, listen=str(tmp_path / "cluster.sock"))
+    try:
+        assert [env["BOT_PUBLIC_RATE_LIMIT"] for env in spawned] == ["4.0"] * 3
+        assert main.public_rate_limiter.rate == 4.0
+    finally:
+        main.cluster.stop()
@@ -0,0 +1,54 @@
+import time
+
+import main
+
+
+def signal(symbol, price=100.0):
+    snap = {"bars": main.SMA200, "bar_ms": 60_000, "price": price, "rsi": 20.0, "sma50": 90.0, "sma200": 90.0,
+            "support": 50.0, "resistance": 200.0}
+    main.evaluate_signal(symbol, "1m", snap)
+
+
+def wait_open(count):
+    deadline = time.monotonic() + 5
+    while len(main.open_trades) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_entry_order_carries_stops_and_monitor_skips_the_trade(real):
+    signal("BTC/USDT")
+    wait_open(1)
+    order = real.orders[0]
+    sl, tp = main.sl_tp_prices(100.0, "LONG")
+    assert order["params"]["stopLoss"] == {"triggerPrice": sl}
+    assert order["params"]["takeProfit"] == {"triggerPrice": tp}
+    (trade,) = list(main.open_trades)
+    assert trade["exchange_exits"]
+    assert len(main.trade_snapshot.columns()) == 0
+    assert main.open_trades.triggered("BTC/USDT", tp * 2) == []
+
+
+def test_reconciler_books_protected_exits_from_one_positions_call(real):
+    signal("BTC/USDT")
+    signal("ETH/USDT")
+    wait_open(2)
+    real.positions = [{"symbol": "ETH/USDT:USDT", "side": "long", "contracts": 1.0}]
+    real.fills["BTC/USDT:USDT"] = [{"side": "buy", "price": 100.0}, {"side": "sell", "price": 103.9}]
+    report = main.PositionReconciler().check(confirmations=1)
+    assert real.position_calls == [None]
+    assert report["repaired"] == [f"{main.closed_trades[0]['id']}: closed on the exchange, booked Hit TP (exchange) at 103.9"]
+    assert [t["symbol"] for t in main.open_trades] == ["ETH/USDT"]
+    assert main.closed_trades[0]["exit_price"] == 103.9
+    assert len(real.orders) == 2  # no close order: the exchange already closed it
+
+
+def test_reentry_in_the_same_bar_is_a_new_order(real):
+    signal("BTC/USDT")
+    wait_open(1)
+    main.PositionReconciler().check(confirmations=1)  # stopped out on the exchange
+    assert len(main.open_trades) == 0
+    signal("BTC/USDT")  # same bar_ms
+    wait_open(1)
+    assert len(main.open_trades) == 1
+    first, second = real.orders
+    assert first["clientOrderId"] != second["clientOrderId"]
@@ -0,0 +1,79 @@
+import pytest
+
+import main
+
+MINUTE = 60_000
+
+
+def long_trade(tid="L", opened_ms=0):
+    return {"id": tid, "symbol": "BTC/USDT", "direction": "LONG", "sl_price": 98.0, "tp_price": 104.0, "opened_ms": opened_ms}
+
+
+def short_trade(tid="S", opened_ms=0):
+    return {"id": tid, "symbol": "BTC/USDT", "direction": "SHORT", "sl_price": 102.0, "tp_price": 96.0, "opened_ms": opened_ms}
+
+
+def test_wick_between_polls_fills_at_the_level():
+    columns = main.TriggerColumns([long_trade()])
+    # last price is back inside the band, but the candle wicked through TP
+    hits = columns.triggered({"BTC/USDT": 100.0}, {"BTC/USDT": (MINUTE, 100.0, 104.5, 99.5)})
+    assert hits == [("L", "BTC/USDT", "Hit TP", 104.0)]
+    assert columns.triggered({"BTC/USDT": 100.0}) == []
+
+
+@pytest.mark.parametrize("policy, open_price, reason", [
+    ("sl_first", 103.5, "Hit SL"),
+    ("tp_first", 98.5, "Hit TP"),
+    ("nearest_open", 103.5, "Hit TP"),
+    ("nearest_open", 98.5, "Hit SL"),
+])
+def test_same_bar_policy(policy, open_price, reason):
+    columns = main.TriggerColumns([long_trade()])
+    hits = columns.triggered({"BTC/USDT": 100.0}, {"BTC/USDT": (MINUTE, open_price, 105.0, 97.0)}, policy=policy)
+    assert [(h[2], h[3]) for h in hits] == [(reason, 98.0 if reason == "Hit SL" else 104.0)]
+
+
+def test_gap_through_stop_fills_at_open():
+    columns = main.TriggerColumns([short_trade()])
+    hits = columns.triggered({"BTC/USDT": 103.0}, {"BTC/USDT": (MINUTE, 103.0, 103.5, 102.8)})
+    assert hits == [("S", "BTC/USDT", "Hit SL", 103.0)]
+
+
+@pytest.mark.parametrize("bar", [(103.0, 103.5, 102.8), (101.0, 102.5, 95.5), (95.0, 95.5, 94.0), (100.0, 101.0, 99.0)])
+def test_backtester_fills_like_the_monitor(bar):
+    open_price, high, low = bar
+    hits = main.TriggerColumns([short_trade()]).triggered({"BTC/USDT": open_price}, {"BTC/USDT": (MINUTE, open_price, high, low)})
+    j, reason, price = main.resolve_exit("SHORT", 0, 102.0, 96.0, main.np.array([high]), main.np.array([low]),
+                                         main.np.array([open_price]))
+    assert [(h[2], h[3]) for h in hits] == ([(reason, price)] if j is not None else [])
+
+
+def test_range_before_the_trade_opened_is_ignored():
+    columns = main.TriggerColumns([long_trade(opened_ms=MINUTE + 30_000)])
+    assert columns.triggered({"BTC/USDT": 100.0}, {"BTC/USDT": (MINUTE, 100.0, 104.5, 99.5)}) == []
+
+
+class FakeCache:
+    def __init__(self, rows, fetched_at):
+        self.rows, self.fetched_at, self.updates = rows, fetched_at, 0
+
+    def peek(self, symbol, timeframe):
+        return list(self.rows), self.fetched_at
+
+    def update(self, symbol, timeframe):
+        self.updates += 1
+        return list(self.rows)
+
+
+def test_collect_covers_candles_since_last_check(monkeypatch):
+    rows = [[i * MINUTE, 100.0, 100.0 + i, 100.0 - i, 100.0, 1.0] for i in range(10)]
+    cache = FakeCache(rows, fetched_at=9 * MINUTE + 5_000)
+    monkeypatch.setattr(main, "candle_cache", cache)
+    ranges = main.ExitRanges()
+    assert ranges.collect(["BTC/USDT"], now_ms=7 * MINUTE + 10_000) == {}
+    got = ranges.collect(["BTC/USDT"], now_ms=9 * MINUTE + 20_000)
+    assert got == {"BTC/USDT": (7 * MINUTE, 100.0, 109.0, 91.0)}
+    assert cache.updates == 0
+    # a new minute closed since the cache was refreshed: fetch once
+    ranges.collect(["BTC/USDT"], now_ms=10 * MINUTE + 3_000)
+    assert cache.updates == 1
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+import main
+
+
+class FakeMessage:
+    def __init__(self):
+        self.texts = []
+
+    async def reply_text(self, text, reply_markup=None):
+        self.texts.append(text)
+        return self
+
+    async def edit_text(self, text, reply_markup=None):
+        self.texts.append(text)
+
+
+class FakeUpdate:
+    def __init__(self):
+        self.message = FakeMessage()
+
+
+@pytest.fixture
+def slow_scan(monkeypatch):
+    calls = []
+
+    def scan(timeframes=None, progress=None, cancel=None):
+        calls.append(timeframes)
+        for i in range(3):
+            time.sleep(0.1)
+            progress(i + 1, 3)
+        return {"pairs": 3, "cycle_seconds": 0.3, "errors": 0, "cancelled": cancel.is_set()}
+
+    monkeypatch.setattr(main, "check_signals_once", scan)
+    monkeypatch.setattr(main, "forced_scan", main.ForcedScan())
+    monkeypatch.setattr(main, "FORCE_CHECK_PROGRESS_INTERVAL", 0.05)
+    return calls
+
+
+def test_second_force_check_joins_and_loop_stays_responsive(slow_scan):
+    ticks = []
+
+    async def ticker():
+        for _ in range(10):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.02)
+
+    async def scenario():
+        first, second = FakeUpdate(), FakeUpdate()
+        await asyncio.gather(main.force_check_cmd(first, None), main.force_check_cmd(second, None), ticker())
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert len(slow_scan) == 1
+    assert second.message.texts[0].startswith("Joined")
+    for update in (first, second):
+        assert update.message.texts[-1].startswith("Check complete: 3 pairs")
+    assert any("/3" in text for text in first.message.texts)
+    # the event loop kept running while the scan was in flight
+    assert len(ticks) == 10 and max(b - a for a, b in zip(ticks, ticks[1:])) < 0.1
+
+
+def test_cancel_reaches_running_scan(slow_scan):
+    future, joined = main.forced_scan.start()
+    assert not joined
+    assert main.forced_scan.cancel()
+    assert future.result(timeout=5)["cancelled"]
+    assert not main.forced_scan.cancel()
+
+
+def test_cancelled_scan_stops_evaluating(tmp_path, monkeypatch):
+    registry = main.TenantRegistry(path=str(tmp_path / "tenants.json"))
+    registry.tenants[""] = main.Tenant(None, symbols=[f"S{i}/USDT" for i in range(40)], active_tf=["1m"])
+    monkeypatch.setattr(main, "tenants", registry)
+    monkeypatch.setattr(main, "RESAMPLE_FROM_BASE", False)
+    monkeypatch.setattr(main.symbol_resolver, "resolve", lambda symbol: symbol)
+    monkeypatch.setattr(main, "analyze_pair", lambda symbol, tfs, queue: time.sleep(0.02) or ([(tfs[0], {})], 0.02))
+    evaluated = []
+    monkeypatch.setattr(main, "evaluate_signal", lambda symbol, tf, snap: evaluated.append(symbol))
+    cancel = threading.Event()
+
+    def progress(done, total):
+        if done == 2:
+            cancel.set()
+
+    stats = main.check_signals_once(progress=progress, cancel=cancel)
+    assert stats["cancelled"]
+    assert len(evaluated) < 40
+
+
+def test_scan_cycles_never_overlap(monkeypatch):
+    active = []
+    overlaps = []
+
+    def cycle(timeframes, progress, cancel):
+        active.append(1)
+        overlaps.append(len(active) > 1)
+        time.sleep(0.05)
+        active.pop()
+
+    monkeypatch.setattr(main, "_scan_cycle", cycle)
+    threads = [threading.Thread(target=main.check_signals_once) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert overlaps == [False] * 4
+
+
+
+class OfflineRequest(BaseRequest):
+    """
+    Bot API stand-in: answers every call without a network and records the texts sent.
+    """
+    def __init__(self):
+        self.texts = []
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **timeouts):
+        params = request_data.parameters if request_data else {}
+        endpoint = url.rsplit("/", 1)[-1]
+        if endpoint == "getMe":
+            result = {"id": 42, "is_bot": True, "first_name": "bot", "username": "bot"}
+        elif endpoint in ("sendMessage", "editMessageText"):
+            self.texts.append(params.get("text"))
+            result = {"message_id": 7, "date": 0, "chat": {"id": 1, "type": "private"}, "text": params.get("text")}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def command_update(update_id, text):
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "chat": {"id": 1, "type": "private"}, "from": {"id": 1, "is_bot": False, "first_name": "u"},
+        "text": text, "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}]}}
+
+
+def test_cancel_button_is_handled_while_the_scan_runs(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "TG_CHAT_ID", "1")
+    monkeypatch.setattr(main, "tenants", main.TenantRegistry(path=str(tmp_path / "tenants.json")))
+    monkeypatch.setattr(main, "forced_scan", main.ForcedScan())
+    monkeypatch.setattr(main, "FORCE_CHECK_PROGRESS_INTERVAL", 0.05)
+    started = threading.Event()
+
+    def scan(timeframes=None, progress=None, cancel=None):
+        started.set()
+        return {"pairs": 0, "cycle_seconds": 0.0, "errors": 0, "cancelled": cancel.wait(5)}
+
+    monkeypatch.setattr(main, "check_signals_once", scan)
+    request = OfflineRequest()
+
+    async def scenario():
+        app = main.build_application(Application.builder().token("1:test").request(request).get_updates_request(OfflineRequest()))
+        async with app:
+            await app.start()  # runs the non-blocking handlers as tracked tasks
+            await app.process_update(Update.de_json(command_update(1, "/force_check"), app.bot))
+            await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+            # the command handler is still awaiting the scan; the button press must get through
+            button = {"update_id": 2, "callback_query": {
+                "id": "q", "chat_instance": "c", "data": "force_check_cancel", "from": {"id": 1, "is_bot": False, "first_name": "u"},
+                "message": {"message_id": 7, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "Running signal check..."}}}
+            await asyncio.wait_for(app.process_update(Update.de_json(button, app.bot)), timeout=2)
+            for _ in range(100):
+                if request.texts and request.texts[-1] == "Check cancelled.":
+                    break
+                await asyncio.sleep(0.02)
+            await app.stop()
+
+    asyncio.run(scenario())
+    assert request.texts[0] == "Running signal check..."
+    assert request.texts[-1] == "Check cancelled."
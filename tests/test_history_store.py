@@ -0,0 +1,58 @@
+import main
+
+MINUTE = 60_000
+
+
+def candles(start, count):
+    return [[t * MINUTE, 100.0 + t % 50, 101.0 + t % 50, 99.0 + t % 50, 100.5 + t % 50, 1.0] for t in range(start, start + count)]
+
+
+def test_appends_from_two_processes_never_duplicate(tmp_path):
+    # two stores on one directory stand in for two processes sharing the history
+    a, b = main.OHLCVStore(root=str(tmp_path)), main.OHLCVStore(root=str(tmp_path))
+    assert a.append("BTC/USDT", "1m", candles(0, 5)) == 5
+    assert b.append("BTC/USDT", "1m", candles(3, 5)) == 3
+    assert a.append("BTC/USDT", "1m", candles(6, 4)) == 2
+    times = a.read("BTC/USDT", "1m")["time"]
+    assert list(times) == [i * MINUTE for i in range(10)]
+
+
+def test_append_after_a_crash_between_columns(tmp_path):
+    store = main.OHLCVStore(root=str(tmp_path))
+    store.append("BTC/USDT", "1m", candles(0, 5))
+    # crash mid-append: time and open got the new row, the other columns did not
+    for column in ("time", "open"):
+        with open(store._path("BTC/USDT", "1m", column), "ab") as f:
+            f.write(main.np.float64(5 * MINUTE).tobytes())
+    assert store.last_ts("BTC/USDT", "1m") == 4 * MINUTE
+    assert store.append("BTC/USDT", "1m", candles(5, 2)) == 2
+    cols = store.read("BTC/USDT", "1m")
+    assert list(cols["time"]) == [i * MINUTE for i in range(7)]
+    assert list(cols["close"]) == [100.5 + i for i in range(7)]
+    sizes = {(tmp_path / "BTC_USDT" / "1m" / f"{c}.f8").stat().st_size for c in main.OHLCVStore.COLUMNS}
+    assert sizes == {7 * 8}
+
+
+def test_gaps_are_the_missing_ranges(tmp_path):
+    store = main.OHLCVStore(root=str(tmp_path))
+    store.append("BTC/USDT", "1m", candles(0, 3) + candles(5, 2) + candles(10, 1))
+    assert store.gaps("BTC/USDT", "1m") == [(2 * MINUTE, 5 * MINUTE), (6 * MINUTE, 10 * MINUTE)]
+
+
+def test_backfill_fetches_only_the_gaps(tmp_path, monkeypatch):
+    store = main.OHLCVStore(root=str(tmp_path))
+    now = int(main.time.time() * 1000) // MINUTE
+    store.append("BTC/USDT", "1m", candles(now - 20, 5) + candles(now - 10, 10))  # up to the last closed candle
+    requests = []
+
+    def fetch(symbol, timeframe, limit, since):
+        requests.append(since)
+        first = since // MINUTE
+        return candles(first, min(limit, now - first + 1))  # includes the forming candle
+
+    monkeypatch.setattr(main, "fetch_ohlcv_raw", fetch)
+    assert store.backfill("BTC/USDT", "1m", page=3) == 5
+    assert store.gaps("BTC/USDT", "1m") == []
+    assert list(store.read("BTC/USDT", "1m")["time"]) == [(now - 20 + i) * MINUTE for i in range(20)]
+    # the gap in pages of 3, then the tail after the last stored candle (only the forming one)
+    assert requests == [(now - 15) * MINUTE, (now - 12) * MINUTE, now * MINUTE]
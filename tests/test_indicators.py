@@ -0,0 +1,79 @@
+import math
+import random
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("ta")
+from ta.momentum import RSIIndicator
+from ta.trend import SMAIndicator
+
+import main
+
+
+def random_walk(n, seed=1):
+    rnd = random.Random(seed)
+    price = 100.0
+    rows = []
+    for i in range(n):
+        price *= 1 + rnd.uniform(-0.01, 0.01)
+        rows.append([i * 60000, price, price, price, price, 1.0])
+    return rows
+
+
+def reference(rows):
+    close = pd.Series([r[4] for r in rows])
+    return (
+        RSIIndicator(close, window=main.RSI_WINDOW).rsi().iloc[-1],
+        SMAIndicator(close, window=main.SMA50).sma_indicator().iloc[-1],
+        SMAIndicator(close, window=main.SMA200).sma_indicator().iloc[-1],
+    )
+
+
+def assert_close(actual, expected):
+    if math.isnan(expected):
+        assert math.isnan(actual)
+    else:
+        assert actual == pytest.approx(expected, rel=1e-9, abs=1e-9)
+
+
+def test_feed_with_forming_ticks_matches_ta():
+    rows = random_walk(1200)
+    state = main.IndicatorState()
+    checkpoints = {1, 5, 13, 14, 15, 49, 50, 51, 199, 200, 201, 300, 777, 1200}
+    for n in range(1, len(rows) + 1):
+        window = [list(r) for r in rows[:n]]
+        # the forming candle ticks before settling on its final close
+        window[-1][4] = rows[n - 1][4] * 1.001
+        state.feed(window)
+        window[-1][4] = rows[n - 1][4]
+        state.feed(window)
+        if n in checkpoints:
+            rsi, sma50, sma200 = reference(window)
+            assert_close(state.rsi(), rsi)
+            assert_close(state.sma(main.SMA50), sma50)
+            assert_close(state.sma(main.SMA200), sma200)
+
+
+def test_update_per_candle_matches_ta():
+    rows = random_walk(400, seed=7)
+    state = main.IndicatorState()
+    for r in rows:
+        state.update(r[0], r[4] * 0.999)
+        state.update(r[0], r[4])
+    rsi, sma50, sma200 = reference(rows)
+    assert_close(state.rsi(), rsi)
+    assert_close(state.sma(main.SMA50), sma50)
+    assert_close(state.sma(main.SMA200), sma200)
+
+
+def test_feed_rebuilds_after_gap():
+    rows = random_walk(600, seed=3)
+    state = main.IndicatorState()
+    state.feed(rows[:300])
+    # the cache re-bootstrapped past a gap: the forming candle is no longer in the window
+    window = rows[350:600]
+    state.feed(window)
+    rsi, sma50, sma200 = reference(window)
+    assert_close(state.rsi(), rsi)
+    assert_close(state.sma(main.SMA200), sma200)
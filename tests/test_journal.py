@@ -0,0 +1,60 @@
+import subprocess
+import sys
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "TG_CHAT_ID", None)
+    monkeypatch.setattr(main, "OPEN_TRADES_FILE", str(tmp_path / "open_trades.json"))
+    monkeypatch.setattr(main, "CLOSED_TRADES_FILE", str(tmp_path / "closed_trades.json"))
+    monkeypatch.setattr(main, "tenants", main.TenantRegistry(path=str(tmp_path / "tenants.json")))
+    monkeypatch.setattr(main, "journal", main.TradeJournal(path=str(tmp_path / "trades_journal.jsonl")))
+    monkeypatch.setattr(main, "open_trades", main.TradeBook())
+    monkeypatch.setattr(main, "closed_trades", [])
+    monkeypatch.setattr(main, "trade_snapshot", main.TradeSnapshot())
+    return main.journal
+
+
+def restart(monkeypatch, path):
+    assert main.journal.flush(timeout=5)
+    monkeypatch.setattr(main, "journal", main.TradeJournal(path=path))
+    main.load_state()
+
+
+def test_open_and_close_survive_restart(journal, monkeypatch):
+    kept = main.open_trade("BTC/USDT", "LONG", 100.0, "1m")
+    closed = main.open_trade("ETH/USDT", "SHORT", 50.0, "5m")
+    main.close_trade(closed, 49.0, "Hit TP")
+    restart(monkeypatch, journal.path)
+    assert [t["id"] for t in main.open_trades] == [kept["id"]]
+    assert [t["id"] for t in main.closed_trades] == [closed["id"]]
+
+
+def test_torn_write_does_not_swallow_next_event(journal, monkeypatch):
+    with open(journal.path, "w", encoding="utf-8") as f:
+        f.write('{"op": "open", "tra')  # crash in the middle of an append
+    restart(monkeypatch, journal.path)
+    trade = main.open_trade("BTC/USDT", "LONG", 100.0, "1m")
+    restart(monkeypatch, journal.path)
+    assert trade["id"] in main.open_trades
+
+
+def test_replay_is_idempotent_over_snapshots(journal, monkeypatch):
+    trade = main.open_trade("BTC/USDT", "LONG", 100.0, "1m")
+    main.journal.compact()  # snapshot now holds the trade
+    main.journal.append("open", dict(trade))  # and so does the journal
+    restart(monkeypatch, journal.path)
+    assert len(main.open_trades) == 1
+
+
+def test_offline_commands_leave_the_journal_alone(tmp_path):
+    line = '{"op": "open", "trade": {"id": "BTC/USDT-1m-1"}}\n'
+    (tmp_path / "trades_journal.jsonl").write_text(line)
+    subprocess.run([sys.executable, main.__file__, "backtest", "--symbols", "BTC/USDT", "--tfs", "1m"],
+                   cwd=tmp_path, check=True, capture_output=True, timeout=60)
+    assert (tmp_path / "trades_journal.jsonl").read_text() == line
+    assert not (tmp_path / "open_trades.json").exists()
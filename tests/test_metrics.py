@@ -0,0 +1,58 @@
+import threading
+import urllib.request
+
+import pytest
+
+import main
+
+
+def test_histogram_and_counters_render_as_prometheus_text():
+    m = main.Metrics(buckets=(0.01, 0.1))
+    m.observe("req_seconds", 0.005)
+    m.observe("req_seconds", 0.05)
+    m.observe("req_seconds", 3.0)
+    m.inc("req_total", 3)
+    text = m.render()
+    assert 'bot_req_seconds_bucket{le="0.01"} 1' in text
+    assert 'bot_req_seconds_bucket{le="0.1"} 2' in text
+    assert 'bot_req_seconds_bucket{le="+Inf"} 3' in text
+    assert "bot_req_seconds_count 3" in text
+    assert "bot_req_total 3" in text
+    count, avg, p95, peak = m.summary("req_seconds")
+    assert (count, peak) == (3, 3.0)
+    assert p95 == float("inf")
+
+
+def test_timer_counts_errors():
+    m = main.Metrics()
+    with pytest.raises(ValueError):
+        with m.timer("op_seconds", errors="op_errors_total"):
+            raise ValueError("boom")
+    assert m.counters["op_errors_total"] == 1
+    assert m.summary("op_seconds")[0] == 1
+
+
+def test_timed_lock_records_contended_wait(monkeypatch):
+    m = main.Metrics()
+    monkeypatch.setattr(main, "metrics", m)
+    lock = main.TimedLock(threading.Lock(), "demo")
+    lock.acquire()
+    t = threading.Thread(target=lambda: lock.acquire() and lock.release())
+    t.start()
+    threading.Event().wait(0.05)
+    lock.release()
+    t.join()
+    count, _, _, peak = m.summary("demo_wait_seconds")
+    assert count == 2
+    assert peak >= 0.04
+
+
+def test_metrics_endpoint_serves_text():
+    main.metrics.inc("endpoint_probe_total")
+    server = main.start_metrics_server(port=0)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/metrics", timeout=5) as resp:
+            body = resp.read().decode()
+        assert "bot_endpoint_probe_total 1" in body
+    finally:
+        server.shutdown()
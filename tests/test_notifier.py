@@ -0,0 +1,79 @@
+import time
+
+import pytest
+
+import main
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body or {"ok": status_code == 200}
+        self.text = str(self.body)
+
+    def json(self):
+        return self.body
+
+
+class FakeSession:
+    """
+    requests.Session stand-in: records each sendMessage and answers from `responses`
+    (then 200s).
+    """
+    responses = []
+
+    def __init__(self):
+        self.posts = []
+        FakeSession.last = self
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def post(self, url, json=None, timeout=None):
+        self.posts.append((time.monotonic(), json))
+        return FakeSession.responses.pop(0) if FakeSession.responses else FakeResponse(200)
+
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(main.requests, "Session", FakeSession)
+    monkeypatch.setattr(FakeSession, "responses", [])
+    return FakeSession
+
+
+def wait_sent(notifier, count, timeout=5):
+    deadline = time.monotonic() + timeout
+    while notifier.stats["sent"] + notifier.stats["failed"] < count:
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_burst_is_coalesced_within_the_length_limit(session):
+    notifier = main.TelegramNotifier(api_url="https://tg.invalid", coalesce_window=0.2)
+    texts = [f"{i}" * 1000 for i in range(10)]
+    for text in texts:
+        notifier.enqueue(1, text)
+    wait_sent(notifier, 3)
+    sent = [payload["text"] for _, payload in session.last.posts]
+    assert len(sent) == 3 and all(len(text) <= main.TelegramNotifier.MAX_TEXT for text in sent)
+    assert "\n\n".join(sent) == "\n\n".join(texts)
+    assert notifier.stats["coalesced"] == 7
+
+
+def test_full_queue_drops_the_oldest(session):
+    notifier = main.TelegramNotifier(api_url="https://tg.invalid", max_queue=3, coalesce_window=0.3)
+    for i in range(5):
+        notifier.enqueue(1, f"m{i}")
+    wait_sent(notifier, 1)
+    assert [payload["text"] for _, payload in session.last.posts] == ["m2\n\nm3\n\nm4"]
+    assert notifier.metrics()["dropped"] == 2
+
+
+def test_rate_limited_send_waits_retry_after(session):
+    session.responses = [FakeResponse(429, {"ok": False, "parameters": {"retry_after": 0.2}})]
+    notifier = main.TelegramNotifier(api_url="https://tg.invalid", coalesce_window=0.0)
+    notifier.enqueue(1, "hello")
+    wait_sent(notifier, 1)
+    (first, _), (second, payload) = session.last.posts
+    assert second - first >= 0.2 and payload["text"] == "hello"
+    assert (notifier.stats["rate_limited"], notifier.stats["sent"]) == (1, 1)
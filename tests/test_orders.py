@@ -0,0 +1,91 @@
+import time
+
+import main
+
+
+def test_leverage_is_set_once_per_market(executor):
+    ex, exchange = executor
+    for i in range(3):
+        ex.submit("BTC/USDT", "buy", 1.0, f"c{i}", leverage=10).result(timeout=5)
+    ex.submit("BTC/USDT", "buy", 1.0, "c3", leverage=5).result(timeout=5)
+    assert exchange.leverage_calls == [(10, "BTC/USDT:USDT"), (5, "BTC/USDT:USDT")]
+
+
+def test_symbols_run_in_parallel_but_each_in_order(executor):
+    ex, exchange = executor
+    exchange.delay = 0.1
+    started = time.monotonic()
+    futures = [ex.submit(f"S{i % 4}/USDT", "buy", 1.0, f"c{i}") for i in range(8)]
+    assert all(f.result(timeout=5) for f in futures)
+    assert time.monotonic() - started < 0.35  # 4 symbols x 2 orders, not 8 sequential
+    for i in range(4):
+        ids = [o["clientOrderId"] for o in sorted(exchange.orders, key=lambda o: o["at"]) if o["symbol"] == f"S{i}/USDT:USDT"]
+        assert ids == [f"c{i}", f"c{i + 4}"]
+
+
+def test_lost_ack_is_not_placed_twice(executor):
+    ex, exchange = executor
+    exchange.drop, exchange.reached = 1, True
+    order = ex.submit("BTC/USDT", "buy", 1.0, "same").result(timeout=5)
+    assert order["clientOrderId"] == "same" and len(exchange.orders) == 1
+
+
+def test_failed_request_is_retried_with_the_same_id(executor):
+    ex, exchange = executor
+    exchange.drop = 1
+    order = ex.submit("BTC/USDT", "buy", 1.0, "same").result(timeout=5)
+    assert [o["clientOrderId"] for o in exchange.orders] == ["same"] and order is exchange.orders[0]
+    exchange.drop = 5
+    assert ex.submit("BTC/USDT", "buy", 1.0, "gone").result(timeout=5) is None
+
+
+def test_simultaneous_exits_close_in_parallel(tmp_path, monkeypatch, executor):
+    ex, exchange = executor
+    exchange.delay = 0.2
+    monkeypatch.setattr(main, "order_executor", ex)
+    monkeypatch.setattr(main, "get_private_exchange", lambda: exchange)
+    monkeypatch.setattr(main, "tg_send", lambda chat, text: None)
+    monkeypatch.setattr(main, "tenants", main.TenantRegistry(path=str(tmp_path / "tenants.json")))
+    monkeypatch.setattr(main, "journal", main.TradeJournal(path=str(tmp_path / "trades_journal.jsonl")))
+    monkeypatch.setattr(main, "open_trades", main.TradeBook())
+    monkeypatch.setattr(main, "closed_trades", [])
+    monkeypatch.setattr(main, "trade_snapshot", main.TradeSnapshot())
+    monkeypatch.setattr(main, "metrics", main.Metrics())
+    trades = [main.open_trade(f"S{i}/USDT", "LONG", 100.0, "1m", real_order={"order": {}}, amount_base=1.0) for i in range(6)]
+    started = time.monotonic()
+    assert all(main.exit_trade(t, 104.0, "Hit TP", triggered_at=started) for t in trades)
+    assert not main.exit_trade(trades[0], 104.0, "Hit TP")  # already closing
+    deadline = time.monotonic() + 5
+    while len(main.closed_trades) < 6 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert time.monotonic() - started < 0.6
+    assert len(main.closed_trades) == 6 and len(main.open_trades) == 0
+    assert all(o["params"]["reduceOnly"] and o["side"] == "sell" for o in exchange.orders)
+    assert len({o["clientOrderId"] for o in exchange.orders}) == 6
+    assert main.metrics.summary("close_ack_seconds")[0] == 6
+
+
+def test_real_open_is_recorded_on_ack_and_not_repeated(tmp_path, monkeypatch, executor):
+    ex, exchange = executor
+    exchange.delay = 0.2
+    monkeypatch.setattr(main, "order_executor", ex)
+    monkeypatch.setattr(main, "get_private_exchange", lambda: exchange)
+    monkeypatch.setattr(main, "tg_send", lambda chat, text: None)
+    monkeypatch.setattr(main, "TG_CHAT_ID", "1")
+    registry = main.TenantRegistry(path=str(tmp_path / "tenants.json"))
+    owner = registry.owner()
+    owner.symbols, owner.active_tf, owner.trade_mode = ["BTC/USDT"], ["1m"], "real"
+    monkeypatch.setattr(main, "tenants", registry)
+    monkeypatch.setattr(main, "journal", main.TradeJournal(path=str(tmp_path / "trades_journal.jsonl")))
+    monkeypatch.setattr(main, "open_trades", main.TradeBook())
+    monkeypatch.setattr(main, "trade_snapshot", main.TradeSnapshot())
+    snap = {"bars": main.SMA200, "bar_ms": 60_000, "price": 100.0, "rsi": 20.0, "sma50": 90.0, "sma200": 90.0,
+            "support": 50.0, "resistance": 200.0}
+    main.evaluate_signal("BTC/USDT", "1m", snap)
+    main.evaluate_signal("BTC/USDT", "1m", snap)  # ack still pending
+    deadline = time.monotonic() + 5
+    while not len(main.open_trades) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    trades = list(main.open_trades)
+    assert len(exchange.orders) == 1 and len(trades) == 1 and trades[0]["real"]
+    assert exchange.leverage_calls == [(owner.leverage, "BTC/USDT:USDT")]
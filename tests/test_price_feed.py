@@ -0,0 +1,94 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+websockets = pytest.importorskip("websockets")
+
+import main
+
+
+class FakeBitgetServer:
+    """
+    Local stand-in for the Bitget public WebSocket: answers "ping" and, on subscribe,
+    pushes the queued ticker prices for each subscribed instrument.
+    """
+    def __init__(self, prices):
+        self.prices = prices
+        self.messages = []
+        self.port = None
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=lambda: asyncio.run(self._serve()), daemon=True)
+
+    async def _handler(self, ws):
+        async for raw in ws:
+            if raw == "ping":
+                await ws.send("pong")
+                continue
+            msg = json.loads(raw)
+            self.messages.append(msg)
+            if msg["op"] != "subscribe":
+                continue
+            for arg in msg["args"]:
+                for price in self.prices:
+                    await ws.send(json.dumps({"action": "snapshot", "arg": arg,
+                                              "data": [{"instId": arg["instId"], "lastPr": str(price)}]}))
+
+    async def _serve(self):
+        async with websockets.serve(self._handler, "127.0.0.1", 0) as server:
+            self.port = server.sockets[0].getsockname()[1]
+            self.ready.set()
+            await asyncio.Future()
+
+    def start(self):
+        self.thread.start()
+        assert self.ready.wait(5)
+        return f"ws://127.0.0.1:{self.port}"
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.fixture
+def fresh_book(monkeypatch):
+    monkeypatch.setattr(main, "TG_CHAT_ID", None)
+    monkeypatch.setattr(main, "open_trades", main.TradeBook())
+    monkeypatch.setattr(main, "closed_trades", [])
+    monkeypatch.setattr(main, "trade_snapshot", main.TradeSnapshot())
+
+
+def test_feed_subscribes_and_tracks_last_price(fresh_book):
+    url = FakeBitgetServer([101.0, 102.5]).start()
+    feed = main.PriceFeed(url=url)
+    feed.set_symbols(["ETH/USDT"])
+    assert feed.start()
+    try:
+        assert wait_for(lambda: feed.last_price("ETH/USDT") == 102.5)
+    finally:
+        feed.stop()
+
+
+def test_streamed_price_triggers_stop_loss(fresh_book):
+    server = FakeBitgetServer([100.0, 97.0])
+    url = server.start()
+    trade = main.open_trade("BTC/USDT", "LONG", 100.0, "1m")
+    feed = main.PriceFeed(url=url, on_price=main.on_stream_price)
+    feed.set_symbols(["BTC/USDT"])
+    feed.start()
+    try:
+        assert wait_for(lambda: trade["id"] not in main.open_trades)
+    finally:
+        feed.stop()
+    assert server.messages[0] == {"op": "subscribe", "args": [
+        {"instType": main.WS_INST_TYPE, "channel": "ticker", "instId": "BTCUSDT"}]}
+    closed = main.closed_trades[-1]
+    assert closed["close_reason"] == "Hit SL"
+    assert closed["exit_price"] == 97.0
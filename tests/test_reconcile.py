@@ -0,0 +1,80 @@
+import time
+
+import main
+
+
+def book_real(symbol, direction="LONG", amount=1.0, entry=100.0):
+    return main.open_trade(symbol, direction, entry, "1m", real_order={"order": {}}, amount_base=amount)
+
+
+def position(symbol, side="long", contracts=1.0, entry=100.0, leverage=5):
+    return {"symbol": f"{symbol}:USDT", "side": side, "contracts": contracts, "contractSize": 1,
+            "entryPrice": entry, "leverage": leverage}
+
+
+def test_in_sync_book_needs_no_repair(real):
+    for i in range(2000):
+        book_real(f"S{i}/USDT")
+    real.positions = [position(f"S{i}/USDT") for i in range(2000)]
+    started = time.perf_counter()
+    report = main.PositionReconciler().check()
+    assert time.perf_counter() - started < 1.0
+    assert (report["positions"], report["trades"], report["repaired"], report["warnings"]) == (2000, 2000, [], [])
+    assert main.format_reconcile_text(report).endswith("In sync.")
+
+
+def test_divergence_is_repaired_on_the_second_pass(real):
+    trade = book_real("BTC/USDT")
+    reconciler = main.PositionReconciler()
+    first = reconciler.check()
+    assert first["repaired"] == [] and first["pending"] == 1 and len(main.open_trades) == 1
+    second = reconciler.check()
+    assert len(second["repaired"]) == 1
+    assert main.closed_trades[0]["id"] == trade["id"]
+    assert main.closed_trades[0]["close_reason"] == "Closed on exchange"
+
+
+def test_a_divergence_that_resolves_itself_is_not_repaired(real):
+    book_real("BTC/USDT")
+    reconciler = main.PositionReconciler()
+    reconciler.check()  # e.g. fetched while the position was being opened
+    real.positions = [position("BTC/USDT")]
+    assert reconciler.check()["repaired"] == [] and len(main.open_trades) == 1
+
+
+def test_untracked_position_is_adopted_for_the_owner(real, monkeypatch):
+    monkeypatch.setattr(main, "RECONCILE_ADOPT", True)
+    real.positions = [position("SOL/USDT", side="short", contracts=2.0, entry=150.0, leverage=5)]
+    report = main.PositionReconciler().check(confirmations=1)
+    (trade,) = list(main.open_trades)
+    assert report["repaired"] == [f"{trade['id']}: untracked short position on SOL/USDT:USDT adopted"]
+    assert (trade["symbol"], trade["direction"], trade["amount_base"], trade["leverage"]) == ("SOL/USDT", "SHORT", 2.0, 5)
+    assert trade["invest"] == 60.0 and trade["real"] and trade["tenant"] == "1"
+    # monitor-only: far past its computed SL, the client never closes it
+    assert len(main.trade_snapshot.columns()) == 0
+    assert main.open_trades.triggered("SOL/USDT", 1000.0) == []
+    real.positions = []
+    main.PositionReconciler().check(confirmations=1)
+    assert main.closed_trades[0]["close_reason"] == "Closed on exchange"
+
+
+def test_untracked_position_is_only_reported_by_default(real):
+    real.positions = [position("SOL/USDT")]
+    report = main.PositionReconciler().check(confirmations=1)
+    assert report["warnings"] == ["SOL/USDT:USDT long: position of 1.0 is not tracked"] and len(main.open_trades) == 0
+
+
+def test_size_mismatch_is_reported(real):
+    book_real("BTC/USDT", amount=1.0)
+    book_real("ETH/USDT", amount=1.0)
+    real.positions = [position("BTC/USDT", contracts=0.5), position("ETH/USDT", contracts=1.0)]
+    report = main.PositionReconciler().check(confirmations=1)
+    assert report["warnings"] == ["BTC/USDT:USDT long: exchange holds 0.5, trades account for 1.0"]
+    assert report["repaired"] == []
+
+
+def test_market_with_open_order_in_flight_is_skipped(real, monkeypatch):
+    monkeypatch.setattr(main, "_pending_opens", {("1", "BTC/USDT", "1m")})
+    real.positions = [position("BTC/USDT")]
+    assert main.PositionReconciler().check(confirmations=1)["repaired"] == []
+    assert len(main.open_trades) == 0
@@ -0,0 +1,80 @@
+import time
+
+import numpy as np
+import pytest
+
+import main
+
+MINUTE = 60_000
+
+
+class FakeMarket:
+    """
+    Serves 1m candles ending at the current (forming) minute and aggregates them for
+    higher timeframes, like the exchange does.
+    """
+    def __init__(self, minutes=2000, seed=3):
+        rng = np.random.default_rng(seed)
+        now = int(time.time() * 1000) // MINUTE * MINUTE
+        closes = 100 + np.cumsum(rng.normal(0, 0.2, minutes))
+        self.base = []
+        for i, c in enumerate(closes):
+            o = closes[i - 1] if i else c
+            self.base.append([now - (minutes - 1 - i) * MINUTE, o, max(o, c) + 0.1, min(o, c) - 0.1, c, float(rng.integers(1, 50))])
+        self.calls = []
+
+    def fetch(self, symbol, timeframe="1m", limit=300, since=None):
+        self.calls.append(timeframe)
+        rows = main.resample_rows(self.base, main.timeframe_ms(timeframe))
+        if since is not None:
+            return [list(r) for r in rows if r[0] >= since][:limit]
+        return [list(r) for r in rows[-limit:]]
+
+
+@pytest.fixture
+def market(monkeypatch, tmp_path):
+    m = FakeMarket()
+    monkeypatch.setattr(main, "fetch_ohlcv_raw", m.fetch)
+    monkeypatch.setattr(main, "history_store", main.OHLCVStore(str(tmp_path / "history")))
+    monkeypatch.setattr(main, "RESAMPLE_FROM_BASE", True)
+    return m
+
+
+def test_resample_rows_matches_aggregation():
+    rows = [[i * MINUTE, 1.0 + i, 2.0 + i, 0.5 + i, 1.5 + i, 1.0] for i in range(7)]
+    out = main.resample_rows(rows, 5 * MINUTE)
+    assert out[0] == [0, 1.0, 6.0, 0.5, 5.5, 5.0]
+    # the trailing bucket is partial, like a forming candle
+    assert out[1] == [5 * MINUTE, 6.0, 8.0, 5.5, 7.5, 2.0]
+
+
+def test_higher_timeframes_derived_from_one_base_fetch(market):
+    cache = main.CandleCache()
+    cache.update_many("BTC/USDT", ["1m", "5m", "15m"])  # bootstraps every timeframe once
+    market.base.append([market.base[-1][0] + MINUTE, 100.0, 101.0, 99.0, 100.5, 7.0])
+    market.calls.clear()
+    rows = cache.update_many("BTC/USDT", ["1m", "5m", "15m"])
+    assert market.calls == ["1m"]
+    for tf in ("5m", "15m"):
+        expected = market.fetch("BTC/USDT", tf, limit=50)
+        assert rows[tf][-50:] == expected
+    assert cache.stats["resampled"] == 2
+
+
+def test_verify_flags_and_repairs_diverging_candles(market):
+    cache = main.CandleCache()
+    cache.update_many("BTC/USDT", ["1m", "5m"])
+    assert cache.verify("BTC/USDT", "5m") == 0
+    cache.rows[("BTC/USDT", "5m")][-3][4] += 1.0
+    assert cache.verify("BTC/USDT", "5m") == 1
+    assert cache.verify("BTC/USDT", "5m") == 0
+    assert cache.stats["verify_mismatches"] == 1
+
+
+def test_direct_mode_fetches_each_timeframe(market, monkeypatch):
+    monkeypatch.setattr(main, "RESAMPLE_FROM_BASE", False)
+    cache = main.CandleCache()
+    cache.update_many("BTC/USDT", ["1m", "5m"])
+    market.calls.clear()
+    cache.update_many("BTC/USDT", ["1m", "5m"])
+    assert market.calls == ["1m", "5m"]
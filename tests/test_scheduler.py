@@ -0,0 +1,48 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def active(tmp_path, monkeypatch):
+    registry = main.TenantRegistry(path=str(tmp_path / "tenants.json"))
+    registry.tenants[""] = main.Tenant(None, symbols=["BTC/USDT"], active_tf=["1m", "5m", "15m"])
+    monkeypatch.setattr(main, "tenants", registry)
+
+
+def test_plan_groups_timeframes_closing_together(active):
+    sched = main.CandleScheduler(delay=2.0)
+    # 00:14:30 -> the next close (00:15) is shared by all three timeframes
+    now = 14 * 60 + 30
+    plan = sched.plan(now)
+    assert plan[0] == (15 * 60 + 2.0, ["1m", "5m", "15m"])
+    assert len(plan) == 1
+    assert sched.seconds_until_next(now) == pytest.approx(32.0)
+
+
+def test_due_runs_each_close_once(active):
+    sched = main.CandleScheduler(delay=2.0)
+    sched.plan(60 * 60 + 10)
+    assert sched.due(60 * 60 + 61) == []
+    assert sched.due(60 * 60 + 62) == ["1m"]
+    assert sched.due(60 * 60 + 63) == []
+    # 01:05 closes 1m and 5m together
+    assert sched.due(65 * 60 + 2) == ["1m", "5m"]
+
+
+def test_overrun_folds_missed_closes(active):
+    sched = main.CandleScheduler(delay=2.0)
+    sched.plan(0.5)
+    # a slow cycle kept the loop busy past three 1m closes
+    assert sched.due(3 * 60 + 30) == ["1m"]
+    assert sched.plan(3 * 60 + 30)[0] == (4 * 60 + 2.0, ["1m"])
+
+
+def test_check_signals_once_scans_only_due_timeframes(active, monkeypatch):
+    scanned = []
+    monkeypatch.setattr(main.symbol_resolver, "resolve", lambda symbol: symbol)
+    monkeypatch.setattr(main, "analyze_pair", lambda symbol, tfs, queue: scanned.extend(tfs) or ([(tf, {}) for tf in tfs], 0.0))
+    monkeypatch.setattr(main, "evaluate_signal", lambda symbol, tf, snap: None)
+    stats = main.check_signals_once(["1m", "5m"])
+    assert sorted(scanned) == ["1m", "5m"]
+    assert stats["timeframes"] == ["1m", "5m"]
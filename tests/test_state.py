@@ -0,0 +1,57 @@
+import threading
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def state(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "TG_CHAT_ID", None)
+    registry = main.TenantRegistry(path=str(tmp_path / "tenants.json"))
+    registry.owner().balance = {"currency": "USDT", "total": 1e6, "available": 1e6}
+    monkeypatch.setattr(main, "tenants", registry)
+    monkeypatch.setattr(main, "journal", main.TradeJournal(path=str(tmp_path / "trades_journal.jsonl")))
+    monkeypatch.setattr(main, "open_trades", main.TradeBook())
+    monkeypatch.setattr(main, "closed_trades", [])
+    monkeypatch.setattr(main, "trade_snapshot", main.TradeSnapshot())
+
+
+def test_snapshot_is_not_affected_by_later_changes(state):
+    trade = main.open_trade("BTC/USDT", "LONG", 100.0, "1m")
+    before = main.trade_snapshot
+    main.close_trade(trade, 104.0, "Hit TP")
+    assert [t["id"] for t in before.open_list()] == [trade["id"]]
+    assert before.open_list()[0]["status"] == "OPEN"
+    assert before.closed_list() == []
+    after = main.trade_snapshot
+    assert after.open_list() == []
+    assert [t["close_reason"] for t in after.closed_list(last=50)] == ["Hit TP"]
+
+
+def test_concurrent_signals_open_a_pair_once(state, monkeypatch):
+    snap = {"bars": main.SMA200, "price": 100.0, "rsi": 20.0, "sma50": 95.0, "sma200": 90.0,
+            "support": 80.0, "resistance": 120.0}
+    monkeypatch.setattr(main, "size_from_usd", lambda *args: 1.0)
+    start = threading.Barrier(8)
+
+    def signal():
+        start.wait()
+        main.evaluate_signal("BTC/USDT", "1m", snap)
+
+    threads = [threading.Thread(target=signal) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(main.open_trades) == 1
+    assert main.trade_snapshot.open_count == 1
+
+
+def test_journal_writes_events_in_order_off_thread(state, tmp_path):
+    for i in range(200):
+        main.journal.append("open", {"id": f"T{i}", "symbol": "BTC/USDT"})
+    assert main.journal.flush(timeout=5)
+    with open(main.journal.path, encoding="utf-8") as f:
+        ids = [line.split('"id": "')[1].split('"')[0] for line in f]
+    assert ids == [f"T{i}" for i in range(200)]
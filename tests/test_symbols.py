@@ -0,0 +1,88 @@
+import pytest
+
+import main
+
+
+class FakeExchange:
+    def __init__(self):
+        self.markets = {
+            "BTC/USDT:USDT": {"symbol": "BTC/USDT:USDT", "id": "BTCUSDT", "base": "BTC", "quote": "USDT",
+                              "type": "swap", "linear": True, "active": True},
+            "BTC/USD:BTC": {"symbol": "BTC/USD:BTC", "id": "BTCUSD", "base": "BTC", "quote": "USD",
+                            "type": "swap", "linear": False, "active": True},
+            "ETH/USDT": {"symbol": "ETH/USDT", "id": "ETHUSDT_SPBL", "base": "ETH", "quote": "USDT",
+                         "type": "spot", "active": True},
+        }
+        self.calls = []
+
+    def fetch_ohlcv(self, symbol, timeframe="1m", since=None, limit=300):
+        self.calls.append(symbol)
+        return [[0, 1.0, 1.0, 1.0, 1.0, 1.0]]
+
+
+@pytest.fixture
+def exchange(monkeypatch):
+    ex = FakeExchange()
+    monkeypatch.setattr(main, "get_public_exchange", lambda: ex)
+    monkeypatch.setattr(main, "symbol_resolver", main.SymbolResolver())
+    return ex
+
+
+@pytest.mark.parametrize("text", ["BTC/USDT", "BTCUSDT", "btc-usdt", "BTC/USDT:USDT"])
+def test_resolves_user_spellings_to_swap_market(exchange, text):
+    assert main.symbol_resolver.resolve(text) == "BTC/USDT:USDT"
+    assert main.symbol_resolver.display_name(text) == "BTC/USDT"
+
+
+def test_unlisted_symbol_is_cached_as_missing(exchange):
+    assert main.symbol_resolver.resolve("MATIC/USDT") is None
+    # spot-only listings do not count either
+    assert main.symbol_resolver.resolve("ETH/USDT") is None
+    with pytest.raises(ValueError):
+        main.fetch_ohlcv_raw("MATIC/USDT", "1m")
+    assert exchange.calls == []
+
+
+def test_fetch_uses_resolved_symbol_in_one_request(exchange):
+    main.fetch_ohlcv_raw("BTC/USDT", "1m", limit=1)
+    main.fetch_ohlcv_raw("BTC/USDT", "1m", limit=1)
+    assert exchange.calls == ["BTC/USDT:USDT", "BTC/USDT:USDT"]
+
+
+class CatalogClient:
+    def __init__(self):
+        self.downloads = 0
+        self.markets = self.currencies = None
+
+    def load_markets(self):
+        self.downloads += 1
+        self.markets, self.currencies = {"BTC/USDT:USDT": {"id": "BTCUSDT"}}, {"USDT": {}}
+
+    def set_markets(self, markets, currencies=None):
+        self.markets, self.currencies = markets, currencies
+
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "MARKETS_CACHE_FILE", str(tmp_path / "markets_cache.json"))
+    monkeypatch.setattr(main, "_markets", None)
+    return main.MARKETS_CACHE_FILE
+
+
+def test_fresh_disk_catalog_needs_no_download(catalog):
+    main.save_json(catalog, {"saved_at": main.time.time() - 60, "markets": {"ETH/USDT:USDT": {}}, "currencies": {}})
+    public, private = CatalogClient(), CatalogClient()
+    main.load_market_metadata(public)
+    main.load_market_metadata(private)
+    assert public.downloads == private.downloads == 0
+    assert public.markets == private.markets == {"ETH/USDT:USDT": {}}
+
+
+def test_expired_catalog_is_downloaded_once_for_both_clients(catalog):
+    main.save_json(catalog, {"saved_at": main.time.time() - main.MARKETS_CACHE_TTL - 1, "markets": {}, "currencies": {}})
+    public, private = CatalogClient(), CatalogClient()
+    main.load_market_metadata(public)
+    main.load_market_metadata(private)
+    assert (public.downloads, private.downloads) == (1, 0)
+    assert private.markets == public.markets == {"BTC/USDT:USDT": {"id": "BTCUSDT"}}
+    assert main.load_json(catalog, None)["markets"] == public.markets
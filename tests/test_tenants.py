@@ -0,0 +1,75 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "TG_CHAT_ID", "1")
+    monkeypatch.setattr(main, "tg_send", lambda chat, text: None)
+    registry = main.TenantRegistry(path=str(tmp_path / "tenants.json"))
+    monkeypatch.setattr(main, "tenants", registry)
+    monkeypatch.setattr(main, "journal", main.TradeJournal(path=str(tmp_path / "trades_journal.jsonl")))
+    monkeypatch.setattr(main, "open_trades", main.TradeBook())
+    monkeypatch.setattr(main, "closed_trades", [])
+    monkeypatch.setattr(main, "trade_snapshot", main.TradeSnapshot())
+    return registry
+
+
+def signal_snap(price=100.0):
+    # RSI < 30 above SMA200: the first LONG rule fires
+    return {"bars": main.SMA200, "price": price, "rsi": 20.0, "sma50": 90.0, "sma200": 90.0,
+            "support": 50.0, "resistance": 200.0}
+
+
+def test_shared_pair_is_scanned_once_and_traded_per_tenant(registry):
+    owner = registry.owner()
+    owner.symbols, owner.active_tf = ["BTC/USDT"], ["1m", "5m"]
+    guest = registry.get(2, create=True)
+    guest.symbols, guest.active_tf, guest.invest_amount = ["BTC/USDT", "ETH/USDT"], ["1m"], 50.0
+    registry.changed()
+
+    assert registry.pairs() == [("BTC/USDT", "1m"), ("BTC/USDT", "5m"), ("ETH/USDT", "1m")]
+    assert registry.active_timeframes() == ["1m", "5m"]
+
+    main.evaluate_signal("BTC/USDT", "1m", signal_snap())
+    main.evaluate_signal("BTC/USDT", "1m", signal_snap())  # already open for both
+    trades = main.trade_snapshot.open_list()
+    assert sorted(t["tenant"] for t in trades) == ["1", "2"]
+    assert owner.balance["available"] == 1000.0 - owner.invest_amount
+    assert guest.balance["available"] == 950.0
+
+    guest_trade = next(t for t in trades if t["tenant"] == "2")
+    main.close_trade(main.open_trades.get(guest_trade["id"]), 110.0, "Hit TP")
+    assert guest.balance["available"] > 1000.0
+    assert owner.balance["available"] == 1000.0 - owner.invest_amount
+    assert [t["tenant"] for t in main.trade_snapshot.closed_list(tenant="2")] == ["2"]
+    assert main.trade_snapshot.closed_list(tenant="1") == []
+
+
+def test_only_the_owner_trades_for_real(registry, monkeypatch):
+    guest = registry.get(2, create=True)
+    guest.trade_mode = "real"  # e.g. edited by hand in tenants.json
+    guest.symbols, guest.active_tf = ["BTC/USDT"], ["1m"]
+    registry.owner().symbols = []
+    registry.changed()
+    monkeypatch.setattr(main, "get_private_exchange", lambda: pytest.fail("guest reached the exchange"))
+    main.evaluate_signal("BTC/USDT", "1m", signal_snap())
+    assert [t["real"] for t in main.trade_snapshot.open_list()] == [False]
+
+
+def test_legacy_settings_migrate_to_the_owner(registry, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "SETTINGS_FILE", str(tmp_path / "settings.json"))
+    monkeypatch.setattr(main, "VIRTUAL_BALANCE_FILE", str(tmp_path / "virtual_balance.json"))
+    main.save_json(main.SETTINGS_FILE, {"SYMBOLS": ["SOL/USDT"], "ACTIVE_TF": ["1h"], "INVEST_AMOUNT": 5, "LEVERAGE": 3})
+    main.save_json(main.VIRTUAL_BALANCE_FILE, {"currency": "USDT", "total": 700.0, "available": 650.0})
+    registry.load()
+    owner = registry.owner()
+    assert (owner.symbols, owner.active_tf, owner.invest_amount, owner.leverage) == (["SOL/USDT"], ["1h"], 5.0, 3)
+    assert owner.balance["available"] == 650.0
+
+    registry.save()
+    assert main.journal.flush(timeout=5)
+    reloaded = main.TenantRegistry(path=registry.path)
+    reloaded.load()
+    assert reloaded.owner().to_dict() == owner.to_dict()
@@ -0,0 +1,62 @@
+import pytest
+
+import main
+
+
+class FakeExchange:
+    def __init__(self, bulk_fails=False):
+        self.markets = {
+            f"{base}/USDT:USDT": {"symbol": f"{base}/USDT:USDT", "id": f"{base}USDT", "base": base, "quote": "USDT",
+                                  "type": "swap", "linear": True, "active": True}
+            for base in ("BTC", "ETH", "SOL")
+        }
+        self.bulk_fails = bulk_fails
+        self.calls = []
+
+    def fetch_tickers(self, symbols):
+        self.calls.append(("fetch_tickers", tuple(symbols)))
+        if self.bulk_fails:
+            raise RuntimeError("bulk endpoint down")
+        return {s: {"symbol": s, "last": 100.0 + i} for i, s in enumerate(symbols)}
+
+    def fetch_ticker(self, symbol):
+        self.calls.append(("fetch_ticker", symbol))
+        return {"symbol": symbol, "last": 42.0}
+
+
+@pytest.fixture
+def exchange(monkeypatch):
+    ex = FakeExchange()
+    monkeypatch.setattr(main, "get_public_exchange", lambda: ex)
+    monkeypatch.setattr(main, "symbol_resolver", main.SymbolResolver())
+    return ex
+
+
+def test_one_bulk_request_for_all_symbols_then_cached(exchange):
+    snap = main.TickerSnapshot(ttl=60)
+    prices = snap.get(["BTC/USDT", "ETH/USDT", "SOL/USDT"])
+    assert prices == {"BTC/USDT": 100.0, "ETH/USDT": 101.0, "SOL/USDT": 102.0}
+    assert snap.get(["BTC/USDT", "SOL/USDT"]) == {"BTC/USDT": 100.0, "SOL/USDT": 102.0}
+    assert len(exchange.calls) == 1
+
+
+def test_scanner_prices_spare_the_request(exchange):
+    snap = main.TickerSnapshot(ttl=60)
+    snap.offer("BTC/USDT", 123.0)
+    assert snap.get(["BTC/USDT"]) == {"BTC/USDT": 123.0}
+    assert exchange.calls == []
+
+
+def test_falls_back_to_single_tickers(exchange):
+    exchange.bulk_fails = True
+    snap = main.TickerSnapshot(ttl=60)
+    assert snap.get(["BTC/USDT", "ETH/USDT"]) == {"BTC/USDT": 42.0, "ETH/USDT": 42.0}
+    assert [c[0] for c in exchange.calls] == ["fetch_tickers", "fetch_ticker", "fetch_ticker"]
+
+
+def test_monitor_prices_independent_of_trade_count(exchange, monkeypatch):
+    monkeypatch.setattr(main, "ticker_snapshot", main.TickerSnapshot(ttl=60))
+    monkeypatch.setattr(main, "price_feed", main.PriceFeed())
+    prices = main.current_prices_for(["BTC/USDT", "ETH/USDT"])
+    assert set(prices) == {"BTC/USDT", "ETH/USDT"}
+    assert len(exchange.calls) == 1
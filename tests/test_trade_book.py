@@ -0,0 +1,77 @@
+import random
+
+import main
+
+
+def make_trade(tid, symbol, direction, entry, timeframe="1m"):
+    sl = entry * (0.98 if direction == "LONG" else 1.02)
+    tp = entry * (1.04 if direction == "LONG" else 0.96)
+    return {"id": tid, "symbol": symbol, "direction": direction, "timeframe": timeframe,
+            "entry_price": entry, "sl_price": sl, "tp_price": tp}
+
+
+def exit_reason(trade, price):
+    if trade["direction"] == "LONG":
+        if price <= trade["sl_price"]:
+            return "Hit SL"
+        if price >= trade["tp_price"]:
+            return "Hit TP"
+    else:
+        if price >= trade["sl_price"]:
+            return "Hit SL"
+        if price <= trade["tp_price"]:
+            return "Hit TP"
+    return None
+
+
+def test_triggered_matches_per_trade_check():
+    rnd = random.Random(2)
+    book = main.TradeBook()
+    trades = [make_trade(str(i), rnd.choice("AB"), rnd.choice(["LONG", "SHORT"]), rnd.uniform(90, 110))
+              for i in range(400)]
+    for t in trades:
+        book.add(t)
+    for t in trades[::3]:
+        book.remove(t["id"])
+    live = [t for t in trades if t["id"] in book]
+    for _ in range(200):
+        symbol, price = rnd.choice("AB"), rnd.uniform(85, 115)
+        got = {t["id"]: reason for t, reason in book.triggered(symbol, price)}
+        expected = {t["id"]: exit_reason(t, price) for t in live if t["symbol"] == symbol and exit_reason(t, price)}
+        assert got == expected
+
+
+def test_indexes_by_pair_and_symbol():
+    book = main.TradeBook([make_trade("a", "BTC/USDT", "LONG", 100.0, "1m"),
+                           make_trade("b", "BTC/USDT", "SHORT", 100.0, "5m")])
+    assert book.has_pair("BTC/USDT", "1m")
+    assert not book.has_pair("BTC/USDT", "15m")
+    assert {t["id"] for t in book.for_symbol("BTC/USDT")} == {"a", "b"}
+    book.remove("a")
+    assert not book.has_pair("BTC/USDT", "1m")
+    assert [t["id"] for t in book] == ["b"]
+
+
+def test_re_adding_an_id_replaces_its_levels():
+    book = main.TradeBook()
+    book.add(make_trade("dup", "BTC/USDT", "LONG", 100.0))
+    book.add(make_trade("dup", "BTC/USDT", "LONG", 200.0))
+    book.add(make_trade("other", "BTC/USDT", "LONG", 100.0))
+    book.remove("dup")
+    # only "other" is left; the first "dup" must not linger in the level index
+    assert [(t["id"], r) for t, r in book.triggered("BTC/USDT", 50.0)] == [("other", "Hit SL")]
+
+
+def test_trigger_columns_match_per_trade_check():
+    rnd = random.Random(5)
+    symbols = [f"S{i}" for i in range(20)]
+    trades = [make_trade(str(i), rnd.choice(symbols), rnd.choice(["LONG", "SHORT"]), rnd.uniform(90, 110))
+              for i in range(2000)]
+    columns = main.TriggerColumns(trades)
+    for _ in range(50):
+        prices = {s: rnd.uniform(85, 115) for s in symbols if rnd.random() < 0.8}
+        got = {tid: (symbol, reason) for tid, symbol, reason, _ in columns.triggered(prices)}
+        expected = {t["id"]: (t["symbol"], exit_reason(t, prices[t["symbol"]])) for t in trades
+                    if t["symbol"] in prices and exit_reason(t, prices[t["symbol"]])}
+        assert got == expected
+    assert main.TriggerColumns([]).triggered({"S0": 1.0}) == []